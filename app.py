@@ -36,15 +36,16 @@ from src.wms_layers import WMSLayers
 from esdl.esdl_handler import EnergySystemHandler
 from esdl.processing import ESDLGeometry, ESDLAsset, ESDLEcore, ESDLQuantityAndUnits, ESDLEnergySystem
 from esdl.processing.EcoreDocumentation import EcoreDocumentation
-from src.esdl_helper import energy_asset_to_ui, update_carrier_conn_list
+from src.esdl_helper import energy_asset_to_ui, update_carrier_conn_list, send_connection_updates, create_load_callbacks
 from esdl import esdl
-from src.process_es_area_bld import process_energy_system, get_building_information
+from src.process_es_area_bld import process_energy_system, get_building_information, create_area_info_geojson, \
+    emit_area_geojson, process_viewport
 from extensions.heatnetwork import HeatNetwork
 from extensions.ibis import IBISBedrijventerreinen
 from extensions.bag import BAG
 from extensions.boundary_service import BoundaryService
 from extensions.esdl_browser import ESDLBrowser
-from extensions.session_manager import set_handler, get_handler, get_session, set_session, del_session, schedule_session_clean_up, valid_session, get_session_for_esid, set_session_for_esid
+from extensions.session_manager import set_handler, get_handler, get_session, set_session, del_session, schedule_session_clean_up, init_session_backend, valid_session, get_session_for_esid, get_session_lock, with_session_lock
 import src.esdl_config as esdl_config
 from src.esdl_helper import get_asset_from_port_id, get_asset_and_coord_from_port_id, generate_profile_info, get_port_profile_info
 from utils.datetime_utils import parse_date
@@ -62,6 +63,9 @@ from extensions.vesta import Vesta
 from extensions.workflow import Workflow
 from src.log import get_logger
 from extensions.esdl_drive import ESDLDrive
+from extensions.job_manager import JobManager
+from src.vector_tiles import VectorTileCache
+import src.timeseries as timeseries
 from extensions.es_statistics import ESStatisticsService
 from extensions.shapefile_converter import ShapefileConverter
 from extensions.essim_sensitivity import ESSIMSensitivity
@@ -125,8 +129,11 @@ get_logger('engineio').setLevel(logging.WARNING)  # don't print all the messages
 # fix sessions with socket.io. see: https://blog.miguelgrinberg.com/post/flask-socketio-and-the-user-session
 Session(app)
 executor = Executor(app)
+job_manager = JobManager(app, socketio, executor)
+vector_tile_cache = VectorTileCache(settings.VECTOR_TILE_CACHE_MEMORY_MB * 1024 * 1024)
 
 #extensions
+init_session_backend(app)
 schedule_session_clean_up()
 HeatNetwork(app, socketio)
 IBISBedrijventerreinen(app, socketio)
@@ -362,8 +369,6 @@ def download_esdl():
     active_es_id = get_session('active_es_id')
 
     try:
-        #stream = esh.to_bytesio()
-        content = esh.to_string(es_id=active_es_id)
         my_es = esh.get_energy_system(es_id=active_es_id)
         try:
             name = my_es.name
@@ -377,12 +382,15 @@ def download_esdl():
         user_email = get_session('user-email')
         user_actions_logging.store_logging(user_email, "download esdl", name, "", "", {})
 
-        #wrapped_io = FileWrapper(stream)
-        #logger.debug(content)
         headers = dict()
         #headers['Content-Type'] =  'application/esdl+xml'
         headers['Content-Disposition'] = 'attachment; filename="{}"'.format(name)
-        headers['Content-Length'] = len(content)
+        # stream the XML while it is serialized, compressed if the browser supports it
+        gzip_level = None
+        if 'gzip' in request.headers.get('Accept-Encoding', ''):
+            headers['Content-Encoding'] = 'gzip'
+            gzip_level = 4
+        content = esh.to_chunks(es_id=active_es_id, gzip_level=gzip_level)
         return Response(content, mimetype='application/esdl+xml', direct_passthrough=True, headers=headers)
         #return send_file(stream, as_attachment=True, mimetype='application/esdl+xml', attachment_filename=name)
     except Exception as e:
@@ -391,6 +399,24 @@ def download_esdl():
         return "Error sending ESDL file, due to {}".format(e)
 
 
+@app.route('/tiles/<es_id>/<int:z>/<int:x>/<int:y>.mvt')
+@with_session_lock
+def get_vector_tile(es_id, z, x, y):
+    """Sends a Mapbox Vector Tile with the assets, conductors, connections and areas of an energy system"""
+    esh = get_handler()
+    if esh.get_energy_system(es_id=es_id) is None or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        abort(404)
+    tile = vector_tile_cache.get_tile(esh, es_id, get_session_for_esid(es_id, 'conn_list'), z, x, y)
+    # tiles change when the energy system is edited
+    return Response(tile, mimetype='application/vnd.mapbox-vector-tile', headers={'Cache-Control': 'no-cache'})
+
+
+@app.route('/timeseries/metrics')
+def timeseries_metrics():
+    """Query metrics of the InfluxDB time series databases per host and database"""
+    return jsonify(timeseries.get_metrics()), 200
+
+
 @app.route('/<path:path>')
 def serve_static(path):
     # logger.debug('in serve_static(): '+ path)
@@ -575,11 +601,13 @@ def send_alert(message):
 
 
 # FIXME: pyecore
-def _set_carrier_for_connected_transport_assets(asset_id, carrier_id, processed_assets):
+def _set_carrier_for_connected_transport_assets(asset_id, carrier_id, processed_assets, job=None):
     active_es_id = get_session('active_es_id')
     esh = get_handler()
     asset = esh.get_by_id(active_es_id, asset_id)
     processed_assets.append(asset_id)
+    if job:
+        job.progress(len(processed_assets), message='{} assets processed'.format(len(processed_assets)))
     for p in asset.port:
         p.carrier = esh.get_by_id(active_es_id, carrier_id) #FIXME pyecore
         conn_to = p.connectedTo
@@ -589,16 +617,16 @@ def _set_carrier_for_connected_transport_assets(asset_id, carrier_id, processed_
                 if isinstance(conn_asset, esdl.Transport) and not isinstance(conn_asset, esdl.HeatExchange) \
                         and not isinstance(conn_asset, esdl.Transformer):
                     if conn_asset.id not in processed_assets:
-                        _set_carrier_for_connected_transport_assets(conn_asset.id, carrier_id, processed_assets)
+                        _set_carrier_for_connected_transport_assets(conn_asset.id, carrier_id, processed_assets, job)
                 else:
                     for conn_asset_port in conn_asset.port:
                         if conn_asset_port.id == conn_port.id:
                             conn_asset_port.carrier = p.carrier
 
 
-def set_carrier_for_connected_transport_assets(asset_id, carrier_id):
+def set_carrier_for_connected_transport_assets(asset_id, carrier_id, job=None):
     processed_assets = []  # List of asset_id's that are processed
-    _set_carrier_for_connected_transport_assets(asset_id, carrier_id, processed_assets)
+    _set_carrier_for_connected_transport_assets(asset_id, carrier_id, processed_assets, job)
     # logger.debug(processed_assets)
 
 
@@ -738,49 +766,47 @@ def remove_ab_from_area_bld_list(ab_id, ab_list):
 def update_asset_connection_locations(ass_id, lat, lon):
     active_es_id = get_session('active_es_id')
     conn_list = get_session_for_esid(active_es_id, 'conn_list')
-    for c in conn_list:
+    changed_conn_list = conn_list.get_connections_for_asset(ass_id)
+    for c in changed_conn_list:
         if c['from-asset-id'] == ass_id:
-            c['from-asset-coord'] = (lat, lon)
+            conn_list.update_connection(c, {'from-asset-coord': (lat, lon)})
         if c['to-asset-id'] == ass_id:
-            c['to-asset-coord'] = (lat, lon)
+            conn_list.update_connection(c, {'to-asset-coord': (lat, lon)})
 
-    emit('clear_connections')   # clear current active layer connections
-    emit('add_connections', {'es_id': active_es_id, 'conn_list': conn_list})
+    send_connection_updates(active_es_id, changed_conn_list)
 
 
 def update_transport_connection_locations(ass_id, asset, coords):
     active_es_id = get_session('active_es_id')
     esh = get_handler()
     conn_list = get_session_for_esid(active_es_id, 'conn_list')
+    changed_conn_list = conn_list.get_connections_for_asset(ass_id)
 
     # logger.debug('Updating locations')
-    for c in conn_list:
+    for c in changed_conn_list:
         if c['from-asset-id'] == ass_id:
             port_id = c['from-port-id']
             port_ass_map = get_asset_and_coord_from_port_id(esh, active_es_id, port_id)
-            c['from-asset-coord'] = port_ass_map['coord']
+            conn_list.update_connection(c, {'from-asset-coord': port_ass_map['coord']})
         if c['to-asset-id'] == ass_id:
             port_id = c['to-port-id']
             port_ass_map = get_asset_and_coord_from_port_id(esh, active_es_id, port_id)
-            c['to-asset-coord'] = port_ass_map['coord']
+            conn_list.update_connection(c, {'to-asset-coord': port_ass_map['coord']})
 
-    emit('clear_connections')   # clear current active layer connections
-    emit('add_connections', {'es_id': active_es_id, 'conn_list': conn_list})
+    send_connection_updates(active_es_id, changed_conn_list)
 
 
 def update_polygon_asset_connection_locations(ass_id, coords):
     active_es_id = get_session('active_es_id')
     conn_list = get_session_for_esid(active_es_id, 'conn_list')
-    for c in conn_list:
+    changed_conn_list = conn_list.get_connections_for_asset(ass_id)
+    for c in changed_conn_list:
         if c['from-asset-id'] == ass_id:
-            c['from-asset-coord'] = coords
+            conn_list.update_connection(c, {'from-asset-coord': coords})
         if c['to-asset-id'] == ass_id:
-            c['to-asset-coord'] = coords
-
-    emit('clear_connections')   # clear current active layer connections
-    emit('add_connections', {'es_id': active_es_id, 'conn_list': conn_list})
+            conn_list.update_connection(c, {'to-asset-coord': coords})
 
-    set_session_for_esid(active_es_id, 'conn_list', conn_list)
+    send_connection_updates(active_es_id, changed_conn_list)
 
 
 # ---------------------------------------------------------------------------------------------------------------------
@@ -961,15 +987,18 @@ def split_conductor(conductor, location, mode, conductor_container):
         esdl_assets_to_be_added.append(['line', 'asset', new_cond2.name, new_cond2.id, type(new_cond2).__name__, coords2, port_list])
 
         # update asset id's of conductor with new_cond1 and new_cond2 in conn_list
-        for c in conn_list:
+        for c in conn_list.get_connections_for_asset(conductor_id):
+            changes = dict()
             if c['from-asset-id'] == conductor_id and c['from-port-id'] == port1.id:
-                c['from-asset-id'] = new_cond1_id
+                changes['from-asset-id'] = new_cond1_id
             if c['from-asset-id'] == conductor_id and c['from-port-id'] == port2.id:
-                c['from-asset-id'] = new_cond2_id
+                changes['from-asset-id'] = new_cond2_id
             if c['to-asset-id'] == conductor_id and c['to-port-id'] == port1.id:
-                c['to-asset-id'] = new_cond1_id
+                changes['to-asset-id'] = new_cond1_id
             if c['to-asset-id'] == conductor_id and c['to-port-id'] == port2.id:
-                c['to-asset-id'] = new_cond2_id
+                changes['to-asset-id'] = new_cond2_id
+            if changes:
+                conn_list.update_connection(c, changes)
 
         # create list of connections to be added to UI
         if mode == 'connect':
@@ -1018,7 +1047,7 @@ def split_conductor(conductor, location, mode, conductor_container):
         # now send new objects to UI
         emit('add_esdl_objects', {'es_id': active_es_id, 'asset_pot_list': esdl_assets_to_be_added, 'zoom': False})
         emit('clear_connections')   # clear current active layer connections
-        emit('add_connections', {'es_id': active_es_id, 'conn_list': conn_list})
+        emit('add_connections', {'es_id': active_es_id, 'conn_list': conn_list.to_list()})
     else:
         send_alert('UNSUPPORTED: Conductor is not of type esdl.Line!')
 
@@ -1027,6 +1056,7 @@ def split_conductor(conductor, location, mode, conductor_container):
 #  Update ESDL coordinates on movement of assets in browser
 # ---------------------------------------------------------------------------------------------------------------------
 @socketio.on('update-coord', namespace='/esdl')
+@with_session_lock
 def update_coordinates(message):
     # logger.debug("updating coordinates")
     # logger.debug('received: ' + str(message['id']) + ':' + str(message['lat']) + ',' + str(message['lng']) + ' - ' + str(message['asspot']))
@@ -1058,6 +1088,7 @@ def update_coordinates(message):
 
 
 @socketio.on('update-line-coord', namespace='/esdl')
+@with_session_lock
 def update_line_coordinates(message):
     # logger.debug ('received polyline: ' + str(message['id']) + ':' + str(message['polyline']))
     ass_id = message['id']
@@ -1085,6 +1116,7 @@ def update_line_coordinates(message):
 
 
 @socketio.on('update-polygon-coord', namespace='/esdl')
+@with_session_lock
 def update_polygon_coordinates(message):
     # logger.debug ('received polygon: ' + str(message['id']) + ':' + str(message['polygon']))
     ass_id = message['id']
@@ -1343,13 +1375,18 @@ def get_first_last_of_line(line):
 
 
 @executor.job
-def call_process_energy_system(esh, filename=None, es_title=None, app_context=None):
-    process_energy_system(esh, filename, es_title, app_context)
+def call_process_energy_system(esh, filename=None, es_title=None, app_context=None, force_update_es_id=None,
+                               incremental=True):
+    process_energy_system(esh, filename, es_title, app_context, force_update_es_id, incremental)
 
 
 # ---------------------------------------------------------------------------------------------------------------------
 #  React on commands from the browser (add, remove, ...)
 # ---------------------------------------------------------------------------------------------------------------------
+# Commands that can take long for large energy systems and are executed by the job_manager
+JOB_COMMANDS = ('split_conductor', 'get_table_editor_info', 'set_carrier', 'building_editor')
+
+
 @socketio.on('command', namespace='/esdl')
 def process_command(message):
     logger.info('received: ' + message['cmd'])
@@ -1362,6 +1399,16 @@ def process_command(message):
     user_email = get_session('user-email')
     user_actions_logging.store_logging(user_email, "command", message['cmd'], json.dumps(message), "", {})
 
+    # Heavy commands run as a job in a worker thread. When jobs of this session are queued or running, all commands
+    # are queued after them, such that the commands of a client are always executed in the order they were sent
+    if message['cmd'] in JOB_COMMANDS or job_manager.has_jobs():
+        job_manager.submit(message['cmd'], execute_command, message)
+    else:
+        with get_session_lock():
+            execute_command(message)
+
+
+def execute_command(message, job=None):
     active_es_id = get_session('active_es_id')
     if active_es_id is None:
         send_alert('Serious error: no active es id found. Please report')
@@ -1746,7 +1793,10 @@ def process_command(message):
 
         energy_assets = esh.get_all_instances_of_type(esdl.EnergyAsset, active_es_id)
 
-        for asset in energy_assets:
+        for i, asset in enumerate(energy_assets):
+            if job:
+                job.check_cancelled()
+                job.progress(i, len(energy_assets))
             attrs_sorted = ESDLEcore.get_asset_attributes(asset, esdl_doc)
             connected_to_info = get_connected_to_info(asset)
             strategy_info = get_control_strategy_info(asset)
@@ -2074,22 +2124,11 @@ def process_command(message):
         # refresh connections in gui
         active_es_id = get_session('active_es_id')
         conn_list = get_session_for_esid(active_es_id, 'conn_list')
-        new_list = []
-        #print(conn_list)
-        for conn in conn_list:
-            if (conn['from-port-id'] != from_port_id or conn['from-asset-id'] != from_asset_id or \
-                    conn['to-port-id'] != to_port_id or conn['to-asset-id'] != to_asset_id) and \
-                    (conn['from-port-id'] != to_port_id or conn['from-asset-id'] != to_asset_id or \
-                    conn['to-port-id'] != from_port_id or conn['to-asset-id'] != from_asset_id):
-                # Remove both directions from -> to and to -> from as we don't know how they are stored in the list
-                # does not matter, as a connection is unique
-                new_list.append(conn)  # add connections that we are not interested in
-            else:
-                print(' - removed {}'.format(conn))
-        set_session_for_esid(active_es_id, 'conn_list', new_list)  # set new connection list
-        # TODO: send es.id with this message?
-        emit('clear_connections')   # clear current active layer connections
-        emit('add_connections', {'es_id': active_es_id, 'conn_list': new_list})
+        # Remove both directions from -> to and to -> from as we don't know how they are stored in the list
+        # does not matter, as a connection is unique
+        for conn in conn_list.remove_connections_between_ports(from_port_id, to_port_id):
+            logger.debug('Removed connection {}'.format(conn))
+        emit('remove_single_connection', {'es_id': active_es_id, 'from-port-id': from_port_id, 'to-port-id': to_port_id})
 
     if message['cmd'] == 'set_carrier':
         asset_id = message['asset_id']
@@ -2100,7 +2139,7 @@ def process_command(message):
             asset = ESDLAsset.find_asset(area, asset_id)
             num_ports = len(asset.port)
             if isinstance(asset, esdl.Transport) or num_ports == 1:
-                set_carrier_for_connected_transport_assets(asset_id, carrier_id)
+                set_carrier_for_connected_transport_assets(asset_id, carrier_id, job)
             else:
                 send_alert("Error: Can only start setting carriers from transport assets or assets with only one port")
 
@@ -2200,12 +2239,12 @@ def process_command(message):
         conn_list = get_session_for_esid(es_edit.id, 'conn_list')
         for c in conn_list:
             if c['from-port-carrier'] == carrier_id:
-                c['from-port-carrier'] = None
+                conn_list.update_connection(c, {'from-port-carrier': None})
             if c['to-port-carrier'] == carrier_id:
-                c['to-port-carrier'] = None
+                conn_list.update_connection(c, {'to-port-carrier': None})
 
         emit('clear_connections')  # clear current active layer connections
-        emit('add_connections', {'es_id': es_edit.id, 'conn_list': conn_list})
+        emit('add_connections', {'es_id': es_edit.id, 'conn_list': conn_list.to_list()})
 
     if message['cmd'] == 'get_storage_strategy_info':
         asset_id = message['asset_id']
@@ -2390,7 +2429,7 @@ def process_command(message):
     if message['cmd'] == 'redraw_connections':
         conn_list = get_session_for_esid(active_es_id, 'conn_list')
         emit('clear_connections')  # clear current active layer connections
-        emit('add_connections', {'es_id': active_es_id, 'conn_list': conn_list})
+        emit('add_connections', {'es_id': active_es_id, 'conn_list': conn_list.to_list()})
 
         asset_list = get_session_for_esid(active_es_id, 'asset_list')
         emit('clear_ui', {'layer': 'assets'})  # clear current active layer assets
@@ -2433,6 +2472,10 @@ def process_command(message):
         remove_es_id = message['remove_es_id']
         esh.remove_energy_system(es_id=remove_es_id)
 
+    if settings.FLASK_DEBUG:
+        # verify the id index used by the find functions in ESDLAsset and ESDLEnergySystem against a full walk
+        esh.check_id_index(active_es_id)
+
     set_handler(esh)
     session.modified = True
 
@@ -2453,15 +2496,36 @@ def query_esdl_services(params):
 
 
 @socketio.on('set_active_es_id', namespace='/esdl')
+@with_session_lock
 def set_active_es_id(id):
     set_session('active_es_id', id)
     logger.debug("========================= Setting active es_id!!!  ============================")
 
 
+@socketio.on('get_area_boundaries', namespace='/esdl')
+@with_session_lock
+def get_area_boundaries(message):
+    # the client requests the area boundaries simplified for another zoom level of the map
+    active_es_id = get_session('active_es_id')
+    esh = get_handler()
+    area = esh.get_energy_system(es_id=active_es_id).instance[0].area
+    area_list, _, zoom_level = create_area_info_geojson(area, message['zoom'])
+    emit_area_geojson(area_list, zoom_level, replace=True)
+
+
+@socketio.on('get_viewport_objects', namespace='/esdl')
+@with_session_lock
+def get_viewport_objects(message):
+    # the client requests the objects of a large energy system that are located in its viewport
+    esh = get_handler()
+    process_viewport(esh, message['es_id'], message['bounds'], message['zoom'])
+
+
 # ---------------------------------------------------------------------------------------------------------------------
 #  React on commands from the browser (add, remove, ...)
 # ---------------------------------------------------------------------------------------------------------------------
 @socketio.on('file_command', namespace='/esdl')
+@with_session_lock
 def process_file_command(message):
     logger.info('received: ' + message['cmd'])
     es_info_list = get_session("es_info_list")
@@ -2493,7 +2557,9 @@ def process_file_command(message):
         esh = EnergySystemHandler()
 
         try:
-            result = esh.load_from_string(esdl_string=file_content, name=filename)
+            progress_callback, batch_callback = create_load_callbacks(filename)
+            result = esh.load_from_string(esdl_string=file_content, name=filename,
+                                          progress_callback=progress_callback, batch_callback=batch_callback)
         except Exception as e:
             send_alert("Error opening {}. Exception is: {}".format(filename, e))
             emit('clear_ui')
@@ -2696,6 +2762,7 @@ def get_carrier_color_dict():
 
 
 @socketio.on('initialize', namespace='/esdl')
+@with_session_lock
 def browser_initialize():
     user = get_session('user-email')
     role = get_session('user-role')
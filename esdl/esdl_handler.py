@@ -17,15 +17,27 @@ from pyecore.ecore import EEnum, EAttribute, EObject, EReference, EClass, EStruc
 from pyecore.valuecontainer import EAbstractSet
 from pyecore.utils import alias
 from pyecore.resources.resource import HttpURI
-from esdl.resources.xmlresource import XMLResource
+from pyecore.notification import EObserver, Kind
+from esdl.resources.xmlresource import XMLResource, XMLStreamingOptions
+from esdl.resources import snapshot
+from esdl.processing import ESDLGeometry
 from esdl import esdl
+from src.shape import Shape
+from shapely.geometry import Point as ShapelyPoint, box
+from shapely.geometry.base import BaseGeometry
+from shapely.strtree import STRtree
 from uuid import uuid4
 from io import BytesIO
+import itertools
+import weakref
 import src.log as log
 
 #logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = log.get_logger(__name__)
 
+# approximate memory used per ESDL object with an id, see EnergySystemHandler.estimate_memory_size()
+ESDL_OBJECT_MEMORY_SIZE = 4096
+
 
 class EnergySystemHandler:
 
@@ -35,6 +47,11 @@ class EnergySystemHandler:
         self.resource = None
         self.rset = ResourceSet()
         self.esid_uri_dict = {}
+        self.change_trackers = {}
+        self.port_indices = {}
+        self.spatial_indices = {}
+        self.model_analyses = {}
+        self.version_counters = {}
 
         self._set_resource_factories()
 
@@ -232,6 +249,11 @@ class EnergySystemHandler:
         """Resets the resourceset (e.g. when loading a new file)"""
         self.rset = ResourceSet()
         self.resource = None
+        self.stop_change_tracking()
+        self.remove_port_index()
+        self.remove_spatial_index()
+        self.model_analyses.clear()
+        self.remove_version_counter()
         self._set_resource_factories()
 
     def _set_resource_factories(self):
@@ -239,7 +261,23 @@ class EnergySystemHandler:
         self.rset.resource_factory['esdl'] = XMLResource
         self.rset.resource_factory['*'] = XMLResource
 
-    def load_file(self, uri_or_filename):
+    @staticmethod
+    def _load_options(progress_callback=None, batch_callback=None):
+        """
+        Options for loading a resource, see XMLStreamingOptions
+        :param progress_callback: function(bytes_read, total_bytes) called regularly while parsing
+        :param batch_callback: function(list of Areas and Buildings) called with batches of the Areas and Buildings
+        while parsing continues. Only their attributes are available, their contents are still being parsed.
+        """
+        options = dict()
+        if progress_callback is not None:
+            options[XMLStreamingOptions.PROGRESS_CALLBACK] = progress_callback
+        if batch_callback is not None:
+            options[XMLStreamingOptions.BATCH_CALLBACK] = batch_callback
+            options[XMLStreamingOptions.BATCH_TYPES] = (esdl.Area, esdl.AbstractBuilding)
+        return options
+
+    def load_file(self, uri_or_filename, progress_callback=None, batch_callback=None):
         """Loads a EnergySystem file or URI into a new resourceSet
         :returns EnergySystem the first item in the resourceSet"""
         if isinstance(uri_or_filename, str):
@@ -249,7 +287,7 @@ class EnergySystemHandler:
                 uri = URI(uri_or_filename)
         else:
             uri = uri_or_filename
-        return self.load_uri(uri)
+        return self.load_uri(uri, progress_callback, batch_callback)
 
     def import_file(self, uri_or_filename):
         if isinstance(uri_or_filename, str):
@@ -261,10 +299,10 @@ class EnergySystemHandler:
             uri = uri_or_filename
         return self.add_uri(uri)
 
-    def load_uri(self, uri):
+    def load_uri(self, uri, progress_callback=None, batch_callback=None):
         """Loads a new resource in a new resourceSet"""
         self._new_resource_set()
-        self.resource = self.rset.get_resource(uri)
+        self.resource = self.rset.get_resource(uri, options=self._load_options(progress_callback, batch_callback))
         # At this point, the model instance is loaded!
         self.energy_system = self.resource.contents[0]
         if isinstance(uri, str):
@@ -288,14 +326,14 @@ class EnergySystemHandler:
         self.add_object_to_dict(tmp_resource.contents[0].id, tmp_resource.contents[0], True)
         return tmp_resource.contents[0]
 
-    def load_from_string(self, esdl_string, name='from_string'):
+    def load_from_string(self, esdl_string, name='from_string', progress_callback=None, batch_callback=None):
         """Loads an energy system from a string and adds it to a *new* resourceSet
         :returns the loaded EnergySystem """
         uri = StringURI(name+'.esdl', esdl_string)
         self._new_resource_set()
         self.resource = self.rset.create_resource(uri)
         try:
-            self.resource.load()
+            self.resource.load(options=self._load_options(progress_callback, batch_callback))
             self.energy_system = self.resource.contents[0]
             self.validate()
             self.esid_uri_dict[self.energy_system.id] = uri.normalize()
@@ -349,6 +387,40 @@ class EnergySystemHandler:
         # return the string
         return uri.getvalue()
 
+    def to_chunks(self, es_id=None, gzip_level=None):
+        """Serializes an energy system to XML in chunks while they are consumed, e.g. by a streaming response
+        :param gzip_level: compress the XML with gzip with this level (1-9), None is uncompressed
+        :returns generator of bytes"""
+        resource = self.get_resource(es_id)
+        if resource is None:
+            resource = self.resource
+        return resource.iter_chunks(gzip_level=gzip_level)
+
+    def to_snapshot(self):
+        """Returns a compact binary snapshot of all resources in the resourceSet, see esdl.resources.snapshot"""
+        resources = list(self.rset.resources.items())
+        # make sure the main resource is restored as main resource
+        resources.sort(key=lambda item: item[1] is not self.resource)
+        return snapshot.dumps(resources)
+
+    def load_snapshot(self, data):
+        """Restores all resources of a binary snapshot (created by to_snapshot()) into a *new* resourceSet
+        :returns the EnergySystem of the main resource"""
+        self._new_resource_set()
+        self.esid_uri_dict = {}
+        for uri_string, roots in snapshot.loads(data, self.rset.metamodel_registry):
+            uri = StringURI(uri_string)
+            resource = self.rset.create_resource(uri)
+            for root in roots:
+                resource.append(root)
+            if self.resource is None:
+                self.resource = resource
+            es = resource.contents[0]
+            self.esid_uri_dict[es.id] = uri.normalize()
+            self.add_object_to_dict(es.id, es, True)
+        self.energy_system = self.resource.contents[0]
+        return self.energy_system
+
     def to_bytesio(self):
         """Returns a BytesIO stream for the energy system"""
         uri = StringURI('bytes_io_to_string.esdl')
@@ -424,6 +496,11 @@ class EnergySystemHandler:
         if es_id is None:
             return
         else:
+            self.stop_change_tracking(es_id)
+            self.remove_port_index(es_id)
+            self.remove_spatial_index(es_id)
+            self.model_analyses.pop(es_id, None)
+            self.remove_version_counter(es_id)
             my_uri = self.esid_uri_dict[es_id]
             del self.rset.resources[my_uri]
             del self.esid_uri_dict[es_id]
@@ -463,8 +540,9 @@ class EnergySystemHandler:
 
     def add_object_to_dict(self, es_id: str, esdl_object: EObject, recursive=False):
         if recursive:
-            for obj in esdl_object.eAllContents():
-                self.add_object_to_dict(es_id, obj)
+            for obj in walk_contents(esdl_object):
+                if obj is not esdl_object:
+                    self.add_object_to_dict(es_id, obj)
         if hasattr(esdl_object, 'id'):
             if esdl_object.id is not None:
                 self.get_resource(es_id).uuid_dict[esdl_object.id] = esdl_object
@@ -491,6 +569,114 @@ class EnergySystemHandler:
         return all_instances
         #return esdl_type.allInstances()
 
+    # Change tracking: records which objects of an energy system are added, removed or modified after
+    # start_change_tracking() has been called, such that the UI can be updated incrementally
+    def start_change_tracking(self, es_id):
+        """(Re)starts tracking changes of the energy system with the given id
+        :returns the ChangeTracker for this energy system"""
+        self.stop_change_tracking(es_id)
+        es = self.get_energy_system(es_id)
+        if es is None:
+            return None
+        tracker = ChangeTracker(es)
+        self.change_trackers[es_id] = tracker
+        return tracker
+
+    def stop_change_tracking(self, es_id=None):
+        """Stops tracking changes of the energy system with the given id, or of all energy systems if es_id is None"""
+        if es_id is None:
+            es_ids = list(self.change_trackers.keys())
+        else:
+            es_ids = [es_id]
+        for id in es_ids:
+            tracker = self.change_trackers.pop(id, None)
+            if tracker is not None:
+                tracker.detach()
+
+    def get_change_tracker(self, es_id):
+        return self.change_trackers.get(es_id)
+
+    def get_port_index(self, es_id=None):
+        """Returns the PortIndex of the energy system with the given id, it is built on first use"""
+        if es_id is None:
+            es_id = self.energy_system.id
+        if es_id not in self.port_indices:
+            es = self.get_energy_system(es_id)
+            if es is None:
+                return None
+            self.port_indices[es_id] = PortIndex(es)
+        return self.port_indices[es_id]
+
+    def check_id_index(self, es_id=None):
+        """Verifies the IdIndex of an energy system against a full walk, used in debug mode"""
+        es = self.get_energy_system(es_id)
+        if es is None:
+            return []
+        return IdIndex.get_for(es).check_consistency()
+
+    def remove_port_index(self, es_id=None):
+        if es_id is None:
+            es_ids = list(self.port_indices.keys())
+        else:
+            es_ids = [es_id]
+        for id in es_ids:
+            port_index = self.port_indices.pop(id, None)
+            if port_index is not None:
+                port_index.detach()
+
+    def get_spatial_index(self, es_id=None):
+        """Returns the SpatialIndex of the energy system with the given id, it is built on first use"""
+        if es_id is None:
+            es_id = self.energy_system.id
+        if es_id not in self.spatial_indices:
+            es = self.get_energy_system(es_id)
+            if es is None:
+                return None
+            self.spatial_indices[es_id] = SpatialIndex(es)
+        return self.spatial_indices[es_id]
+
+    def get_model_analysis(self, es_id=None):
+        """
+        Returns the ModelAnalysis of the top-level area of the energy system with the given id, it is cached until the
+        energy system changes
+        """
+        if es_id is None:
+            es_id = self.energy_system.id
+        es = self.get_energy_system(es_id)
+        if es is None or not es.instance or es.instance[0].area is None:
+            return None
+        area = es.instance[0].area
+        version = self.get_spatial_index(es_id).version
+        analysis = self.model_analyses.get(es_id)
+        if analysis is None or analysis.version != version or analysis.area is not area:
+            analysis = ModelAnalysis(area, version)
+            self.model_analyses[es_id] = analysis
+        return analysis
+
+    def compact_geometries(self, es_id=None, min_points=2):
+        """
+        Stores the points of the lines and polygons of an energy system with at least min_points points as arrays of
+        coordinates, see ESDLGeometry.CompactPoints. The points are materialized again when they are accessed.
+        :returns the number of points that are compacted
+        """
+        es = self.get_energy_system(es_id)
+        if es is None:
+            return 0
+        geometries = [obj for obj in walk_contents(es) if isinstance(obj, (esdl.Line, esdl.SubPolygon))]
+        count = sum(ESDLGeometry.compact_points(geometry, min_points) for geometry in geometries)
+        logger.info('Compacted {} points of {} geometries of energy system {}'.format(count, len(geometries), es.id))
+        return count
+
+    def remove_spatial_index(self, es_id=None):
+        if es_id is None:
+            es_ids = list(self.spatial_indices.keys())
+        else:
+            es_ids = [es_id]
+        for id in es_ids:
+            spatial_index = self.spatial_indices.pop(id, None)
+            if spatial_index is not None:
+                spatial_index.detach()
+
     # Creates a dict of all the attributes of an ESDL object, useful for printing/debugging
     @staticmethod
     def attr_to_dict(esdl_object):
@@ -531,15 +717,50 @@ class EnergySystemHandler:
 
         return self.energy_system
 
+    def estimate_memory_size(self):
+        """
+        Returns the approximate memory used by the energy systems of this handler in bytes, based on the number of
+        objects with an id (measured average including their attributes, geometries and contained objects without id)
+        """
+        return sum(len(resource.uuid_dict) for resource in self.rset.resources.values()) * ESDL_OBJECT_MEMORY_SIZE
+
+    def modification_version(self):
+        """
+        Returns a value that changes whenever one of the energy systems of this handler is changed, added or removed,
+        based on the VersionCounter of every energy system. Used by the session store to detect changes in place.
+        """
+        versions = []
+        for es_id in self.esid_uri_dict:
+            es = self.get_energy_system(es_id)
+            counter = self.version_counters.get(es_id)
+            if counter is None or counter.energy_system is not es:
+                self.remove_version_counter(es_id)
+                counter = VersionCounter(es) if es is not None else None
+                if counter is not None:
+                    self.version_counters[es_id] = counter
+            versions.append((es_id, counter.version if counter is not None else None))
+        return tuple(versions)
+
+    def remove_version_counter(self, es_id=None):
+        if es_id is None:
+            es_ids = list(self.version_counters.keys())
+        else:
+            es_ids = [es_id]
+        for id in es_ids:
+            counter = self.version_counters.pop(id, None)
+            if counter is not None:
+                counter.detach()
+
     # Support for Pickling when serializing the energy system in a session
     # The pyEcore classes by default do not allow for simple serialization for Session management in Flask.
     # Internally Flask Sessions use Pickle to serialize a data structure by means of its __dict__. This does not work.
-    # Furthermore, ESDL can contain cyclic relations. Therefore we serialize to XMI and back if necessary.
+    # Furthermore, ESDL can contain cyclic relations. Therefore we serialize to a binary snapshot and back.
+    # The XML format ('energySystem') is still supported when deserializing.
     def __getstate__(self):
         state = dict()
         #print('Serialize rset {}'.format(self.rset.resources))
         print('Serializing EnergySystem...', end ="")
-        state['energySystem'] = self.to_string()
+        state['snapshot'] = self.to_snapshot()
         print('done')
         return state
 
@@ -547,15 +768,48 @@ class EnergySystemHandler:
         self.__init__()
         #print('Deserialize rset {}'.format(self.rset.resources))
         print('Deserializing EnergySystem...', end="")
-        self.load_from_string(state['energySystem'])
+        if 'snapshot' in state:
+            self.load_snapshot(state['snapshot'])
+        else:
+            self.load_from_string(state['energySystem'])
         print('done')
 
 
+class StringInStream:
+    """
+    Input stream of a string that is encoded to UTF-8 while it is read, such that the encoded document does not need
+    to be kept in memory while it is parsed
+    """
+    CHUNK_SIZE = 1 << 20
+
+    def __init__(self, text):
+        self.text = text
+        self.position = 0
+        self.buffer = b''
+        self.total_bytes = len(text)  # approximation, exact for ASCII
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = len(self.buffer) + 4 * (len(self.text) - self.position)
+        while len(self.buffer) < size and self.position < len(self.text):
+            chunk = self.text[self.position:self.position + max(size, self.CHUNK_SIZE)]
+            self.position += len(chunk)
+            self.buffer += chunk.encode('UTF-8')
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def getvalue(self):
+        return self.text.encode('UTF-8')
+
+    def close(self):
+        pass
+
+
 class StringURI(URI):
     def __init__(self, uri, text=None):
         super(StringURI, self).__init__(uri)
         if text is not None:
-            self.__stream = BytesIO(text.encode('UTF-8'))
+            self.__stream = StringInStream(text)
 
     def getvalue(self):
         readbytes = self.__stream.getvalue()
@@ -571,4 +825,663 @@ class StringURI(URI):
         return self.__stream
 
     def get_stream(self):
-        return self.__stream
\ No newline at end of file
+        return self.__stream
+
+
+def walk_contents(root):
+    """
+    Yields root and all objects that are contained in it, in no particular order. This is a lot faster than
+    eAllContents() for large energy systems, as only the containment references that are set are visited. The points
+    of compact geometries (see ESDLGeometry.CompactPoints) are not materialized and not yielded.
+    """
+    stack = [root]
+    while stack:
+        obj = stack.pop()
+        yield obj
+        for feature in obj._isset:
+            if isinstance(feature, EReference) and feature.containment:
+                if isinstance(obj.__dict__.get(feature.name), ESDLGeometry.CompactPoints):
+                    continue
+                value = obj.eGet(feature)
+                if feature.many:
+                    stack.extend(value)
+                elif value is not None:
+                    stack.append(value)
+
+
+class EnergySystemObserver(EObserver):
+    """
+    Base class for observers of all objects in an energy system using pyecore notifications. Objects that are added to
+    the energy system are observed automatically, objects that are removed from it are released.
+    """
+    def __init__(self, energy_system):
+        super().__init__()
+        self.energy_system = energy_system
+        self._observe_tree(energy_system)
+
+    def _observe_tree(self, root):
+        for obj in walk_contents(root):
+            self.observe(obj)
+
+    def _release_tree(self, root):
+        for obj in walk_contents(root):
+            if self in obj.listeners:
+                obj.listeners.remove(self)
+
+    def detach(self):
+        self._release_tree(self.energy_system)
+
+    def is_attached(self, obj):
+        """Checks if obj is (still) part of the observed energy system"""
+        while obj is not None:
+            if obj is self.energy_system:
+                return True
+            obj = obj.eContainer()
+        return False
+
+    @staticmethod
+    def containment_changes(notification):
+        """Returns the lists of objects that are added to and removed from a containment reference"""
+        added = []
+        removed = []
+        feature = notification.feature
+        if isinstance(feature, EReference) and feature.containment:
+            kind = notification.kind
+            if kind in (Kind.ADD, Kind.SET):
+                added.append(notification.new)
+            elif kind == Kind.ADD_MANY:
+                added.extend(notification.new)
+            if kind in (Kind.REMOVE, Kind.SET, Kind.UNSET):
+                removed.append(notification.old)
+            elif kind == Kind.REMOVE_MANY:
+                removed.extend(notification.old)
+        return [o for o in added if isinstance(o, EObject)], [o for o in removed if isinstance(o, EObject)]
+
+
+class VersionCounter(EnergySystemObserver):
+    """
+    Changes its version on every change of an energy system, without any other bookkeeping. The version is unique over
+    all counters, such that a counter of an energy system that is loaded again never returns an earlier version.
+    """
+    _versions = itertools.count()
+
+    def __init__(self, energy_system):
+        self.version = next(VersionCounter._versions)
+        super().__init__(energy_system)
+
+    def notifyChanged(self, notification):
+        self.version = next(VersionCounter._versions)
+        added, removed = EnergySystemObserver.containment_changes(notification)
+        for root in removed:
+            # objects that are moved within the energy system are still attached
+            if not self.is_attached(root):
+                self._release_tree(root)
+        for root in added:
+            for obj in walk_contents(root):
+                if self not in obj.listeners:
+                    self.observe(obj)
+
+
+class ChangeTracker(EnergySystemObserver):
+    """
+    Records which objects of an energy system are added, removed or modified.
+    """
+    def __init__(self, energy_system):
+        self.added = dict()
+        self.removed = dict()
+        self.modified = dict()
+        super().__init__(energy_system)
+
+    def detach(self):
+        super().detach()
+        for obj in self.removed.values():
+            self._release_tree(obj)
+        self.clear()
+
+    def clear(self):
+        self.added.clear()
+        self.removed.clear()
+        self.modified.clear()
+
+    def has_changes(self):
+        return bool(self.added or self.removed or self.modified)
+
+    def notifyChanged(self, notification):
+        notifier = notification.notifier
+        feature = notification.feature
+        # adding or removing assets, potentials and subareas to an area does not modify the area itself
+        if not (isinstance(notifier, esdl.Area) and feature.name in ('asset', 'potential', 'area')):
+            self.modified[id(notifier)] = notifier
+
+        added, removed = EnergySystemObserver.containment_changes(notification)
+        for obj in removed:
+            self.removed[id(obj)] = obj
+        for obj in added:
+            self._observe_tree(obj)
+            self.added[id(obj)] = obj
+
+    @staticmethod
+    def ui_object(obj):
+        """
+        Returns the object that represents obj on the map: the outermost building if obj is part of a building,
+        otherwise the nearest EnergyAsset, Potential or Area. Returns None if obj is not part of an area
+        (e.g. carriers or other EnergySystemInformation).
+        """
+        found = None
+        while obj is not None:
+            if isinstance(obj, esdl.AbstractBuilding):
+                found = obj
+            elif found is None and isinstance(obj, (esdl.EnergyAsset, esdl.Potential)):
+                found = obj
+            elif isinstance(obj, esdl.Area):
+                return found if found is not None else obj
+            obj = obj.eContainer()
+        return None
+
+    def collect(self):
+        """
+        Translates the recorded notifications into changes of objects that are shown on the map.
+        :returns dict with lists of 'added', 'removed' and 'modified' objects and a 'full_update' flag that
+        indicates that the changes can't be handled incrementally (e.g. areas or carriers have changed)
+        """
+        added = dict()
+        removed = dict()
+        modified = dict()
+        full_update = False
+
+        for obj in self.removed.values():
+            if not self.is_attached(obj):
+                if isinstance(obj, (esdl.Area, esdl.AbstractBuilding)):
+                    full_update = True
+                elif isinstance(obj, (esdl.EnergyAsset, esdl.Potential)):
+                    removed[id(obj)] = obj
+
+        for obj in self.added.values():
+            if self.is_attached(obj):
+                ui_obj = ChangeTracker.ui_object(obj)
+                if ui_obj is obj:
+                    added[id(obj)] = obj
+                elif ui_obj is not None:
+                    modified[id(ui_obj)] = ui_obj
+                else:
+                    full_update = True
+
+        for obj in self.modified.values():
+            if self.is_attached(obj):
+                ui_obj = ChangeTracker.ui_object(obj)
+                if ui_obj is None:
+                    full_update = True
+                else:
+                    modified[id(ui_obj)] = ui_obj
+
+        # objects that were moved to another container are reported as modified
+        for key in list(removed.keys()):
+            if key in added:
+                modified[key] = added.pop(key)
+                del removed[key]
+        # changes to newly added objects are part of the addition
+        for key in added.keys():
+            modified.pop(key, None)
+
+        # only newly added areas can be handled incrementally, other changes to areas and buildings can't
+        for obj in list(added.values()):
+            if isinstance(obj, esdl.AbstractBuilding):
+                full_update = True
+        for obj in list(modified.values()):
+            if isinstance(obj, (esdl.Area, esdl.AbstractBuilding)):
+                full_update = True
+
+        return {
+            'added': list(added.values()),
+            'removed': list(removed.values()),
+            'modified': list(modified.values()),
+            'full_update': full_update
+        }
+
+
+
+class PortIndex(EnergySystemObserver):
+    """
+    Index of all ports in an energy system: port id -> dict with the asset, the ordinal of the port in the asset,
+    the coordinate of the port (the first or last point for Lines), the carrier id and the containing building.
+    The index is built in a single pass and kept up to date using pyecore notifications: assets that are changed
+    are marked dirty and their ports are re-indexed on the next lookup.
+    """
+    def __init__(self, energy_system):
+        self.ports = dict()             # port id -> port info
+        self.asset_port_ids = dict()    # id(asset) -> list of port ids of that asset
+        self.dirty = dict()             # id(asset) -> asset
+        super().__init__(energy_system)
+        for obj in walk_contents(energy_system):
+            if isinstance(obj, esdl.EnergyAsset):
+                self._index_asset(obj)
+
+    @staticmethod
+    def port_coordinate(asset, ordinal):
+        geom = asset.geometry
+        if geom:
+            if isinstance(geom, esdl.Point):
+                return (geom.lat, geom.lon)
+            if isinstance(geom, esdl.Line):
+                # first coordinate for the first port and last coordinate for the second port
+                coordinate = None
+                if ordinal == 0:
+                    coordinate = ESDLGeometry.get_coordinate(geom, 0)
+                if ordinal == 1:
+                    coordinate = ESDLGeometry.get_coordinate(geom, -1)
+                if coordinate:
+                    return (coordinate[1], coordinate[0])
+            if isinstance(geom, esdl.Polygon):
+                return ESDLGeometry.calculate_polygon_center(geom)
+        return ()
+
+    def _index_asset(self, asset):
+        port_ids = []
+        for ordinal, port in enumerate(asset.port):
+            self.ports[port.id] = {
+                'asset': asset,
+                'port': port,
+                'ordinal': ordinal,
+                'coord': PortIndex.port_coordinate(asset, ordinal),
+                'carrier_id': port.carrier.id if port.carrier else None,
+                'building': asset.containingBuilding
+            }
+            port_ids.append(port.id)
+        self.asset_port_ids[id(asset)] = port_ids
+
+    def _unindex_asset(self, asset):
+        for port_id in self.asset_port_ids.pop(id(asset), []):
+            info = self.ports.get(port_id)
+            if info is not None and info['asset'] is asset:
+                del self.ports[port_id]
+
+    def notifyChanged(self, notification):
+        # mark the asset the notifier belongs to as dirty, e.g. when its geometry or ports change
+        obj = notification.notifier
+        while obj is not None and not isinstance(obj, esdl.EnergyAsset):
+            if isinstance(obj, (esdl.Area, esdl.EnergySystem)):
+                obj = None
+                break
+            obj = obj.eContainer()
+        if obj is not None:
+            self.dirty[id(obj)] = obj
+
+        added, removed = EnergySystemObserver.containment_changes(notification)
+        for root in removed:
+            # objects that are moved within the energy system are still attached
+            if not self.is_attached(root):
+                self._release_tree(root)
+                for o in walk_contents(root):
+                    if isinstance(o, esdl.EnergyAsset):
+                        self.dirty.pop(id(o), None)
+                        self._unindex_asset(o)
+        for root in added:
+            self._observe_tree(root)
+            for o in walk_contents(root):
+                if isinstance(o, esdl.EnergyAsset):
+                    self.dirty[id(o)] = o
+
+    def _refresh(self):
+        if self.dirty:
+            dirty = list(self.dirty.values())
+            self.dirty.clear()
+            for asset in dirty:
+                self._unindex_asset(asset)
+                if self.is_attached(asset):
+                    self._index_asset(asset)
+
+    def get(self, port_id):
+        """Returns the port info for the port with the given id, or None if the port is unknown"""
+        self._refresh()
+        return self.ports.get(port_id)
+
+
+class SpatialIndex(EnergySystemObserver):
+    """
+    Spatial index (STRtree) of the geometries of all assets, buildings, areas and potentials in an energy system, to
+    find the objects in a viewport, near a point or within a polygon without walking the complete energy system.
+    Geometries are indexed in WGS84 with x=lon and y=lat, distances are in degrees.
+
+    Like the PortIndex, objects of which the geometry changes are marked dirty using pyecore notifications (e.g. when
+    their coordinates are updated in the map) and the index is brought up to date on the next query. The STRtree
+    itself can't be changed, so it is rebuilt on the first query after a change.
+
+    The version changes on every change of the energy system and is unique over all spatial indices, such that caches
+    of data that is derived from the energy system (e.g. vector tiles) can use it in their keys.
+    """
+    INDEXED_TYPES = (esdl.EnergyAsset, esdl.AbstractBuilding, esdl.Area, esdl.Potential)
+    _versions = itertools.count()
+
+    def __init__(self, energy_system):
+        self.version = next(SpatialIndex._versions)
+        self.shapes = dict()    # id(obj) -> (obj, shapely geometry)
+        self.dirty = dict()     # id(obj) -> obj
+        self._tree = None
+        self._entries = []      # the (obj, geometry) tuples in the order of the STRtree
+        self._entry_index = dict()  # id(geometry) -> index in _entries (shapely 1.x queries return geometries)
+        self._extent = None     # bounds of all indexed geometries
+        super().__init__(energy_system)
+
+    def _observe_tree(self, root):
+        # objects are indexed on the first query, such that the energy system is only walked once
+        for obj in walk_contents(root):
+            self.observe(obj)
+            if isinstance(obj, SpatialIndex.INDEXED_TYPES):
+                self.dirty[id(obj)] = obj
+
+    @staticmethod
+    def to_shapely(geometry):
+        """Converts an ESDL geometry or a Shape to a shapely geometry"""
+        if isinstance(geometry, Shape):
+            return geometry.shape
+        if isinstance(geometry, EObject):
+            return Shape.create(geometry).shape
+        return geometry
+
+    def _index(self, obj):
+        if obj.geometry is None:
+            return
+        try:
+            geometry = SpatialIndex.to_shapely(obj.geometry)
+        except Exception as e:
+            logger.debug('Geometry of {} cannot be indexed: {}'.format(obj.id, e))
+            return
+        if geometry is not None and not geometry.is_empty:
+            self.shapes[id(obj)] = (obj, geometry)
+            self._tree = None
+
+    def _unindex(self, obj):
+        if self.shapes.pop(id(obj), None) is not None:
+            self._tree = None
+
+    @staticmethod
+    def geometry_owner(notification):
+        """Returns the indexed object of which the geometry is changed by a notification, or None"""
+        obj = notification.notifier
+        if isinstance(obj, SpatialIndex.INDEXED_TYPES):
+            return obj if notification.feature.name == 'geometry' else None
+        while obj is not None:
+            container = obj.eContainer()
+            if isinstance(container, SpatialIndex.INDEXED_TYPES):
+                return container if obj.eContainmentFeature().name == 'geometry' else None
+            obj = container
+        return None
+
+    def notifyChanged(self, notification):
+        self.version = next(SpatialIndex._versions)
+        owner = SpatialIndex.geometry_owner(notification)
+        if owner is not None:
+            self.dirty[id(owner)] = owner
+
+        added, removed = EnergySystemObserver.containment_changes(notification)
+        for root in removed:
+            # objects that are moved within the energy system are still attached
+            if not self.is_attached(root):
+                self._release_tree(root)
+                for o in walk_contents(root):
+                    if isinstance(o, SpatialIndex.INDEXED_TYPES):
+                        self.dirty.pop(id(o), None)
+                        self._unindex(o)
+        for root in added:
+            self._observe_tree(root)
+
+    def _refresh(self):
+        if self.dirty:
+            dirty = list(self.dirty.values())
+            self.dirty.clear()
+            for obj in dirty:
+                self._unindex(obj)
+                if self.is_attached(obj):
+                    self._index(obj)
+        if self._tree is None and self.shapes:
+            self._entries = list(self.shapes.values())
+            self._entry_index = {id(geometry): i for i, (_, geometry) in enumerate(self._entries)}
+            self._tree = STRtree([geometry for _, geometry in self._entries])
+            bounds = [geometry.bounds for _, geometry in self._entries]
+            self._extent = (min(b[0] for b in bounds), min(b[1] for b in bounds),
+                            max(b[2] for b in bounds), max(b[3] for b in bounds))
+
+    def _candidates(self, geometry, types):
+        """Returns the (obj, geometry) tuples of which the bounding box intersects that of geometry"""
+        self._refresh()
+        if self._tree is None:
+            return []
+        candidates = []
+        for result in self._tree.query(geometry):
+            # shapely 2 returns the indices of the geometries, shapely 1.x the geometries themselves
+            index = self._entry_index[id(result)] if isinstance(result, BaseGeometry) else int(result)
+            obj, obj_geometry = self._entries[index]
+            if types is None or isinstance(obj, types):
+                candidates.append((obj, obj_geometry))
+        return candidates
+
+    def get_geometry(self, obj):
+        """Returns the indexed shapely geometry of an object, or None"""
+        self._refresh()
+        entry = self.shapes.get(id(obj))
+        return entry[1] if entry else None
+
+    def bounds(self):
+        """Returns the bounds (min_lon, min_lat, max_lon, max_lat) of all indexed geometries, or None"""
+        self._refresh()
+        return self._extent
+
+    def query_bbox(self, min_lon, min_lat, max_lon, max_lat, types=None):
+        """Returns the objects (of the given types) of which the geometry intersects the bounding box (viewport)"""
+        bbox = box(min_lon, min_lat, max_lon, max_lat)
+        return [obj for obj, geometry in self._candidates(bbox, types) if geometry.intersects(bbox)]
+
+    def nearest(self, lon, lat, types=None, max_distance=None):
+        """
+        Returns the object (of the given types) of which the geometry is nearest to a point, or None if there is no
+        such object (within max_distance degrees)
+        """
+        self._refresh()
+        if self._tree is None:
+            return None
+        point = ShapelyPoint(lon, lat)
+        # search in a growing square around the point, an object found within distance r of the point is the nearest
+        # one if there are no other objects within that distance
+        min_lon, min_lat, max_lon, max_lat = self._extent
+        limit = max(max_lon - min_lon, max_lat - min_lat, abs(lon - min_lon), abs(lon - max_lon),
+                    abs(lat - min_lat), abs(lat - max_lat)) * 2
+        if max_distance is not None:
+            limit = min(limit, max_distance)
+        radius = min(0.001, limit) if limit > 0 else 0
+        while True:
+            search_box = box(lon - radius, lat - radius, lon + radius, lat + radius)
+            best = None
+            best_distance = None
+            for obj, geometry in self._candidates(search_box, types):
+                distance = geometry.distance(point)
+                if distance <= radius and (best is None or distance < best_distance):
+                    best = obj
+                    best_distance = distance
+            if best is not None or radius >= limit:
+                return best
+            radius = min(radius * 2, limit)
+
+    def query_within(self, polygon, types=None):
+        """
+        Returns the objects (of the given types) of which the geometry is within a polygon (an ESDL geometry, a Shape
+        or a shapely geometry), e.g. the assets that are located in an area
+        """
+        polygon = SpatialIndex.to_shapely(polygon)
+        return [obj for obj, geometry in self._candidates(polygon, types) if polygon.contains(geometry)]
+
+    def query_containing(self, lon, lat, types=None):
+        """Returns the objects (of the given types) of which the geometry contains a point, e.g. areas or buildings"""
+        point = ShapelyPoint(lon, lat)
+        return [obj for obj, geometry in self._candidates(point, types) if geometry.intersects(point)]
+
+
+class ModelAnalysis:
+    """
+    Information about the contents of an area that is needed to process an energy system after it is loaded, gathered
+    in a single walk of the area:
+    - the extent (min_lon, min_lat, max_lon, max_lat) of the points and polygons that don't use the 'Simple' CRS
+    - rd_coordinates: True if the coordinates are in the RD (Rijksdriehoek) CRS instead of WGS84
+    - missing_geometry: the assets and buildings without a geometry
+    - potentials: all potentials
+    - areas: the area and all its subareas
+    - boundary_areas: the areas without a geometry with an id and a scope, of which the boundary can be retrieved
+      from the boundary service
+
+    The EnergySystemHandler caches the analysis of the top-level area of an energy system, keyed by the version of the
+    SpatialIndex, such that it is recalculated after the energy system changes.
+    """
+    def __init__(self, area, version=None):
+        self.area = area
+        self.version = version
+        self.min_lon = float("inf")
+        self.min_lat = float("inf")
+        self.max_lon = -float("inf")
+        self.max_lat = -float("inf")
+        self.missing_geometry = []
+        self.potentials = []
+        self.areas = []
+        self.boundary_areas = []
+
+        for obj in walk_contents(area):
+            point = None
+            if isinstance(obj, esdl.Point):
+                if obj.CRS != "Simple": point = (obj.lon, obj.lat)
+            elif isinstance(obj, esdl.Polygon):
+                if obj.CRS != "Simple" and obj.exterior:
+                    point = ESDLGeometry.get_coordinate(obj.exterior, 0)  # take first coordinate of exterior of polygon
+            elif isinstance(obj, (esdl.Line, esdl.SubPolygon)):
+                points = obj.__dict__.get('point')
+                if isinstance(points, ESDLGeometry.CompactPoints):
+                    # the points of compact geometries are not visited by walk_contents()
+                    self._add_to_extent(min(points.lon), min(points.lat), max(points.lon), max(points.lat))
+            elif isinstance(obj, (esdl.EnergyAsset, esdl.AggregatedBuilding, esdl.Building)):
+                if not obj.geometry:
+                    self.missing_geometry.append(obj)
+            elif isinstance(obj, esdl.Potential):
+                self.potentials.append(obj)
+            elif isinstance(obj, esdl.Area):
+                self.areas.append(obj)
+                if not obj.geometry and obj.id and obj.scope.name != 'UNDEFINED':
+                    self.boundary_areas.append(obj)
+            if point:
+                self._add_to_extent(point[0], point[1], point[0], point[1])
+
+        self.rd_coordinates = (self.max_lat > 180 and self.max_lon > 180)
+
+    def _add_to_extent(self, min_lon, min_lat, max_lon, max_lat):
+        if min_lat < self.min_lat: self.min_lat = min_lat
+        if max_lat > self.max_lat: self.max_lat = max_lat
+        if min_lon < self.min_lon: self.min_lon = min_lon
+        if max_lon > self.max_lon: self.max_lon = max_lon
+
+    def extent(self):
+        """Returns (min_lon, min_lat, max_lon, max_lat), or None if the area doesn't contain any coordinates"""
+        if self.min_lon > self.max_lon:
+            return None
+        return self.min_lon, self.min_lat, self.max_lon, self.max_lat
+
+
+class IdIndex(EnergySystemObserver):
+    """
+    Index of all objects with an id in an energy system: id -> object. Together with eContainer() as back-pointer to
+    the container of an object this allows resolving objects in O(1) instead of recursively searching all areas and
+    buildings. The index is kept up to date using pyecore notifications (added and removed objects, changed ids).
+    Use IdIndex.get_for(obj) to get the index of the energy system obj is part of.
+    """
+    indices = weakref.WeakValueDictionary()     # id(energy_system) -> IdIndex
+
+    def __init__(self, energy_system):
+        self.objects = dict()
+        super().__init__(energy_system)
+        self._index_tree(energy_system)
+        IdIndex.indices[id(energy_system)] = self
+
+    @staticmethod
+    def get_for(obj):
+        """Returns the IdIndex of the energy system obj is part of (creates it if necessary), or None if obj is not
+        part of an energy system"""
+        root = obj
+        while root.eContainer() is not None:
+            root = root.eContainer()
+        if not isinstance(root, esdl.EnergySystem):
+            return None
+        id_index = IdIndex.indices.get(id(root))
+        if id_index is None or id_index.energy_system is not root:
+            id_index = IdIndex(root)
+        return id_index
+
+    def detach(self):
+        super().detach()
+        if IdIndex.indices.get(id(self.energy_system)) is self:
+            del IdIndex.indices[id(self.energy_system)]
+
+    def _index_tree(self, root):
+        for obj in walk_contents(root):
+            obj_id = getattr(obj, 'id', None)
+            if obj_id is not None:
+                self.objects[obj_id] = obj
+
+    def _unindex_tree(self, root):
+        for obj in walk_contents(root):
+            obj_id = getattr(obj, 'id', None)
+            if obj_id is not None and self.objects.get(obj_id) is obj:
+                del self.objects[obj_id]
+
+    def notifyChanged(self, notification):
+        feature = notification.feature
+        notifier = notification.notifier
+        if isinstance(feature, EAttribute) and feature.name == 'id':
+            if notification.old is not None and self.objects.get(notification.old) is notifier:
+                del self.objects[notification.old]
+            if notification.new is not None and self.is_attached(notifier):
+                self.objects[notification.new] = notifier
+            return
+
+        added, removed = EnergySystemObserver.containment_changes(notification)
+        for root in removed:
+            # objects that are moved within the energy system are still attached
+            if not self.is_attached(root):
+                self._release_tree(root)
+                self._unindex_tree(root)
+        for root in added:
+            self._observe_tree(root)
+            self._index_tree(root)
+
+    def get(self, obj_id):
+        return self.objects.get(obj_id)
+
+    def find_in(self, container, obj_id, esdl_type):
+        """Returns the object with the given id and type if it is (indirectly) contained in container, else None"""
+        obj = self.objects.get(obj_id)
+        if obj is None or not isinstance(obj, esdl_type):
+            return None
+        parent = obj
+        while parent is not None:
+            if parent is container:
+                return obj
+            parent = parent.eContainer()
+        return None
+
+    def check_consistency(self):
+        """
+        Verifies the index against a full walk of the energy system (use in debug mode only)
+        :returns list of inconsistencies, empty if the index is consistent
+        """
+        errors = []
+        walked = dict()
+        for obj in walk_contents(self.energy_system):
+            obj_id = getattr(obj, 'id', None)
+            if obj_id is not None:
+                walked[obj_id] = obj
+        for obj_id, obj in walked.items():
+            if obj_id not in self.objects:
+                errors.append('{} with id {} is missing in the index'.format(obj.eClass.name, obj_id))
+            elif self.objects[obj_id] is not obj:
+                errors.append('id {} refers to a different object in the index'.format(obj_id))
+        for obj_id, obj in self.objects.items():
+            if obj_id not in walked:
+                errors.append('{} with id {} is in the index, but not in the energy system'.format(obj.eClass.name,
+                                                                                                  obj_id))
+        for error in errors:
+            logger.error('IdIndex inconsistency: {}'.format(error))
+        return errors
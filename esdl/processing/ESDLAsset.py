@@ -15,7 +15,7 @@
 from esdl import esdl
 from pyecore.ecore import EClass
 from pyecore.resources import ResourceSet
-from esdl.esdl_handler import StringURI
+from esdl.esdl_handler import StringURI, IdIndex
 from esdl.processing import ESDLEnergySystem
 
 
@@ -40,6 +40,10 @@ def find_asset_in_building(building, asset_id):
 
 
 def find_asset(area, asset_id):
+    id_index = IdIndex.get_for(area)
+    if id_index is not None:
+        return id_index.find_in(area, asset_id, esdl.Asset)
+
     for ass in area.asset:
         if ass.id == asset_id:
             return ass
@@ -57,6 +61,14 @@ def find_asset(area, asset_id):
 
 
 def find_potential(area, pot_id):
+    id_index = IdIndex.get_for(area)
+    if id_index is not None:
+        pot = id_index.find_in(area, pot_id, esdl.Potential)
+        # only potentials in areas, not in buildings
+        if pot is not None and isinstance(pot.eContainer(), esdl.Area):
+            return pot
+        return None
+
     for pot in area.potential:
         if pot.id == pot_id:
             return pot
@@ -77,10 +89,17 @@ def find_asset_in_building_and_container(building, asset_id):
             asset, build = find_asset_in_building_and_container(ass, asset_id)
             if asset:
                 return asset, build
-    return None
+    return None, None
 
 
 def find_asset_and_container(area, asset_id):
+    id_index = IdIndex.get_for(area)
+    if id_index is not None:
+        asset = id_index.find_in(area, asset_id, esdl.Asset)
+        if asset is not None:
+            return asset, asset.eContainer()
+        return None, None
+
     for ass in area.asset:
         if ass.id == asset_id:
             return ass, area
@@ -94,7 +113,7 @@ def find_asset_and_container(area, asset_id):
         if asset:
             return asset, ar
 
-    return None
+    return None, None
 
 
 def add_object_to_area(es, obj, area_id):
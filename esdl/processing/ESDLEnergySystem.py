@@ -13,10 +13,15 @@
 #      TNO
 
 from esdl import esdl
+from esdl.esdl_handler import IdIndex
 import uuid
 
 
 def find_area(area, area_id):
+    id_index = IdIndex.get_for(area)
+    if id_index is not None:
+        return id_index.find_in(area, area_id, esdl.Area)
+
     if area.id == area_id: return area
     for a in area.area:
         ar = find_area(a, area_id)
@@ -14,6 +14,9 @@
 
 from esdl import esdl
 from utils.RDWGSConverter import RDWGSConverter
+from pyecore.valuecontainer import ECollection
+from pyecore.ordered_set_patch import ordered_set
+from array import array
 import math
 
 
@@ -178,16 +181,9 @@ def create_geojson(id, name, KPIs, boundary_wgs):
 
 
 def parse_esdl_subpolygon(subpol, close=True):
-    ar = []
-    points = subpol.point
-    firstlat = points[0].lat
-    firstlon = points[0].lon
-    for point in points:
-        lat = point.lat
-        lon = point.lon
-        ar.append([lon, lat])
+    ar = [[lon, lat] for lon, lat in get_coordinates(subpol)]
     if close:
-        ar.append([firstlon, firstlat])  # close the polygon: TODO: check if necessary??
+        ar.append([ar[0][0], ar[0][1]])  # close the polygon: TODO: check if necessary??
     return ar
 
 
@@ -234,33 +230,23 @@ def create_geometry_from_geom(geom):
 
 def convert_polygon_rd_to_wgs(coords):
     RDWGS = RDWGSConverter()
-
-    for i in range(0, len(coords)):
-        for j in range(0, len(coords[i])):
-            point = coords[i][j]
-            coords[i][j] = RDWGS.fromRdToWgs(point)
-
+    coords[:] = RDWGS.fromRdToWgsRings(coords)
     return coords
 
 
 def convert_mp_rd_to_wgs(coords):
     RDWGS = RDWGSConverter()
 
-    for i in range(0, len(coords)):
-        for j in range(0, len(coords[i])):
-            for k in range(0, len(coords[i][j])):
-                point = coords[i][j][k]
-                coords[i][j][k] = RDWGS.fromRdToWgs(point)
+    # convert the rings of all polygons in one batch
+    converted = iter(RDWGS.fromRdToWgsRings([ring for polygon in coords for ring in polygon]))
+    for polygon in coords:
+        polygon[:] = [next(converted) for _ in polygon]
 
     return coords
 
 
 def exchange_coordinates(coords):
-
-    for i in range(0, len(coords)):
-        point = coords[i]
-        coords[i] = [point[1], point[0]]
-
+    coords[:] = [[point[1], point[0]] for point in coords]
     return coords
 
 
@@ -291,13 +277,11 @@ def calculate_polygon_center(polygon):
     max_lat = 0
     max_lon = 0
 
-    exterior = polygon.exterior
-    points = exterior.point
-    for p in points:
-        if p.lat < min_lat: min_lat = p.lat
-        if p.lon < min_lon: min_lon = p.lon
-        if p.lat > max_lat: max_lat = p.lat
-        if p.lon > max_lon: max_lon = p.lon
+    for lon, lat in get_coordinates(polygon.exterior):
+        if lat < min_lat: min_lat = lat
+        if lon < min_lon: min_lon = lon
+        if lat > max_lat: max_lat = lat
+        if lon > max_lon: max_lon = lon
 
     return ((min_lat + max_lat) / 2, (min_lon + max_lon) / 2)
 
@@ -387,3 +371,145 @@ def create_ESDL_geometry(shape):
         geometry.CRS = shape['crs']
 
     return geometry
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+#  Compact storage of the points of lines and polygons
+# ---------------------------------------------------------------------------------------------------------------------
+class CompactPoints:
+    """
+    Stores the points of a Line or SubPolygon as arrays of coordinates instead of esdl.Point objects, which use a lot
+    of memory for large networks. It replaces the point collection in the __dict__ of its owner: pyecore calls _get()
+    when owner.point is accessed, which creates the esdl.Point objects again (materializes them), such that existing
+    code keeps working. Use get_coordinates() to read the coordinates without materializing the points.
+    """
+    __slots__ = ('owner', 'feature', 'lat', 'lon', 'elevation')
+
+    def __init__(self, owner, feature, lat, lon, elevation=None):
+        self.owner = owner
+        self.feature = feature
+        self.lat = lat              # array('d')
+        self.lon = lon              # array('d')
+        self.elevation = elevation  # array('d') or None if no point has an elevation
+
+    def __len__(self):
+        return len(self.lat)
+
+    def coordinates(self):
+        """Returns the list of (lon, lat) tuples"""
+        return list(zip(self.lon, self.lat))
+
+    def iter_points(self):
+        """Yields new esdl.Point objects that are not added to the owner, e.g. to serialize them"""
+        for i in range(len(self.lat)):
+            point = esdl.Point(lat=self.lat[i], lon=self.lon[i])
+            if self.elevation is not None:
+                point.elevation = self.elevation[i]
+            point._container = self.owner
+            point._containment_feature = self.feature
+            yield point
+
+    def _get(self):
+        """Called by pyecore when the point reference of the owner is accessed"""
+        collection = ECollection.create(self.owner, self.feature)
+        couple = (self.owner, self.feature)
+        listeners = self.owner.listeners
+        for point in self.iter_points():
+            point._inverse_rels.add(couple)
+            point.listeners.extend(listeners)     # the observers of an energy system observe all its objects
+            ordered_set.OrderedSet.add(collection, point)
+        self.owner.__dict__[self.feature.name] = collection
+        return collection
+
+
+COMPACT_POINT_FEATURES = ('lat', 'lon', 'elevation')
+
+
+def _is_compactable(point, owner, feature):
+    if type(point) is not esdl.Point:
+        return False
+    if any(f.name not in COMPACT_POINT_FEATURES for f in point._isset):
+        return False        # e.g. a CRS per point
+    if any(couple != (owner, feature) for couple in point._inverse_rels):
+        return False        # referenced by another object
+    return all(listener in owner.listeners for listener in point.listeners)
+
+
+def compact_points(owner, min_points=2):
+    """
+    Replaces the esdl.Point objects of a Line or SubPolygon by CompactPoints, if it has at least min_points points.
+    The points are kept if one of them has other attributes than lat, lon and elevation, or is referenced or observed
+    separately.
+    :returns the number of points that are compacted
+    """
+    feature = type(owner).point
+    points = owner.__dict__.get(feature.name)
+    if not points or isinstance(points, CompactPoints) or len(points) < min_points:
+        return 0
+    if not all(_is_compactable(p, owner, feature) for p in points):
+        return 0
+    lat = array('d', [p.lat for p in points])
+    lon = array('d', [p.lon for p in points])
+    elevation = None
+    if any(p.elevation for p in points):
+        elevation = array('d', [p.elevation for p in points])
+    for p in points:
+        p._container = None
+        p._containment_feature = None
+        p.listeners.clear()
+    owner.__dict__[feature.name] = CompactPoints(owner, feature, lat, lon, elevation)
+    return len(lat)
+
+
+def compact_geometry(geometry, min_points=2):
+    """
+    Compacts the points of a Line, Polygon, MultiLine or MultiPolygon, see compact_points()
+    :returns the number of points that are compacted
+    """
+    if isinstance(geometry, (esdl.Line, esdl.SubPolygon)):
+        return compact_points(geometry, min_points)
+    if isinstance(geometry, esdl.Polygon):
+        count = compact_points(geometry.exterior, min_points) if geometry.exterior else 0
+        return count + sum(compact_points(interior, min_points) for interior in geometry.interior)
+    if isinstance(geometry, esdl.MultiLine):
+        return sum(compact_points(line, min_points) for line in geometry.line)
+    if isinstance(geometry, esdl.MultiPolygon):
+        return sum(compact_geometry(polygon, min_points) for polygon in geometry.polygon)
+    return 0
+
+
+def create_points(owner, lons, lats, min_compact_points=0):
+    """
+    Adds points with the given coordinates to a new Line or SubPolygon. The points are stored as CompactPoints if there
+    are at least min_compact_points of them (0 = never).
+    """
+    if min_compact_points and len(lats) >= min_compact_points:
+        feature = type(owner).point
+        owner.__dict__[feature.name] = CompactPoints(owner, feature, array('d', lats), array('d', lons))
+        owner._isset.add(feature)
+    else:
+        owner.point.extend([esdl.Point(lat=lat, lon=lon) for lon, lat in zip(lons, lats)])
+
+
+def is_compact(owner):
+    return isinstance(owner.__dict__.get('point'), CompactPoints)
+
+
+def get_coordinates(owner):
+    """Returns the list of (lon, lat) tuples of the points of a Line or SubPolygon, without materializing them"""
+    points = owner.__dict__.get('point')
+    if isinstance(points, CompactPoints):
+        return points.coordinates()
+    return [(p.lon, p.lat) for p in owner.point]
+
+
+def get_coordinate(owner, index):
+    """Returns the (lon, lat) tuple of one point (index can be negative) of a Line or SubPolygon or None"""
+    points = owner.__dict__.get('point')
+    if isinstance(points, CompactPoints):
+        return (points.lon[index], points.lat[index]) if -len(points) <= index < len(points) else None
+    points = owner.point
+    if -len(points) <= index < len(points):
+        point = points[index]
+        return (point.lon, point.lat)
+    return None
@@ -0,0 +1,203 @@
+#  This work is based on original code developed and copyrighted by TNO 2020.
+#  Subsequent contributions are licensed to you by the developers of such code and are
+#  made available to the Project under one or several contributor license agreements.
+#
+#  This work is licensed to you under the Apache License, Version 2.0.
+#  You may obtain a copy of the license at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#      TNO         - Initial implementation
+#  Manager:
+#      TNO
+
+"""
+Compact binary snapshot format of the model graph of one or more resources, used to persist an EnergySystemHandler
+in a session much faster than serializing to and parsing from XML.
+
+All objects of all resources are stored in a flat table, classes and features are stored once in a header and are
+referred to by integer indices, as are (containment and cross) references between objects:
+
+    (SNAPSHOT_MAGIC, SNAPSHOT_VERSION,
+     classes:    [(nsURI, class name), ...],
+     features:   [[feature name, ...] per class],
+     objects:    [(class index, [feature index, value, ...], [feature index, object index(es), ...]
+                   [, [feature index, (lat, lon, elevation) arrays of compact points, ...]]), ...],
+     resources:  [(uri, [root object index, ...]), ...])
+
+The tuple is pickled and compressed with zlib.
+"""
+
+import pickle
+import zlib
+from pyecore.ecore import EEnum
+from esdl.processing.ESDLGeometry import CompactPoints
+import src.log as log
+
+logger = log.get_logger(__name__)
+
+SNAPSHOT_MAGIC = 'ESDL-SNAPSHOT'
+SNAPSHOT_VERSION = 2
+
+
+def _features(eclass):
+    """Features that are part of a snapshot, in a fixed order (same as used by the XML serialization)"""
+    return [f for f in eclass.eAllStructuralFeatures()
+            if not f.derived and not f.transient and not (f.is_reference and f.eOpposite and f.eOpposite.containment)]
+
+
+def _all_contents(root):
+    """Yields root and all objects that are contained in it, without materializing compact points"""
+    stack = [root]
+    while stack:
+        obj = stack.pop()
+        yield obj
+        for feat in obj._isset:
+            if feat.is_reference and feat.containment and not isinstance(obj.__dict__.get(feat.name), CompactPoints):
+                value = obj.eGet(feat)
+                if feat.many:
+                    stack.extend(reversed(value))
+                elif value is not None:
+                    stack.append(value)
+
+
+# kinds of the values of the features of an object in loads()
+_ATTRIBUTE, _REFERENCE, _COMPACT = range(3)
+
+
+def dumps(resources, compress_level=1):
+    """
+    Creates a binary snapshot of a list of resources
+    :param resources: list of (uri, resource) tuples
+    :param compress_level: zlib compression level
+    :return: bytes
+    """
+    class_index = dict()        # eclass -> index
+    classes = []
+    class_features = []
+    object_index = dict()       # id(obj) -> index
+    object_list = []
+
+    # first pass: number all objects, such that references can be stored as indices
+    resource_list = []
+    for uri, resource in resources:
+        roots = []
+        for root in resource.contents:
+            for obj in _all_contents(root):
+                object_index[id(obj)] = len(object_list)
+                object_list.append(obj)
+            roots.append(object_index[id(root)])
+        resource_list.append((uri, roots))
+
+    objects = []
+    for obj in object_list:
+        eclass = obj.eClass
+        if eclass not in class_index:
+            class_index[eclass] = len(classes)
+            classes.append((eclass.ePackage.nsURI, eclass.name))
+            class_features.append(_features(eclass))
+        cidx = class_index[eclass]
+
+        attributes = []
+        references = []
+        compact = []
+        for fidx, feat in enumerate(class_features[cidx]):
+            if feat not in obj._isset:
+                continue
+            value = obj.__dict__.get(feat.name)
+            if isinstance(value, CompactPoints):
+                compact.extend((fidx, (value.lat, value.lon, value.elevation)))
+                continue
+            value = obj.eGet(feat)
+            if value is None:
+                continue
+            if feat.is_attribute:
+                is_enum = isinstance(feat.eType, EEnum)
+                if feat.many:
+                    if value:
+                        attributes.extend((fidx, [v.name if is_enum else v for v in value]))
+                elif value != feat.get_default_value():
+                    attributes.extend((fidx, value.name if is_enum else value))
+            else:
+                if feat.many:
+                    targets = []
+                    for v in value:
+                        target = object_index.get(id(v))
+                        if target is None:
+                            logger.warning('Snapshot: reference {}.{} to an object outside the resource set is not '
+                                           'stored'.format(eclass.name, feat.name))
+                        else:
+                            targets.append(target)
+                    if targets:
+                        references.extend((fidx, targets))
+                else:
+                    target = object_index.get(id(value))
+                    if target is None:
+                        logger.warning('Snapshot: reference {}.{} to an object outside the resource set is not '
+                                       'stored'.format(eclass.name, feat.name))
+                    else:
+                        references.extend((fidx, target))
+        objects.append((cidx, attributes, references, compact) if compact else (cidx, attributes, references))
+
+    features = [[f.name for f in feats] for feats in class_features]
+    data = (SNAPSHOT_MAGIC, SNAPSHOT_VERSION, classes, features, objects, resource_list)
+    return zlib.compress(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL), compress_level)
+
+
+def loads(data, metamodel_registry):
+    """
+    Restores the objects of a binary snapshot
+    :param data: bytes created by dumps()
+    :param metamodel_registry: dict of nsURI -> EPackage (e.g. ResourceSet.metamodel_registry)
+    :return: list of (uri, [root objects]) tuples
+    """
+    magic, version, classes, features, objects, resource_list = pickle.loads(zlib.decompress(data))
+    if magic != SNAPSHOT_MAGIC or version not in (1, SNAPSHOT_VERSION):     # version 1 has no compact points
+        raise ValueError('Unsupported snapshot format: {} version {}'.format(magic, version))
+
+    python_classes = []
+    class_features = []     # per class: [(feature name, many, enum type or None, feature), ...]
+    for (ns_uri, name), feature_names in zip(classes, features):
+        python_class = metamodel_registry[ns_uri].getEClassifier(name)
+        python_classes.append(python_class)
+        eclass = python_class.eClass
+        feats = []
+        for fname in feature_names:
+            feat = eclass.findEStructuralFeature(fname)
+            feats.append((fname, feat.many, feat.eType if isinstance(feat.eType, EEnum) else None, feat))
+        class_features.append(feats)
+
+    object_list = [python_classes[entry[0]]() for entry in objects]
+
+    # set the features of every object in the order of its class features (see _features()), attributes and references
+    # alike, such that restored objects are the same as the original ones, also in the order of obj._isset
+    for obj, (cidx, attributes, references, *compact) in zip(object_list, objects):
+        feats = class_features[cidx]
+        values = [(attributes[i], _ATTRIBUTE, attributes[i + 1]) for i in range(0, len(attributes), 2)]
+        values.extend((references[i], _REFERENCE, references[i + 1]) for i in range(0, len(references), 2))
+        if compact:
+            compact = compact[0]
+            values.extend((compact[i], _COMPACT, compact[i + 1]) for i in range(0, len(compact), 2))
+        values.sort(key=lambda v: v[0])
+        for fidx, kind, value in values:
+            fname, many, enum_type, feat = feats[fidx]
+            if kind == _COMPACT:
+                lat, lon, elevation = value
+                obj.__dict__[fname] = CompactPoints(obj, feat, lat, lon, elevation)
+                obj._isset.add(feat)
+            elif kind == _REFERENCE:
+                if many:
+                    getattr(obj, fname).extend([object_list[t] for t in value])
+                else:
+                    setattr(obj, fname, object_list[value])
+            elif many:
+                if enum_type is not None:
+                    value = [enum_type.getEEnumLiteral(v) for v in value]
+                getattr(obj, fname).extend(value)
+            else:
+                if enum_type is not None:
+                    value = enum_type.getEEnumLiteral(value)
+                setattr(obj, fname, value)
+
+    return [(uri, [object_list[r] for r in roots]) for uri, roots in resource_list]
@@ -12,8 +12,111 @@
 #  Manager:
 #      TNO
 
-from pyecore.resources.xmi import XMIResource, XMIOptions, XMI_URL, XSI_URL, XSI
-from lxml.etree import QName, Element, ElementTree
+from enum import unique, Enum
+from pyecore.resources.xmi import XMIResource, XMIOptions, XMI_URL, XSI_URL, XSI, XMI as XMI_PREFIX
+from pyecore.ecore import EProxy, EDataType
+from lxml.etree import QName, Element, SubElement, iterparse
+from esdl.processing.ESDLGeometry import CompactPoints
+import os
+import zlib
+
+
+@unique
+class XMLStreamingOptions(Enum):
+    """
+    Options for XMLResource.load():
+    PROGRESS_CALLBACK: function(bytes_read, total_bytes) that is called regularly while parsing, total_bytes is None
+                       if the size of the input is unknown
+    BATCH_CALLBACK:    function(list of EObjects) that is called with batches of the objects of the BATCH_TYPES while
+                       parsing continues. The objects are reported in document order when their element starts, so
+                       only their attributes are set, their contents are still being parsed and references are only
+                       resolved after the whole document is parsed
+    BATCH_TYPES:       tuple of classes of the objects that are reported to the BATCH_CALLBACK
+    BATCH_SIZE:        number of objects in a batch (default 1000)
+    GZIP_LEVEL:        for XMLResource.save(): compress the output with gzip with this level (1-9)
+    """
+    PROGRESS_CALLBACK = 0
+    BATCH_CALLBACK = 1
+    BATCH_TYPES = 2
+    BATCH_SIZE = 3
+    GZIP_LEVEL = 4
+
+
+PROGRESS_INTERVAL = 10000  # number of parsed elements between calls of the progress callback
+CHUNK_SIZE = 1 << 16  # approximate size of the chunks of serialized XML
+FEATURE_SKIP, FEATURE_DICT, FEATURE_ATTRIBUTE, FEATURE_REFERENCE, FEATURE_CONTAINMENT = range(5)
+SKIP_ELEMENT = object()  # marks an element whose children are not decoded
+
+
+class ProgressStream:
+    """Wraps an input stream to keep track of the number of bytes read by the parser"""
+    def __init__(self, stream):
+        self.stream = stream
+        self.bytes_read = 0
+        self.total_bytes = getattr(stream, 'total_bytes', None)
+        if self.total_bytes is None and hasattr(stream, 'getbuffer'):
+            self.total_bytes = stream.getbuffer().nbytes
+        elif self.total_bytes is None and hasattr(stream, 'fileno'):
+            try:
+                self.total_bytes = os.fstat(stream.fileno()).st_size
+            except Exception:
+                pass
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+ATTRIBUTE_ESCAPES = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;',
+                                   '\n': '&#10;', '\r': '&#13;', '\t': '&#9;'})
+TEXT_ESCAPES = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;', '\r': '&#13;'})
+
+
+def escape_attribute(value):
+    """Escapes an attribute value in the same way as lxml"""
+    return '"' + value.translate(ATTRIBUTE_ESCAPES) + '"'
+
+
+def escape_text(value):
+    return value.translate(TEXT_ESCAPES)
+
+
+class ChunkBuffer:
+    """
+    Collects the output of the XML serializer until it is taken as a chunk of UTF-8 encoded bytes, optionally
+    compressed with gzip
+    """
+    def __init__(self, gzip_level=None):
+        self.parts = []
+        self.size = 0
+        self.compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if gzip_level else None
+        self.compressed = []
+
+    def write(self, text):
+        self.parts.append(text)
+        self.size += len(text)
+
+    def close(self):
+        if self.compressor:
+            self.compressed.append(self.compressor.compress(self._encode()))
+            self.compressed.append(self.compressor.flush())
+            self.compressor = None
+
+    def _encode(self):
+        data = ''.join(self.parts).encode('UTF-8')
+        self.parts = []
+        self.size = 0
+        return data
+
+    def take(self):
+        if self.compressor:
+            self.compressed.append(self.compressor.compress(self._encode()))
+        if self.compressed:
+            data = b''.join(self.compressed)
+            self.compressed = []
+            return data
+        return self._encode()
 
 
 """
@@ -27,40 +130,315 @@ class XMLResource(XMIResource):
         self.prefixes = {}
         self.reverse_nsmap = {}
 
+    def load(self, options=None):
+        """
+        Streaming version of XMIResource.load(): the model is built while the document is parsed and the parsed
+        elements are discarded, such that the memory used by the parser does not grow with the size of the document.
+        See XMLStreamingOptions for the supported options.
+        """
+        self.options = options or {}
+        progress_callback = self.options.get(XMLStreamingOptions.PROGRESS_CALLBACK)
+        batch_callback = self.options.get(XMLStreamingOptions.BATCH_CALLBACK)
+        batch_types = self.options.get(XMLStreamingOptions.BATCH_TYPES, ())
+        batch_size = self.options.get(XMLStreamingOptions.BATCH_SIZE, 1000)
+        batch = []
+
+        stream = ProgressStream(self.uri.create_instream())
+        stack = []  # decoded EObjects of the elements that have been started but not ended
+        element_count = 0
+        for event, node in iterparse(stream, events=('start', 'end'), huge_tree=True, remove_comments=True):
+            if event == 'start':
+                if not stack:
+                    self._init_streaming(node)
+                    if '{{{0}}}XMI'.format(self.prefixes.get(XMI_PREFIX)) == node.tag:
+                        stack.append(SKIP_ELEMENT)    # the children are the model roots
+                    else:
+                        stack.append(self._init_modelroot(node))
+                elif stack[-1] is SKIP_ELEMENT and len(stack) == 1:
+                    stack.append(self._init_modelroot(node))
+                elif stack[-1] is SKIP_ELEMENT or self._is_text_node(stack[-1], node):
+                    # text nodes are decoded when their text is available
+                    stack.append(SKIP_ELEMENT)
+                else:
+                    eobject = self._decode_streaming_eobject(node, stack[-1])
+                    stack.append(eobject)
+                    if batch_callback and isinstance(eobject, batch_types):
+                        batch.append(eobject)
+                        if len(batch) >= batch_size:
+                            batch_callback(batch)
+                            batch = []
+            else:
+                stack.pop()
+                if stack and stack[-1] is not SKIP_ELEMENT and self._is_text_node(stack[-1], node):
+                    self._decode_eobject(node, stack[-1])
+                # discard the parsed element and its preceding siblings
+                node.clear()
+                parent = node.getparent()
+                if parent is not None:
+                    while node.getprevious() is not None:
+                        del parent[0]
+                element_count += 1
+                if progress_callback and element_count % PROGRESS_INTERVAL == 0:
+                    progress_callback(stream.bytes_read, stream.total_bytes)
+
+        if batch_callback and batch:
+            batch_callback(batch)
+
+        if self.contents:
+            self._decode_ereferences()
+
+        self._clean_registers()
+        self.uri.close_stream()
+        if progress_callback:
+            progress_callback(stream.bytes_read, stream.total_bytes)
+
+    def _init_streaming(self, xmlroot):
+        self.prefixes.update(xmlroot.nsmap)
+        self.reverse_nsmap = {v: k for k, v in self.prefixes.items()}
+
+        self.xsitype = '{{{0}}}type'.format(self.prefixes.get(XSI))
+        self.xmiid = '{{{0}}}id'.format(self.prefixes.get(XMI_PREFIX))
+        self.schema_tag = '{{{0}}}schemaLocation'.format(self.prefixes.get(XSI))
+
+        self.schema_locations = {}
+        schema_tag_list = xmlroot.attrib.get(self.schema_tag, '').split()
+        for prefix, path in zip(schema_tag_list[::2], schema_tag_list[1::2]):
+            if '#' not in path:
+                path = path + '#'
+            self.schema_locations[prefix] = EProxy(path, self)
+
+    def _is_text_node(self, parent_eobj, node):
+        """Returns True if the node is the value of an attribute of its parent (e.g. <name>value</name>)"""
+        if node.get('href') or self._is_none_node(node) or self._type_attribute(node):
+            return False
+        _, node_tag = self.extract_namespace(node.tag)
+        feature = self._find_feature(parent_eobj.eClass, node_tag)
+        return feature is not None and isinstance(feature.eType, EDataType)
+
+    def _decode_streaming_eobject(self, node, parent_eobj):
+        """Same as XMIResource._decode_eobject(), without decoding the children of the node"""
+        feat_container, eobject, eatts, erefs, from_tag = self._decode_node(parent_eobj, node)
+
+        for eattribute, value in eatts:
+            self._decode_eattribute_value(eobject, eattribute, value, from_tag)
+
+        if erefs:
+            self._later.append((eobject, erefs))
+
+        if not feat_container:
+            return SKIP_ELEMENT
+
+        if feat_container.many:
+            parent_eobj.__getattribute__(feat_container.name).append(eobject)
+        else:
+            parent_eobj.__setattr__(feat_container.name, eobject)
+        return eobject
+
     def save(self, output=None, options=None):
+        """
+        Writes the resource to the output stream in chunks, see iter_chunks(). Use the XMLStreamingOptions.GZIP_LEVEL
+        option to write gzip compressed XML.
+        """
         self.options = options or {}
         output = self.open_out_stream(output)
+        serialize_default = self.options.get(XMIOptions.SERIALIZE_DEFAULT_VALUES, False)
+        gzip_level = self.options.get(XMLStreamingOptions.GZIP_LEVEL)
+        for chunk in self.iter_chunks(serialize_default=serialize_default, gzip_level=gzip_level):
+            output.write(chunk)
+        output.flush()
+        self.uri.close_stream()
+
+    def iter_chunks(self, chunk_size=CHUNK_SIZE, serialize_default=False, gzip_level=None):
+        """
+        Serializes the resource to XML while the chunks are consumed (e.g. by a streaming HTTP response), without
+        building the whole XML document in memory.
+        :param chunk_size: approximate size of the chunks in bytes
+        :param serialize_default: also serialize attributes with default values
+        :param gzip_level: compress the XML with gzip with this level (1-9), None is uncompressed
+        :returns generator of bytes
+        """
+        if getattr(self, 'options', None) is None:
+            self.options = {}
         self.prefixes.clear()
         self.reverse_nsmap.clear()
 
-        serialize_default = \
-            self.options.get(XMIOptions.SERIALIZE_DEFAULT_VALUES,
-                             False)
-        nsmap = {XSI: XSI_URL} # remove XMI for XML serialization
+        for root in self.contents:
+            self.register_eobject_epackage(root)
+        nsmap = {XSI: XSI_URL}  # remove XMI for XML serialization
+        nsmap.update(self.prefixes)
+
+        self._feature_info = dict()
+        self._class_features = dict()
+        self._tag_names = {XSI_URL: XSI}  # namespace -> prefix
+        self._tag_names.update({uri: prefix for prefix, uri in nsmap.items()})
+        namespaces = ''.join(' xmlns:{}={}'.format(prefix, escape_attribute(uri)) for prefix, uri in nsmap.items())
 
+        buffer = ChunkBuffer(gzip_level)
+        buffer.write("<?xml version='1.0' encoding='UTF-8'?>\n")
         if len(self.contents) == 1:
-            root = self.contents[0]
-            self.register_eobject_epackage(root)
-            tmp_xmi_root = self._go_across(root, serialize_default)
+            yield from self._write_across(buffer, chunk_size, self.contents[0], serialize_default, 0, namespaces)
         else:
             # this case hasn't been verified for XML serialization
-            tag = QName(XMI_URL, 'XMI')
-            tmp_xmi_root = Element(tag)
+            self._tag_names[XMI_URL] = XMI_PREFIX
+            namespaces += ' xmlns:{}={}'.format(XMI_PREFIX, escape_attribute(XMI_URL))
+            buffer.write('<{}{}>\n'.format(self._tag_name(QName(XMI_URL, 'XMI')), namespaces))
             for root in self.contents:
-                root_node = self._go_across(root, serialize_default)
-                tmp_xmi_root.append(root_node)
+                yield from self._write_across(buffer, chunk_size, root, serialize_default, 1)
+            buffer.write('</{}>\n'.format(self._tag_name(QName(XMI_URL, 'XMI'))))
+        buffer.close()
+        yield buffer.take()
 
-        # update nsmap with prefixes register during the nodes creation
-        nsmap.update(self.prefixes)
-        xmi_root = Element(tmp_xmi_root.tag, nsmap=nsmap)
-        xmi_root[:] = tmp_xmi_root[:]
-        xmi_root.attrib.update(tmp_xmi_root.attrib)
-        #xmi_version = etree.QName(XMI_URL, 'version') # remove XMI version in XML serialization
-        #xmi_root.attrib[xmi_version] = '2.0'
-        tree = ElementTree(xmi_root)
-        tree.write(output,
-                   pretty_print=True,
-                   xml_declaration=True,
-                   encoding=tree.docinfo.encoding)
-        output.flush()
-        self.uri.close_stream()
+    def _tag_name(self, tag):
+        """Returns the prefixed name of an element or attribute tag, e.g. xsi:type for {http://...}type"""
+        qname = QName(tag)
+        if qname.namespace:
+            return '{}:{}'.format(self._tag_names[qname.namespace], qname.localname)
+        return qname.localname
+
+    def _start_tag(self, node, namespaces=''):
+        attributes = ''.join(' {}={}'.format(self._tag_name(key), escape_attribute(value))
+                             for key, value in node.attrib.items())
+        return '<' + self._tag_name(node.tag) + namespaces + attributes
+
+    def _write_across(self, buffer, chunk_size, obj, serialize_default, depth, namespaces=''):
+        """Writes an object and its contents (pretty printed), yields chunks when the buffer is full"""
+        node, children = self._build_node(obj, serialize_default)
+        if len(self.prefixes) > len(self._tag_names):
+            # the root element is already written, so declare the namespace of another package where it is used
+            for prefix, uri in self.prefixes.items():
+                if uri not in self._tag_names:
+                    self._tag_names[uri] = prefix
+                    namespaces += ' xmlns:{}={}'.format(prefix, escape_attribute(uri))
+        indent = '  ' * depth
+        start_tag = self._start_tag(node, namespaces)
+        if len(node) == 0 and not children:
+            buffer.write(indent + start_tag + '/>\n')
+        else:
+            buffer.write(indent + start_tag + '>\n')
+            sub_indent = indent + '  '
+            for sub in node:
+                if sub.text:
+                    buffer.write('{}{}>{}</{}>\n'.format(sub_indent, self._start_tag(sub), escape_text(sub.text),
+                                                         self._tag_name(sub.tag)))
+                else:
+                    buffer.write(sub_indent + self._start_tag(sub) + '/>\n')
+            for child in children:
+                yield from self._write_across(buffer, chunk_size, child, serialize_default, depth + 1)
+            buffer.write(indent + '</' + self._tag_name(node.tag) + '>\n')
+        if buffer.size >= chunk_size:
+            chunk = buffer.take()
+            if chunk:
+                yield chunk
+
+    @staticmethod
+    def _get_feature_info(feat):
+        """Returns (kind, name, many, eType, default value) of a feature, accessing them on the feature is slow"""
+        if feat.derived or feat.transient:
+            kind = FEATURE_SKIP
+        elif hasattr(feat.eType, 'eType') and feat.eType.eType is dict:
+            kind = FEATURE_DICT
+        elif feat.is_attribute:
+            kind = FEATURE_ATTRIBUTE
+        elif feat.eOpposite and feat.eOpposite.containment:
+            kind = FEATURE_SKIP
+        elif not feat.containment:
+            kind = FEATURE_REFERENCE
+        else:
+            kind = FEATURE_CONTAINMENT
+        default_value = feat.get_default_value() if kind == FEATURE_ATTRIBUTE and not feat.many else None
+        return kind, feat.name, feat.many, feat.eType, default_value
+
+    def _set_features(self, obj):
+        """
+        Returns the features that are set on an object in the order of eAllStructuralFeatures(), such that the order of
+        the attributes and elements doesn't depend on the iteration order of the set obj._isset
+        """
+        features = self._class_features.get(obj.eClass)
+        if features is None:
+            features = self._class_features[obj.eClass] = list(obj.eClass.eAllStructuralFeatures())
+        isset = obj._isset
+        result = [feat for feat in features if feat in isset]
+        if len(result) != len(isset):
+            result.extend(feat for feat in isset if feat not in features)
+        return result
+
+    def _build_node(self, obj, serialize_default=False):
+        """
+        Same as XMIResource._go_across(), but does not add the contained objects to the node
+        :returns (node, list of contained objects)
+        """
+        children = []
+        eclass = obj.eClass
+        if not obj.eContainmentFeature():  # obj is the root
+            epackage = eclass.ePackage
+            nsURI = epackage.nsURI
+            tag = QName(nsURI, eclass.name) if nsURI else eclass.name
+            node = Element(tag)
+        else:
+            node = Element(obj.eContainmentFeature().name)
+            if obj.eContainmentFeature().eType != eclass:
+                self._add_explicit_type(node, obj)
+
+        if self.use_uuid:
+            self._assign_uuid(obj)
+            xmi_id = '{{{0}}}id'.format(XMI_URL)
+            node.attrib[xmi_id] = obj._internal_id
+
+        for feat in self._set_features(obj):
+            info = self._feature_info.get(feat)
+            if info is None:
+                info = self._feature_info[feat] = self._get_feature_info(feat)
+            kind, feat_name, many, etype, default_value = info
+            if kind == FEATURE_SKIP:
+                continue
+            if kind == FEATURE_CONTAINMENT and isinstance(obj.__dict__.get(feat_name), CompactPoints):
+                # serialize the points of a compact geometry without adding them to the geometry
+                children.extend(obj.__dict__[feat_name].iter_points())
+                continue
+            value = obj.__getattribute__(feat_name)
+            if value is None:
+                if serialize_default:
+                    node.append(self._build_none_node(feat_name))
+                continue
+            if kind == FEATURE_DICT:
+                for key, val in value.items():
+                    entry = SubElement(node, feat_name)
+                    entry.attrib['key'] = key
+                    entry.attrib['value'] = val
+            elif kind == FEATURE_ATTRIBUTE:
+                if many:
+                    if value:
+                        to_str = etype.to_string
+                        result_list = [to_str(v) for v in value]
+                        if any(x.isspace() for string in result_list for x in string):
+                            for v in result_list:
+                                sub = SubElement(node, feat_name)
+                                sub.text = v
+                        else:
+                            node.attrib[feat_name] = ' '.join(result_list)
+                elif value != default_value or serialize_default:
+                    node.attrib[feat_name] = etype.to_string(value)
+            elif kind == FEATURE_REFERENCE:
+                if many:
+                    embedded = []
+                    for x in value:
+                        frag, cref = self._build_path_from(x)
+                        if cref:
+                            sub = SubElement(node, feat_name)
+                            sub.attrib['href'] = frag
+                            self._add_explicit_type(sub, x)
+                        else:
+                            embedded.append(frag)
+                    if embedded:
+                        node.attrib[feat_name] = ' '.join(embedded)
+                else:
+                    frag, is_crossref = self._build_path_from(value)
+                    if is_crossref:
+                        sub = SubElement(node, feat_name)
+                        sub.attrib['href'] = frag
+                        self._add_explicit_type(sub, value)
+                    else:
+                        node.attrib[feat_name] = frag
+            else:
+                children.extend(value if many else [value])
+        return node, children
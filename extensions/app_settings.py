@@ -16,7 +16,7 @@ from flask import Flask
 from flask_socketio import SocketIO
 from flask_executor import Executor
 from extensions.settings_storage import SettingsStorage
-from extensions.session_manager import get_handler
+from extensions.session_manager import get_handler, with_session_lock
 import src.log as log
 
 logger = log.get_logger(__name__)
@@ -39,6 +39,7 @@ class AppSettings:
         logger.info("Registering AppSettings extension")
 
         @self.socketio.on('app_settings', namespace='/esdl')
+        @with_session_lock
         def app_settings(prmtr):
             with self.flask_app.app_context():
                 esh = get_handler()
@@ -14,7 +14,7 @@
 
 from flask import Flask
 from flask_socketio import SocketIO, emit
-from extensions.session_manager import get_handler, get_session
+from extensions.session_manager import get_handler, get_session, with_session_lock
 import src.settings as settings
 import requests
 from esdl.processing import ESDLAsset, ESDLGeometry, ESDLEnergySystem
@@ -34,6 +34,7 @@ class BAG:
         logger.info('Registering BAG extension')
 
         @self.socketio.on('get_bag_contours', namespace='/esdl')
+        @with_session_lock
         def get_bag_contours(info):
             with self.flask_app.app_context():
                 print("getting bag information")
@@ -14,18 +14,23 @@
 
 from flask import Flask
 from flask_socketio import SocketIO, emit
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from shapely.geometry import shape, mapping, MultiPolygon
 
-import time
 import requests
+import shapely
 import json
+import math
 import uuid
 import re
 import os
 
 from esdl import esdl
 from esdl.processing import ESDLGeometry
-from extensions.session_manager import get_handler, get_session, set_session
+from extensions.session_manager import get_handler, get_session, set_session, with_session_lock
 from extensions.settings_storage import SettingsStorage
+from src.boundary_cache import BoundaryCache
 
 import src.settings as settings
 import src.log as log
@@ -59,8 +64,10 @@ boundary_service_mapping = {
     'COUNTRY': 'countries'
 }
 
-#create a cache for the boundary service
-boundary_cache = dict()
+# cache for the boundary service, shared by all users
+boundary_cache = BoundaryCache(directory=settings.BOUNDARY_CACHE_DIR or None,
+                               memory_size=settings.BOUNDARY_CACHE_MEMORY_MB * 1024 * 1024,
+                               ttl=settings.BOUNDARY_CACHE_TTL_DAYS * 24 * 60 * 60)
 DEFAULT_BOUNDARIES_YEAR = 2019
 
 
@@ -68,6 +75,58 @@ def is_valid_boundary_id(id):
     return re.match('PV[0-9]{2,2}|RES[0-9]{2,2}|GM[0-9]{4,4}|WK[0-9]{6,6}|BU[0-9]{8,8}|[0-9]{2,2}', id.upper())
 
 
+# Boundaries are sent to the browser in a simplified version that fits the zoom level of the map. A version is created
+# for every zoom level in this list, the last level (and higher zoom levels) use the boundary at full resolution
+BOUNDARY_ZOOM_LEVELS = (5, 8, 11, 14)
+MAP_SIZE_PIXELS = 1024  # used to estimate the zoom level at which an area fits the map
+
+
+def boundary_zoom_level(zoom):
+    level = BOUNDARY_ZOOM_LEVELS[0]
+    for zoom_level in BOUNDARY_ZOOM_LEVELS:
+        if zoom >= zoom_level:
+            level = zoom_level
+    return level
+
+
+def simplification_tolerance(zoom_level):
+    """Tolerance in degrees for a zoom level: half the size of a pixel, 0 for full resolution"""
+    if zoom_level >= BOUNDARY_ZOOM_LEVELS[-1]:
+        return 0
+    return 0.5 * 360 / (256 * 2 ** zoom_level)
+
+
+def zoom_for_bounds(bounds):
+    """Estimates the zoom level of a map that shows the bounds (min_lon, min_lat, max_lon, max_lat)"""
+    min_lon, min_lat, max_lon, max_lat = bounds
+    # latitudes are stretched by the web mercator projection
+    span = max(max_lon - min_lon, (max_lat - min_lat) / math.cos(math.radians((min_lat + max_lat) / 2)))
+    if span <= 0:
+        return BOUNDARY_ZOOM_LEVELS[-1]
+    return int(math.log2(MAP_SIZE_PIXELS * 360 / (256 * span)))
+
+
+def simplify_geometries(geometries, tolerance):
+    """
+    Simplifies a list of shapely geometries. If available, coverage simplification is used, that keeps the shared
+    edges of adjacent areas identical, such that no gaps or overlaps occur between neighbouring areas. Otherwise
+    every geometry is simplified independently, preserving its topology.
+    """
+    coverage_simplify = getattr(shapely, 'coverage_simplify', None)
+    if coverage_simplify and len(geometries) > 1:
+        try:
+            return list(coverage_simplify(geometries, tolerance))
+        except Exception as e:
+            logger.warning('Coverage simplification of boundaries failed: {}'.format(e))
+    return [geometry.simplify(tolerance, preserve_topology=True) for geometry in geometries]
+
+
+def boundary_url(year, scope, id):
+    return 'http://' + settings.boundaries_config["host"] + ':' + settings.boundaries_config["port"] + \
+           settings.boundaries_config["path_boundaries"] + '/YEAR/' + str(year) + '/' + \
+           boundary_service_mapping[scope.name] + '/' + id
+
+
 # ---------------------------------------------------------------------------------------------------------------------
 #  Get boundary information
 # ---------------------------------------------------------------------------------------------------------------------
@@ -77,6 +136,12 @@ class BoundaryService:
         self.socketio = socket
         self.settings_storage = settings_storage
         self.plugin_settings = self.get_settings()
+
+        # pooled HTTP connections to the boundary service, used by the threads that fetch missing boundaries
+        max_connections = settings.BOUNDARY_SERVICE_MAX_CONNECTIONS
+        self.http_session = requests.Session()
+        self.http_session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=max_connections))
+        self.fetch_executor = ThreadPoolExecutor(max_workers=max_connections, thread_name_prefix='BoundaryService')
         self.register()
 
         if settings.boundaries_config["host"] is None or settings.boundaries_config["host"] == "":
@@ -121,7 +186,7 @@ class BoundaryService:
                     url = 'http://' + settings.boundaries_config["host"] + ':' + settings.boundaries_config["port"] + \
                           settings.boundaries_config["path_names"] + '/YEAR/' + boundaries_year + '/' + scope_type
                     print(url)
-                    r = requests.get(url)
+                    r = self.http_session.get(url)
                     if len(r.text) > 0:
                         reply = json.loads(r.text)
                         return {"boundaries_names": reply}
@@ -144,7 +209,7 @@ class BoundaryService:
                           settings.boundaries_config["path_names"] + '/YEAR/' + boundaries_year + '/' \
                           + select_scope_type + '/' + select_scope_id + '/' + scope_type
                     print(url)
-                    r = requests.get(url)
+                    r = self.http_session.get(url)
                     if len(r.text) > 0:
                         reply = json.loads(r.text)
                         return {"boundaries_names": reply}
@@ -171,6 +236,7 @@ class BoundaryService:
             self.set_user_setting(user, setting['name'], setting['value'])
 
         @self.socketio.on('get_boundary_info', namespace='/esdl')
+        @with_session_lock
         def get_boundary_info(info):
             print('get_boundary_info:')
             print(info)
@@ -201,8 +267,9 @@ class BoundaryService:
 
             area_list = []
             boundary = None
+            boundaries = None
             if subscope_enabled:
-                self.__preload_subboundaries_in_cache(boundaries_year, esdl.AreaScopeEnum.from_string(str.upper(scope)),
+                boundaries = self.__preload_subboundaries_in_cache(boundaries_year, esdl.AreaScopeEnum.from_string(str.upper(scope)),
                                                esdl.AreaScopeEnum.from_string(str.upper(subscope)),
                                                str.upper(identifier))
             else:
@@ -254,9 +321,7 @@ class BoundaryService:
                     #    emit('area_boundary', {'info-type': 'MP-RD', 'crs': 'RD', 'boundary': boundary})
 
             if subscope_enabled:
-                boundaries = self.__get_subboundaries_from_service(boundaries_year, esdl.AreaScopeEnum.from_string(str.upper(scope)),
-                                                            esdl.AreaScopeEnum.from_string(str.upper(subscope)),
-                                                            str.upper(identifier))
+                # boundaries were requested from the service by __preload_subboundaries_in_cache
                 # result (boundaries) is an ARRAY of:
                 # {'code': 'BU00140500', 'geom': '{"type":"MultiPolygon","bbox":[...],"coordinates":[[[[6.583651,53.209594],
                 # [6.58477,...,53.208816],[6.583651,53.209594]]]]}'}
@@ -347,37 +412,86 @@ class BoundaryService:
         :return: the geomertry of the indicated 'scope'
         """
         if is_valid_boundary_id(id):
-            time.sleep(0.01) # yield a little concurrency when running this in a thread
-
-            if str(year)+id in boundary_cache:
-                # print('Retrieve boundary from cache', str(year)+id)
-                # res_boundary = copy.deepcopy(boundary_cache[id])   # this doesn't solve messing up cache
-                # return res_boundary
-                return boundary_cache[str(year)+id]
-
-            try:
-                url = 'http://' + settings.boundaries_config["host"] + ':' + settings.boundaries_config["port"] + \
-                      settings.boundaries_config["path_boundaries"] + '/YEAR/' + str(year) + '/' + boundary_service_mapping[scope.name] + '/' + id
-                # print('Retrieve from boundary service', id)
-                r = requests.get(url)
-                if len(r.text) > 0:
-                    reply = json.loads(r.text)
-                    # geom = reply['geom']
-                    # {'type': 'MultiPolygon', 'coordinates': [[[[253641.50000000006, 594417.8126220703], [253617, .... ,
-                    # 594477.125], [253641.50000000006, 594417.8126220703]]]]}, 'code': 'BU00030000', 'name': 'Appingedam-Centrum',
-                    # 'tCode': 'GM0003', 'tName': 'Appingedam'}
-                    boundary_cache[str(year)+id] = reply
-                    return reply
-                else:
-                    print("WARNING: Empty response for Boundary service for {} with id {}".format(scope.name, id))
-                    return None
+            boundary = boundary_cache.get(year, id)
+            if boundary is not None:
+                return boundary
+            return self.__fetch_boundary(year, scope, id)
+        else:
+            return None
 
-            except Exception as e:
-                print('ERROR in accessing Boundary service for {} with id {}: {}'.format(scope.name, id, e))
+    def __fetch_boundary(self, year, scope, id):
+        """Requests a boundary from the boundary service and stores it in the cache"""
+        try:
+            # print('Retrieve from boundary service', id)
+            r = self.http_session.get(boundary_url(year, scope, id))
+            if r.status_code == 200 and len(r.content) > 0:
+                reply = json.loads(r.content)
+                # geom = reply['geom']
+                # {'type': 'MultiPolygon', 'coordinates': [[[[253641.50000000006, 594417.8126220703], [253617, .... ,
+                # 594477.125], [253641.50000000006, 594417.8126220703]]]]}, 'code': 'BU00030000', 'name': 'Appingedam-Centrum',
+                # 'tCode': 'GM0003', 'tName': 'Appingedam'}
+                boundary_cache.put(year, id, r.content)
+                return reply
+            else:
+                print("WARNING: Empty response for Boundary service for {} with id {}".format(scope.name, id))
                 return None
-        else:
+
+        except Exception as e:
+            print('ERROR in accessing Boundary service for {} with id {}: {}'.format(scope.name, id, e))
             return None
 
+    def get_boundaries_from_service(self, year, scopes_and_ids):
+        """
+        Gets the boundaries of a list of areas, the boundaries that are not in the cache are fetched in parallel
+        :param scopes_and_ids: list of (scope, id) tuples
+        :return: dict of id -> boundary (None if no boundary is available)
+        """
+        boundaries = dict()
+        missing = []
+        for scope, id in scopes_and_ids:
+            if id not in boundaries:
+                boundaries[id] = boundary_cache.get(year, id)
+                if boundaries[id] is None:
+                    missing.append((scope, id))
+
+        if missing:
+            logger.info('Fetching {} boundaries from the boundary service'.format(len(missing)))
+            fetched = self.fetch_executor.map(lambda scope_and_id: self.__fetch_boundary(year, *scope_and_id), missing)
+            for (scope, id), boundary in zip(missing, fetched):
+                boundaries[id] = boundary
+        return boundaries
+
+    def simplify_boundaries(self, year, boundaries, zoom):
+        """
+        Gets the simplified version of boundaries for a zoom level of the map, from the cache or by simplifying them
+        :param boundaries: dict of id -> boundary at full resolution (or None)
+        :return: dict of id -> simplified boundary (or None)
+        """
+        zoom_level = boundary_zoom_level(zoom)
+        tolerance = simplification_tolerance(zoom_level)
+        if not tolerance:
+            return boundaries
+
+        simplified = dict()
+        groups = dict()     # areas of the same type (and so the same scope) form a coverage
+        for id, boundary in boundaries.items():
+            simplified[id] = boundary_cache.get(year, '{}@z{}'.format(id, zoom_level)) if boundary else None
+            if boundary and not simplified[id]:
+                groups.setdefault(re.match('[A-Z]*', id).group(), []).append(id)
+
+        for ids in groups.values():
+            geometries = [shape(boundaries[id]['geom']) for id in ids]
+            for id, geometry in zip(ids, simplify_geometries(geometries, tolerance)):
+                if geometry.geom_type == 'Polygon':
+                    geometry = MultiPolygon([geometry])
+                elif geometry.geom_type != 'MultiPolygon' or geometry.is_empty:
+                    geometry = shape(boundaries[id]['geom'])    # keep the full resolution boundary
+                boundary = dict(boundaries[id])
+                boundary['geom'] = mapping(geometry)
+                boundary_cache.put(year, '{}@z{}'.format(id, zoom_level), boundary)
+                simplified[id] = boundary
+        return simplified
+
     def __get_subboundaries_from_service(self, year, scope, subscope, id):
         """
         :param scope: any of the following: zipcode, neighbourhood, district, municipality, energyregion, province, country
@@ -392,7 +506,7 @@ class BoundaryService:
                       + settings.boundaries_config["path_boundaries"] + '/YEAR/' + str(year) + '/' \
                       + boundary_service_mapping[subscope.name] + '/' \
                       + boundary_service_mapping[scope.name] + '/' + id
-                r = requests.get(url)
+                r = self.http_session.get(url)
                 reply = json.loads(r.text)
                 # print(reply)
 
@@ -414,7 +528,8 @@ class BoundaryService:
             code = sub_boundary['code']
             geom = sub_boundary['geom']
             if code and geom:
-                boundary_cache[str(year)+code] = sub_boundary
+                boundary_cache.put(year, code, sub_boundary)
+        return sub_boundaries
 
     def preload_area_subboundaries_in_cache(self, top_area):
         user = get_session('user-email')
@@ -433,4 +548,10 @@ class BoundaryService:
             sub_area_scope = first_sub_area.scope
 
             if top_area_scope and sub_area_scope and is_valid_boundary_id(top_area_id):
-                self.__preload_subboundaries_in_cache(boundaries_year, top_area_scope, sub_area_scope, top_area_id)
\ No newline at end of file
+                # one request for all subboundaries, unless they are all in the cache already
+                for sub_area in sub_areas:
+                    if sub_area.id and is_valid_boundary_id(sub_area.id) and \
+                            (boundaries_year, str.upper(sub_area.id)) not in boundary_cache:
+                        self.__preload_subboundaries_in_cache(boundaries_year, top_area_scope, sub_area_scope,
+                                                              top_area_id)
+                        break
\ No newline at end of file
@@ -14,7 +14,7 @@
 
 from flask import Flask
 from flask_socketio import SocketIO
-from extensions.session_manager import get_handler, get_session
+from extensions.session_manager import get_handler, get_session, with_session_lock
 import src.settings as settings
 import requests
 import urllib
@@ -36,6 +36,7 @@ class ESStatisticsService:
         logger.info('Registering ESStatistics extension')
 
         @self.socketio.on('get_es_statistics', namespace='/esdl')
+        @with_session_lock
         def get_es_statistics():
             with self.flask_app.app_context():
                 esh = get_handler()
@@ -19,7 +19,7 @@ Handles the messages belonging to utils/esdl_browser.js
 
 from flask import Flask
 from flask_socketio import SocketIO, emit
-from extensions.session_manager import get_handler, get_session
+from extensions.session_manager import get_handler, get_session, with_session_lock
 from esdl.processing.EcoreDocumentation import EcoreDocumentation
 from esdl.processing.ESDLQuantityAndUnits import qau_to_string
 from esdl import esdl
@@ -54,6 +54,7 @@ class ESDLBrowser:
             emit('esdl_browse_to', browse_data, namespace='/esdl')
 
         @self.socketio.on('esdl_browse_create_object', namespace='/esdl')
+        @with_session_lock
         def socketio_create_object(message):
             # {'parent': {'id': parent_object.id, 'fragment': parent_object.fragment}, 'name': reference_data.name, 'type': types[0]}
             esh = get_handler()
@@ -82,6 +83,7 @@ class ESDLBrowser:
             emit('esdl_browse_to', browse_data, namespace='/esdl')
 
         @self.socketio.on('esdl_browse_delete_ref', namespace='/esdl')
+        @with_session_lock
         def socket_io_delete_ref(message):
             # esdl_browse_delete_ref
             active_es_id = get_session('active_es_id')
@@ -135,6 +137,7 @@ class ESDLBrowser:
 
         #esdl_browse_set_reference
         @self.socketio.on('esdl_browse_set_reference', namespace='/esdl')
+        @with_session_lock
         def socket_io_set_xreference(message):
             #{'parent': parent_object_identifier, 'name': data.ref.name, 'xref': data.xreferences[selected_ref]});
             parent_object: EObject = self.get_object_from_identifier(message['parent'])
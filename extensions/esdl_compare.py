@@ -14,7 +14,7 @@
 
 from flask import Flask
 from flask_socketio import SocketIO, emit
-from extensions.session_manager import get_handler
+from extensions.session_manager import get_handler, with_session_lock
 from xmldiff import main
 import src.log as log
 
@@ -31,6 +31,7 @@ class ESDLCompare:
         logger.info('Registering ESDL Compare extension')
 
         @self.socketio.on('esdl_compare', namespace='/esdl')
+        @with_session_lock
         def compare(esdls):
             with self.flask_app.app_context():
                 esh = get_handler()
@@ -28,11 +28,12 @@ Connects to the ESDL Drive API for file sharing
 
 from flask import Flask
 from flask_socketio import SocketIO, emit
-from extensions.session_manager import get_handler, get_session, set_session
+from extensions.session_manager import get_handler, get_session, set_session, with_session_lock
 import requests
 from pyecore.resources import URI, Resource
 from io import BytesIO
 from src.process_es_area_bld import process_energy_system
+from src.esdl_helper import create_load_callbacks
 from flask_executor import Executor
 import src.log as log
 from src.settings import esdl_drive_config
@@ -63,6 +64,7 @@ class ESDLDrive:
                 return self.browse_cdo(message)
 
         @self.socketio.on('cdo_open', namespace='/esdl')
+        @with_session_lock
         def socketio_esdldrive_open(message):
             with self.flask_app.app_context():
                 path = message['path']
@@ -71,7 +73,8 @@ class ESDLDrive:
                 logger.debug('ESDLDrive open: {} ({})'.format(message, uri.plain))
                 esh = get_handler()
                 try:
-                    es = esh.load_file(uri)
+                    progress_callback, batch_callback = create_load_callbacks(path)
+                    es = esh.load_file(uri, progress_callback=progress_callback, batch_callback=batch_callback)
                 except Exception as e:
                     logger.error("Error in loading file from ESDLDrive: "+ str(e))
                     #send_alert('Error loading ESDL file with id {} from store'.format(store_id))
@@ -91,6 +94,7 @@ class ESDLDrive:
                 self.executor.submit(process_energy_system, esh, None, title)  # run in seperate thread
 
         @self.socketio.on('cdo_save', namespace='/esdl')
+        @with_session_lock
         def socketio_esdldrive_save(message):
             with self.flask_app.app_context():
                 path = message['path']
@@ -99,14 +103,14 @@ class ESDLDrive:
                 active_es_id = get_session('active_es_id')
                 resource: Resource = esh.get_resource(active_es_id)
                 logger.debug('ESDLDrive saving resource {}'.format(resource.uri))
-                if resource.uri.normalize() == uri:
+                if resource.uri.normalize() == uri and isinstance(resource.uri, ESDLDriveHttpURI):
                     # resource already in CDO
                     logger.debug('Saving resource that is already loaded from ESDLDrive: {}'.format(resource.uri.plain))
-                    resource.save()
+                    resource.uri.upload(esh.to_chunks(active_es_id))
                 else:
                     logger.debug('Saving to a new resource in ESDLDrive: {}'.format(resource.uri.plain))
                     resource.uri = ESDLDriveHttpURI(uri, headers_function=add_authorization_header)
-                    resource.save()
+                    resource.uri.upload(esh.to_chunks(active_es_id))
                     esh.esid_uri_dict[resource.contents[0].id] = resource.uri.normalize()
                     # new resource
 
@@ -217,6 +221,7 @@ class ESDLDriveHttpURI(URI):
     def __init__(self, uri, headers_function=None):
         self.headers_function = headers_function
         self.writing = False
+        self.__stream = None
         super().__init__(uri)
 
     def create_instream(self):
@@ -225,11 +230,13 @@ class ESDLDriveHttpURI(URI):
         #self.__stream = urllib.request.urlopen(self.plain)
         print('ESDLDrive Downloading {}'.format(self.plain))
         headers = self.headers_function()
-        response = requests.get(self.plain, headers=headers)
+        # stream the response, such that the ESDL can be parsed while it is downloaded
+        response = requests.get(self.plain, headers=headers, stream=True)
         if response.status_code > 400:
             logger.error("Error reading from ESDLDrive: headers={}, response={}".format(response.headers, response.content))
             raise Exception("Error accessing {}: HTTP Status {}".format(self.plain, response.status_code))
-        self.__stream = BytesIO(response.content)
+        response.raw.decode_content = True
+        self.__stream = response.raw
         return self.__stream
 
 
@@ -261,7 +268,21 @@ class ESDLDriveHttpURI(URI):
             self.writing = False
             super().close_stream()
             return response
+        if self.__stream is not None:
+            self.__stream.close()  # release the streamed download
         super().close_stream()
 
+    def upload(self, chunks):
+        """Writes the content to the URI while it is generated (chunked transfer encoding), e.g. from
+        EnergySystemHandler.to_chunks(), instead of first writing everything to a stream"""
+        logger.debug("Uploading to {}".format(self.plain))
+        headers = self.headers_function()
+        response = requests.put(self.plain, data=chunks, headers=headers)
+        if response.status_code > 400:
+            logger.error("Error writing to ESDLDrive: headers={}, response={}".format(response.headers, response.content))
+            raise Exception("Error saving {}: HTTP Status {}".format(self.plain, response.status_code))
+        logger.debug('Saved successfully to ESDLDrive {} (HTTP status: {}) '.format(self.plain, response.status_code))
+        return response
+
     def apply_relative_from_me(self, relative_path):
         return self.plain
@@ -16,7 +16,7 @@ from flask import Flask, jsonify, session, abort
 from flask_socketio import SocketIO, emit
 from flask_executor import Executor
 from extensions.settings_storage import SettingsStorage
-from extensions.session_manager import get_handler, get_session, set_session, del_session
+from extensions.session_manager import get_handler, get_session, set_session, del_session, with_session_lock
 from src.essim_kpis import ESSIM_KPIs
 import requests
 import urllib
@@ -54,6 +54,7 @@ class ESSIM:
         logger.info("Registering ESSIM extension")
 
         @self.socketio.on('essim_set_simulation_id', namespace='/esdl')
+        @with_session_lock
         def set_simulation_id(sim_id):
             with self.flask_app.app_context():
                 esh = get_handler()
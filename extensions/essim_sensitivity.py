@@ -16,7 +16,7 @@ from flask import Flask
 from flask_socketio import SocketIO, emit
 from si_prefix import si_format
 from extensions.settings_storage import SettingsStorage
-from extensions.session_manager import get_handler, get_session, set_session, del_session
+from extensions.session_manager import get_handler, get_session, set_session, del_session, with_session_lock
 from esdl.processing import ESDLEcore
 from src.esdl_helper import get_port_profile_info
 from extensions.essim import ESSIM
@@ -59,6 +59,7 @@ class ESSIMSensitivity:
         logger.info("Registering ESSIM sensitivity extension")
 
         @self.socketio.on('essim_sensitivity_add_asset', namespace='/esdl')
+        @with_session_lock
         def essim_sensitivity_asset_info(id):
             with self.flask_app.app_context():
                 esh = get_handler()
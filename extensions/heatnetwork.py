@@ -23,7 +23,7 @@ from esdl.processing import ESDLAsset
 from uuid import uuid4
 from flask import Flask
 from flask_socketio import SocketIO, emit
-from extensions.session_manager import get_handler, get_session
+from extensions.session_manager import get_handler, get_session, with_session_lock
 import src.log as log
 
 logger = log.get_logger(__name__)
@@ -43,6 +43,7 @@ class HeatNetwork:
         logger.info('Registering HeatNetwork extension')
 
         @self.socketio.on('duplicate', namespace='/esdl')
+        @with_session_lock
         def socketio_duplicate(message):
             with self.flask_app.app_context():
                 esh = get_handler()
@@ -52,6 +53,7 @@ class HeatNetwork:
                 self.add_asset_and_emit(esh, active_es_id, duplicate, message['area_bld_id'])
 
         @self.socketio.on('reverse_conductor', namespace='/esdl')
+        @with_session_lock
         def reverse_conductor(message):
             # reverses the points in the line, so the in and outport are swapped
             esh = get_handler()
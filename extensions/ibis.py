@@ -14,7 +14,7 @@
 
 from flask import Flask, session
 from flask_socketio import SocketIO, emit
-from extensions.session_manager import get_handler, get_session
+from extensions.session_manager import get_handler, get_session, with_session_lock
 import src.settings as settings
 import requests
 import json
@@ -36,6 +36,7 @@ class IBISBedrijventerreinen:
         logger.info('Registering IBIS bedrijventerreinen extension')
 
         @self.socketio.on('ibis_bedrijventerreinen', namespace='/esdl')
+        @with_session_lock
         def get_ibis_contours(info):
             with self.flask_app.app_context():
                 print("getting ibis request")
@@ -14,10 +14,11 @@
 
 from flask import Flask
 from flask_socketio import SocketIO, emit
-from extensions.session_manager import get_handler, get_session, set_session
+from extensions.session_manager import get_handler, get_session, set_session, with_session_lock
 from extensions.settings_storage import SettingsStorage
-from influxdb import InfluxDBClient
 import src.settings as settings
+import src.timeseries as timeseries
+from src.ldc import ldc_cache
 import src.log as log
 
 logger = log.get_logger(__name__)
@@ -37,6 +38,7 @@ IELAG_DEFAULT_USER_CONFIG = {
 }
 
 FIELD_NAME = 'allocationEnergy'
+LDC_BATCH_SIZE = 200    # number of assets per (grouped) query of a batch of load duration curves
 CAPABILITY_FILTER = 'Transport'
 
 
@@ -99,6 +101,7 @@ class IELGAS:
             set_session('ielgas_monitor_ids', ielgas_monitor_ids)
 
         @self.socketio.on('request_ielgas_ldc', namespace='/esdl')
+        @with_session_lock
         def request_ielgas_ldc(info):
             asset_id = info['id']
             # set_session('ielgas_monitor_id', asset_id)
@@ -114,46 +117,99 @@ class IELGAS:
             power_pos = None
             power_neg = None
 
-            self.database_client = InfluxDBClient(host=self.plugin_settings['database_host'],
-                                                      port=self.plugin_settings['database_port'],
-                                                      database=self.plugin_settings['database_name'])
+            self.database_client = timeseries.get_client(host=self.plugin_settings['database_host'],
+                                                         port=self.plugin_settings['database_port'],
+                                                         database=self.plugin_settings['database_name'])
 
             user = get_session('user-email')
             user_config = self.get_user_settings(user)
 
-            results = dict()
+            # the measurement takes the place of the simulation run in the key of the cached curves
+            ldc = None
             measurements = user_config['measurements']
             for m in measurements:
                 try:
                     query = 'SELECT "'+FIELD_NAME+'" FROM "' + m + '" WHERE assetId=\'' + asset_id + '\''
-                    logger.debug(query)
-                    res = self.database_client.query(query)
-                    if res:
-                        results = res
+                    ldc = ldc_cache.get_curve((self.plugin_settings['database_name'], m, asset_id, FIELD_NAME),
+                                              self.database_client, query, FIELD_NAME)
+                    if ldc:
                         break
                 except Exception as e:
-                    logger.error('error with query: ', str(e))
-
-            first_key = list(results.keys())[0]
-            series = results[first_key]
-
-            ldc_series = []
-            for item in series:
-                ldc_series.append(item['allocationEnergy'])
-            ldc_series.sort(reverse=True)
-
-            ldc_series_decimate = []
-            for idx, item in enumerate(ldc_series):
-                if idx % 40 == 0:
-                    ldc_series_decimate.append(item * 1e6)
-                    if item > 0:
-                        power_pos = power
-                    if item < 0:
-                        power_neg = -power
-
-            emit('ldc-data', {'asset_name': asset_name, 'ldc_series': ldc_series_decimate, 'power_pos': power_pos,
+                    logger.error('error with query: {}'.format(e))
+
+            if not ldc:
+                logger.warn('query returned no results')
+                return
+
+            if ldc.has_positive:
+                power_pos = power
+            if ldc.has_negative:
+                power_neg = -power
+
+            emit('ldc-data', {'asset_name': asset_name, 'ldc_series': ldc.to_list(1e6), 'power_pos': power_pos,
                               'power_neg': power_neg})
 
+        @self.socketio.on('request_ielgas_ldcs', namespace='/esdl')
+        def request_ielgas_ldcs(info):
+            """info: {'asset_ids': [...]}"""
+            self.request_ldcs(info.get('asset_ids', []))
+
+    def request_ldcs(self, asset_ids):
+        """
+        Emits the load duration curves and summary statistics of a list of assets in chunks of 'ldc-batch-data'. Per
+        batch of LDC_BATCH_SIZE assets, each measurement is queried once (grouped by assetId) for the assets that
+        weren't found in the previous measurements.
+        """
+        active_es_id = get_session('active_es_id')
+        esh = get_handler()
+        assets = [esh.get_by_id(active_es_id, asset_id) for asset_id in asset_ids]
+        assets = [asset for asset in assets if asset is not None]
+
+        self.database_client = timeseries.get_client(host=self.plugin_settings['database_host'],
+                                                     port=self.plugin_settings['database_port'],
+                                                     database=self.plugin_settings['database_name'])
+        user = get_session('user-email')
+        measurements = self.get_user_settings(user)['measurements']
+
+        total = len(assets)
+        for start in range(0, total, LDC_BATCH_SIZE):
+            batch = assets[start:start + LDC_BATCH_SIZE]
+            curves = dict()
+            for m in measurements:
+                remaining = [asset.id for asset in batch if asset.id not in curves]
+                if not remaining:
+                    break
+                keys = {asset_id: (self.plugin_settings['database_name'], m, asset_id, FIELD_NAME)
+                        for asset_id in remaining}
+
+                def query(ids, measurement=m):
+                    return 'SELECT "' + FIELD_NAME + '" FROM "' + measurement + '" WHERE ' + \
+                           timeseries.tag_filter('assetId', ids) + ' GROUP BY "assetId"'
+
+                try:
+                    curves.update(ldc_cache.get_curves(keys, self.database_client, query, FIELD_NAME))
+                except Exception as e:
+                    logger.error('error with query: {}'.format(e))
+
+            results = list()
+            for asset in batch:
+                ldc = curves.get(asset.id)
+                if ldc is None:
+                    continue
+                power = None
+                if hasattr(asset, 'power'):
+                    power = asset.power
+                elif hasattr(asset, 'capacity'):
+                    power = asset.capacity
+                results.append({'asset_id': asset.id, 'asset_name': asset.name, 'ldc_series': ldc.to_list(1e6),
+                                'power_pos': power if ldc.has_positive else None,
+                                'power_neg': -power if ldc.has_negative and power is not None else None,
+                                'stats': ldc.stats(1e6, power)})
+            emit('ldc-batch-data', {'results': results, 'done': min(start + LDC_BATCH_SIZE, total), 'total': total})
+
+        if total == 0:
+            emit('ldc-batch-data', {'results': [], 'done': 0, 'total': 0})
+
     def get_user_settings(self, user):
         if self.settings_storage.has_user(user, IELGAS_USER_CONFIG):
             return self.settings_storage.get_user(user, IELGAS_USER_CONFIG)
@@ -0,0 +1,204 @@
+#  This work is based on original code developed and copyrighted by TNO 2020.
+#  Subsequent contributions are licensed to you by the developers of such code and are
+#  made available to the Project under one or several contributor license agreements.
+#
+#  This work is licensed to you under the Apache License, Version 2.0.
+#  You may obtain a copy of the license at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#      TNO         - Initial implementation
+#  Manager:
+#      TNO
+
+import threading
+import time
+import uuid
+from collections import deque
+from flask import Flask, session, copy_current_request_context
+from flask_socketio import SocketIO, emit
+from flask_executor import Executor
+from extensions.session_manager import get_session_lock
+import src.log as log
+
+logger = log.get_logger(__name__)
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_FINISHED = 'finished'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+
+PROGRESS_INTERVAL = 0.5     # minimal number of seconds between two job_progress events of a running job
+
+
+class JobCancelled(Exception):
+    pass
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+#  A job: a function that runs in a worker thread, with the request context of the socket event that created it
+# ---------------------------------------------------------------------------------------------------------------------
+class Job:
+    def __init__(self, client_id, name, func, args, kwargs):
+        self.id = str(uuid.uuid4())
+        self.client_id = client_id
+        self.name = name
+        self.status = JOB_QUEUED
+        self.done = 0
+        self.total = None
+        self.message = None
+        self._func = func
+        self._args = args
+        self._kwargs = kwargs
+        self._cancel_event = threading.Event()
+        self._last_emit = 0
+        # the job runs with (a copy of) the request context of the socket event that submitted it, such that the
+        # session and the emit functions refer to the client that submitted the job
+        self.run = copy_current_request_context(self._execute)
+
+    def info(self):
+        return {'job_id': self.id, 'name': self.name, 'status': self.status, 'done': self.done, 'total': self.total,
+                'message': self.message}
+
+    def emit_progress(self):
+        self._last_emit = time.monotonic()
+        emit('job_progress', self.info(), namespace='/esdl')
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def is_cancelled(self):
+        return self._cancel_event.is_set()
+
+    def check_cancelled(self):
+        """
+        Raises JobCancelled if the job is cancelled. Call this only at points where the job can stop without leaving
+        the energy system in an inconsistent state.
+        """
+        if self._cancel_event.is_set():
+            raise JobCancelled()
+
+    def progress(self, done, total=None, message=None):
+        """
+        Reports the progress of the job to the client, job_progress events are sent at most every PROGRESS_INTERVAL
+        seconds. Does not check for cancellation, see check_cancelled().
+        """
+        self.done = done
+        self.total = total
+        if message is not None:
+            self.message = message
+        if time.monotonic() - self._last_emit >= PROGRESS_INTERVAL:
+            self.emit_progress()
+
+    def _execute(self):
+        if self.is_cancelled():
+            return
+        self.status = JOB_RUNNING
+        self.emit_progress()
+        try:
+            self._func(*self._args, job=self, **self._kwargs)
+            self.status = JOB_FINISHED
+        except JobCancelled:
+            self.status = JOB_CANCELLED
+        except Exception as e:
+            logger.exception('Error in job {} ({})'.format(self.name, self.id))
+            self.status = JOB_FAILED
+            self.message = str(e)
+            emit('alert', 'Error executing {}: {}'.format(self.name, e), namespace='/esdl')
+        self.emit_progress()
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+#  Runs heavy commands in the executor, in submission order per session
+# ---------------------------------------------------------------------------------------------------------------------
+class JobManager:
+    """
+    Jobs of a session are queued and executed one after the other by a single worker at a time, such that the
+    commands of a client are executed in the order in which they were sent. Jobs of different sessions run in
+    parallel (limited by the number of workers of the executor). A job holds the lock of its session while it runs,
+    such that it doesn't run at the same time as socket events that change the same energy systems.
+
+    Emits 'job_progress' events with the job info (job_id, name, status, done, total, message) to the client. A client
+    can cancel a job with the 'cancel_job' event: queued jobs are removed from the queue, running jobs stop at the next
+    call of Job.check_cancelled().
+    """
+    def __init__(self, flask_app: Flask, socket: SocketIO, executor: Executor):
+        self.flask_app = flask_app
+        self.socketio = socket
+        self.executor = executor
+        self.lock = threading.Lock()
+        self.queues = dict()    # client_id -> deque of Jobs, the client_id is present as long as a worker is busy
+        self.jobs = dict()      # job_id -> Job, for all queued and running jobs
+        self.register()
+
+    def register(self):
+        logger.info('Registering JobManager extension')
+
+        @self.socketio.on('cancel_job', namespace='/esdl')
+        def cancel_job(message):
+            self.cancel(message['job_id'])
+
+        @self.socketio.on('get_jobs', namespace='/esdl')
+        def get_jobs():
+            client_id = session.get('client_id')
+            with self.lock:
+                return [job.info() for job in self.jobs.values() if job.client_id == client_id]
+
+    def has_jobs(self, client_id=None):
+        """Returns True if jobs are queued or running for this session (the current session by default)"""
+        if client_id is None:
+            client_id = session.get('client_id')
+        with self.lock:
+            return client_id in self.queues
+
+    def submit(self, name, func, *args, **kwargs):
+        """
+        Queues func(*args, job=job, **kwargs) to be run in a worker thread after all previously submitted jobs of the
+        current session. Must be called from a request or socket event context.
+        :return: the Job
+        """
+        client_id = session.get('client_id')
+        job = Job(client_id, name, func, args, kwargs)
+        with self.lock:
+            self.jobs[job.id] = job
+            start_worker = client_id not in self.queues
+            self.queues.setdefault(client_id, deque()).append(job)
+        job.emit_progress()
+        if start_worker:
+            self.executor.submit(self._run_queue, client_id)
+        return job
+
+    def cancel(self, job_id):
+        """Cancels a job of the current session"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.client_id != session.get('client_id'):
+                return False
+            job.cancel()
+            if job.status == JOB_QUEUED:
+                queue = self.queues.get(job.client_id)
+                if queue is not None and job in queue:
+                    queue.remove(job)
+                del self.jobs[job_id]
+                job.status = JOB_CANCELLED
+        if job.status == JOB_CANCELLED:
+            job.emit_progress()
+        logger.info('Cancelled job {} ({})'.format(job.name, job.id))
+        return True
+
+    def _run_queue(self, client_id):
+        while True:
+            with self.lock:
+                queue = self.queues[client_id]
+                if not queue:
+                    del self.queues[client_id]
+                    return
+                job = queue.popleft()
+            try:
+                with get_session_lock(client_id):
+                    job.run()
+            finally:
+                with self.lock:
+                    self.jobs.pop(job.id, None)
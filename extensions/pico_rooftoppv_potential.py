@@ -15,7 +15,7 @@
 from flask import Flask, jsonify
 from flask_socketio import SocketIO, emit
 from extensions.settings_storage import SettingsStorage
-from extensions.session_manager import get_handler, get_session
+from extensions.session_manager import get_handler, get_session, with_session_lock
 from esdl import esdl
 from esdl.processing import ESDLAsset, ESDLEnergySystem
 import src.settings as settings
@@ -43,6 +43,7 @@ class PICORooftopPVPotential:
         logger.info("Registering PICORooftopPVPotential extension")
 
         @self.socketio.on('use_part_of_potential', namespace='/esdl')
+        @with_session_lock
         def use_part_of_potential(pot_id, percentage):
             """
             Use part of a SolarPotential to install a PVInstallation
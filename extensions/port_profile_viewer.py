@@ -16,7 +16,7 @@ from flask import Flask
 from flask_socketio import SocketIO, emit
 from esdl import esdl
 from extensions.settings_storage import SettingsStorage
-from extensions.session_manager import get_handler, get_session
+from extensions.session_manager import get_handler, get_session, with_session_lock
 from extensions.profiles import create_panel
 from src.esdl_helper import get_port_profile_info
 from esdl.processing import ESDLQuantityAndUnits
@@ -43,6 +43,7 @@ class PortProfileViewer:
         logger.info("Registering PortProfileViewer extension")
 
         @self.socketio.on('port_profile_viewer_request_asset', namespace='/esdl')
+        @with_session_lock
         def port_profile_viewer_request_asset(id):
             with self.flask_app.app_context():
                 esh = get_handler()
@@ -51,6 +52,7 @@ class PortProfileViewer:
                 return get_port_profile_info(asset)
 
         @self.socketio.on('get_profile_panel', namespace='/esdl')
+        @with_session_lock
         def get_profile_panel(profile_id):
             esh = get_handler()
             active_es_id = get_session('active_es_id')
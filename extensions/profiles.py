@@ -18,7 +18,6 @@ from flask_executor import Executor
 from extensions.settings_storage import SettingType, SettingsStorage
 from extensions.session_manager import get_session
 from extensions.panel_service import create_panel
-from influxdb import InfluxDBClient
 import copy
 import src.log as log
 import csv
@@ -26,6 +25,7 @@ import locale
 from io import StringIO
 from uuid import uuid4
 import src.settings as settings
+import src.timeseries as timeseries
 
 logger = log.get_logger(__name__)
 
@@ -214,7 +214,7 @@ class Profiles:
                 })
 
             database = settings.profile_database_config['database']
-            client = InfluxDBClient(
+            client = timeseries.get_client(
                 host=settings.profile_database_config['host'],
                 port=settings.profile_database_config['port'],
                 username=settings.profile_database_config['upload_user'],
@@ -12,27 +12,126 @@
 #  Manager:
 #      TNO
 
-from flask import session
+from flask import session, jsonify, g, has_request_context
 from esdl.esdl_handler import EnergySystemHandler
+from src.session_store import MemorySessionBackend, DiskSessionBackend, LAST_ACCESSED_KEY
 from datetime import datetime
+from functools import wraps
+import os
 import threading
 import time
+import weakref
+import src.settings as settings
 import src.log as log
 
 logger = log.get_logger(__name__)
-managed_sessions = dict()
 ESH_KEY = 'esh'
-LAST_ACCESSED_KEY = 'last-accessed'
+# session keys with large values that the disk backend stores in a separate file and only loads when accessed
+SEPARATE_SESSION_KEYS = (ESH_KEY, 'conn_list', 'asset_list', 'area_bld_list')
 SESSION_TIMEOUT = 60*60*24  # 1 day
 CLEANUP_INTERVAL = 60*60  # every hour
 
 
+def create_session_backend():
+    memory_budget = settings.SESSION_MEMORY_BUDGET_MB * 2**20
+    if settings.SESSION_BACKEND == 'disk':
+        return DiskSessionBackend(settings.SESSION_STORE_DIR, settings.SESSION_MAX_IN_MEMORY, SEPARATE_SESSION_KEYS,
+                                  memory_budget)
+    elif settings.SESSION_BACKEND != 'memory':
+        logger.error('Unknown session backend {}, using memory backend'.format(settings.SESSION_BACKEND))
+    spill_directory = None
+    if settings.SESSION_SPILL_TO_DISK:
+        # sessions in memory belong to this process
+        spill_directory = os.path.join(settings.SESSION_STORE_DIR, 'spill-{}'.format(os.getpid()))
+    return MemorySessionBackend(memory_budget, spill_directory, SEPARATE_SESSION_KEYS)
+
+
+# client_id -> session (dict-like object with key-value pairs)
+managed_sessions = create_session_backend()
+
+# client_id -> lock of the session, for as long as it is in use
+_session_locks = weakref.WeakValueDictionary()
+_session_locks_lock = threading.Lock()
+
+
+def get_session_lock(client_id=None):
+    """
+    Returns the lock of a session (of the current client by default). Socket events, jobs and threads that use the
+    energy systems of a session hold its lock, such that the EnergySystemHandler and the connection and asset lists
+    are never changed by two threads at the same time.
+    """
+    if client_id is None:
+        client_id = session.get('client_id')
+    with _session_locks_lock:
+        lock = _session_locks.get(client_id)
+        if lock is None:
+            lock = threading.RLock()
+            _session_locks[client_id] = lock
+        return lock
+
+
+def with_session_lock(func):
+    """Decorator that runs a function while holding the lock of the session of the current client"""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with get_session_lock():
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def init_session_backend(flask_app):
+    """
+    Makes sure that the changes to the sessions are persisted and the memory budget is enforced at the end of every
+    request and socket.io event
+    """
+    @flask_app.teardown_request
+    def flush_sessions(exception=None):
+        locked_sessions = g.pop('locked_sessions', dict())
+        for client_session, lock in locked_sessions.values():
+            try:
+                managed_sessions.unlock_session(client_session)
+            finally:
+                lock.release()
+        managed_sessions.flush()
+
+    @flask_app.route('/sessions/stats')
+    def session_stats():
+        return jsonify(managed_sessions.stats()), 200
+
+
+def _get_client_session(client_id, create=False):
+    """
+    Returns the session of a client from the backend (creates it if create is True). If the backend locks sessions
+    (e.g. the disk backend, shared by processes), the session is locked from its first use in a request until the
+    changes of the request are written at the end of the request. The lock of the session in this process is taken
+    first, such that all threads take both locks in the same order.
+    """
+    if not managed_sessions.locks_sessions or not has_request_context():
+        return managed_sessions.create(client_id) if create else managed_sessions.get(client_id)
+    locked_sessions = g.setdefault('locked_sessions', dict())
+    if client_id in locked_sessions:
+        return locked_sessions[client_id][0]
+    lock = get_session_lock(client_id)
+    lock.acquire()
+    try:
+        client_session = managed_sessions.lock_session(client_id, create)
+    except Exception:
+        lock.release()
+        raise
+    if client_session is None:
+        lock.release()
+        return None
+    locked_sessions[client_id] = (client_session, lock)
+    return client_session
+
+
 def get_handler():
     global managed_sessions
     client_id = session['client_id']
-    if client_id in managed_sessions:
-        if ESH_KEY in managed_sessions[client_id]:
-            esh = managed_sessions[client_id][ESH_KEY]
+    client_session = _get_client_session(client_id)
+    if client_session is not None:
+        if ESH_KEY in client_session:
+            esh = client_session[ESH_KEY]
             logger.debug('Retrieve ESH client_id={}, es.name={}'.format(client_id, esh.get_energy_system().name))
         else:
             logger.warning('No EnergySystemHandler in session. Returning empty energy system')
@@ -67,10 +166,9 @@ def set_session(key, value):
     if 'client_id' not in session:
         logger.warning('No client_id for the session is available, cannot set value for key {}'.format(key))
     client_id = session['client_id']
-    if client_id not in managed_sessions:
-        managed_sessions[client_id] = dict()
-    managed_sessions[client_id][LAST_ACCESSED_KEY] = datetime.now()
-    managed_sessions[client_id][key] = value
+    client_session = _get_client_session(client_id, create=True)
+    client_session[LAST_ACCESSED_KEY] = datetime.now()
+    client_session[key] = value
     #logger.debug(managed_sessions)
 
 
@@ -85,15 +183,16 @@ def get_session(key=None):
         logger.warning('No client id for the session is available, cannot return value for key {}'.format(key))
         return None
     client_id = session['client_id']
-    if client_id not in managed_sessions:
+    client_session = _get_client_session(client_id)
+    if client_session is None:
         logger.warning('No client id in the managed_sessions is available, cannot return value for key {}'.format(key))
         return None
     else:
         if key is None:
-            return managed_sessions[client_id]
+            return client_session
         else:
             try:
-                return managed_sessions[client_id][key]
+                return client_session[key]
             except:
                 return None
 
@@ -101,26 +200,20 @@ def get_session(key=None):
 def del_session(key):
     global managed_sessions
     client_id = session['client_id']
-    if client_id not in managed_sessions:
+    client_session = _get_client_session(client_id)
+    if client_session is None:
         logger.warning('No client id for the session is available, cannot return value for key {}'.format(key))
         return None
     else:
-        if key in managed_sessions[client_id]:
-            del managed_sessions[client_id][key]
+        if key in client_session:
+            del client_session[key]
 
 
-# does not work
 def clean_up_sessions():
     global managed_sessions
     logger.debug('Current Thread %s' % threading.currentThread().getName())
     logger.info('Clean up sessions: current number of sessions: {}'.format(len(managed_sessions)))
-    for key in list(managed_sessions.keys()): # make a copy of the keys in the list
-        last_accessed = managed_sessions[key][LAST_ACCESSED_KEY]
-        now = datetime.now()
-        difference = (now - last_accessed).total_seconds()
-        if difference > SESSION_TIMEOUT:
-            logger.info('Cleaning up session with client_id={}'.format(key))
-            del managed_sessions[key]
+    managed_sessions.clean_up(SESSION_TIMEOUT)
 
 
 def schedule_session_clean_up():
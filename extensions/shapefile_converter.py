@@ -15,19 +15,22 @@
 from flask import Flask, session
 from flask_socketio import SocketIO, emit
 from flask_executor import Executor
-from extensions.session_manager import get_handler, get_session, set_session
+from extensions.session_manager import get_handler, get_session, set_session, with_session_lock
 import esdl.esdl as esdl
 import os
 import zipfile
 import tempfile
 import glob
 from uuid import uuid4
-from esdl.processing.ESDLGeometry import distance
+from esdl.processing.ESDLGeometry import distance, create_points
 from pyproj import Proj, Transformer
 from pyecore.ecore import EClass
+from itertools import islice
 import shapefile
 import importlib
+import time
 from src.process_es_area_bld import process_energy_system
+import src.settings as settings
 import src.log as log
 
 logger = log.get_logger(__name__)
@@ -37,6 +40,9 @@ inner_diameter_keys = ('inner diam', 'diameter', 'inner diameter', 'innerdiamete
 outer_diameter_keys = ('outer diam', 'diameter', 'outer diameter', 'outerdiameter')
 name_keys = ('name', 'naam', 'layer')
 
+BATCH_SIZE = 1000           # number of shape records that are read and of which the coordinates are transformed at once
+PROGRESS_INTERVAL = 0.5     # minimal number of seconds between two shpcvrt_progress events of a shapefile
+
 #FIXME: the row-indexed array won't work if multiple people are uploading zipfiles
 #FIXME: the tempdir is never cleaned
 #FIXME: use a unique id to have a common link to a zipfile and store the tempdir
@@ -94,6 +100,7 @@ class ShapefileConverter:
                 emit('shpcvrt_files_in_zip', {"zipfile_row": zipfile_row, "files": found_shape_files}, namespace='/esdl')
 
         @self.socketio.on('shpcvrt_receive_energyasset_info', namespace='/esdl')
+        @with_session_lock
         def receive_energyasset_info(shapefile_energyasset_list):
             with self.flask_app.app_context():
                 print("Received shpcvrt_receive_energyasset_info")
@@ -103,10 +110,14 @@ class ShapefileConverter:
                 es = esh.get_energy_system(active_es_id)
                 area = es.instance[0].area
 
+                # the shapefiles are converted in parallel on the executor into new subareas, which are added to the
+                # energy system in this thread when they are complete
+                conversions = []
                 for shapefile_energyasset in shapefile_energyasset_list:
                     energy_asset = shapefile_energyasset['energy_asset']
                     shapefile_name = shapefile_energyasset['shapefile_name']
                     zipfile_row = shapefile_energyasset['zipfile_row']
+                    row = shapefile_energyasset.get('row')
                     # zipfile_name = self.zipfiles[int(zipfile_row)]
 
                     # directory = get_session('shapefile_dir' + zipfile_row)
@@ -116,8 +127,19 @@ class ShapefileConverter:
                     if energy_asset != 'ignore':
                         basename = os.path.basename(shapefile_name_base)
                         subarea = esdl.Area(id=str(uuid4()), name=basename)
-                        area.area.append(subarea)
-                        self.process_shapefile(subarea, shapefile_name_base, energy_asset)
+                        future = self.executor.submit(self.process_shapefile, subarea, shapefile_name_base,
+                                                      energy_asset, zipfile_row, row)
+                        conversions.append((shapefile_name, subarea, future))
+
+                for shapefile_name, subarea, future in conversions:
+                    try:
+                        future.result()
+                    except Exception as e:
+                        logger.exception('Error converting shapefile {}'.format(shapefile_name))
+                        emit('alert', 'Error converting shapefile {}: {}'.format(os.path.basename(shapefile_name), e),
+                             namespace='/esdl')
+                        continue
+                    area.area.append(subarea)
                 # update uuid_dict recursively for the main area (could take long?)
                 esh.add_object_to_dict(es_id=active_es_id, esdl_object=area, recursive=True)
                 self.executor.submit(process_energy_system, esh=esh, filename='test', force_update_es_id=active_es_id)
@@ -135,134 +157,151 @@ class ShapefileConverter:
         transformer = Transformer.from_proj(proj_from=projection_in, proj_to=projection_out)
         return transformer
 
-    def process_shapefile(self, area, filename, energy_asset):
-        sf = shapefile.Reader(filename)
+    def process_shapefile(self, area, filename, energy_asset, zipfile_row=None, row=None):
         with open(filename + '.prj', 'r') as project_file:
             data = project_file.read()
             transformer = self.get_coordinate_transformer(wkt=data)
 
-        print("File: ", filename)
-        print("- Shapefile: ", sf)
-        print("- Fields: ", sf.fields)
-        print("- Shaperecords: ", sf.shapeRecords())
+        with shapefile.Reader(filename) as sf:
+            total = len(sf)
+            logger.debug("File: {}".format(filename))
+            logger.debug("- Shapefile: {}".format(sf))
+            logger.debug("- Fields: {}".format(sf.fields))
+            logger.debug("- Number of shape records: {}".format(total))
+
+            last_emit = 0
+
+            def progress(done):
+                nonlocal last_emit
+                if done == total or time.monotonic() - last_emit >= PROGRESS_INTERVAL:
+                    last_emit = time.monotonic()
+                    emit('shpcvrt_progress', {'zipfile_row': zipfile_row, 'row': row, 'done': done, 'total': total},
+                         namespace='/esdl')
+
+            self.to_esdl(area, sf, transformer, energy_asset, progress)
+
+    @staticmethod
+    def iter_batches(sf):
+        """Yields lists of BATCH_SIZE shape records, without reading all records of the shapefile in memory"""
+        shape_records = sf.iterShapeRecords()
+        while True:
+            batch = list(islice(shape_records, BATCH_SIZE))
+            if not batch:
+                return
+            yield batch
+
+    @staticmethod
+    def transform_batch(transformer, batch):
+        """Transforms the coordinates of all shapes of a batch at once, returns a (lons, lats) tuple per shape"""
+        xs = []
+        ys = []
+        for shape_record in batch:
+            for point in shape_record.shape.points:
+                xs.append(point[0])
+                ys.append(point[1])
+        if not xs:
+            return [([], []) for _ in batch]
+        all_lons, all_lats = transformer.transform(xs, ys)
+        coordinates = []
+        start = 0
+        for shape_record in batch:
+            end = start + len(shape_record.shape.points)
+            coordinates.append((all_lons[start:end], all_lats[start:end]))
+            start = end
+        return coordinates
+
+    def to_esdl(self, area, sf, transformer, energy_asset, progress_callback=None):
+        i = 0
+        for batch in self.iter_batches(sf):
+            assets = []
+            areas = []
+            for shapeRecord, (lons, lats) in zip(batch, self.transform_batch(transformer, batch)):
+                i += 1
+                if shapeRecord.shape.shapeType == shapefile.POLYLINE:
+                    pipe = esdl.Pipe(name=area.name + '-Pipe' + str(i), id=str(uuid4()))
+                    line = esdl.Line()
+                    create_points(line, lons, lats, settings.COMPACT_GEOMETRY_MIN_POINTS)
+                    d = 0.0
+                    for j in range(1, len(lats)):
+                        d = d + distance((lats[j - 1], lons[j - 1]), (lats[j], lons[j]))
+                    pipe.length = d * 1000  # in m instead of km
+
+                    # diameter was put in mm!
+                    pipe.innerDiameter = float(self.get_recordproperty(shapeRecord.record, inner_diameter_keys, 0.0)) / 1000
+                    pipe.outerDiameter = float(self.get_recordproperty(shapeRecord.record, outer_diameter_keys, 0.0)) / 1000
+
+                    pipe.geometry = line
+                    inport = esdl.InPort(id=str(uuid4()), name='InPort')
+                    outport = esdl.OutPort(id=str(uuid4()), name='OutPort')
+                    pipe.port.extend((inport, outport))
+                    assets.append(pipe)
 
-        self.to_esdl(area, sf, transformer, energy_asset)
+                if shapeRecord.shape.shapeType == shapefile.POINT:
+                    # probably an asset
 
-    def to_esdl(self, area, sf, transformer, energy_asset):
-        i = 0
-        for shapeRecord in sf.shapeRecords():
-            i += 1
-            if shapeRecord.shape.shapeType == shapefile.POLYLINE:
-                print('{} {} = {}'.format(shapeRecord.shape.shapeTypeName, shapeRecord.record[0],
-                                          shapeRecord.shape.points))
-                pipe = esdl.Pipe(name=area.name + '-Pipe' + str(i), id=str(uuid4()))
-                line = esdl.Line()
-                d = 0.0
-                prevlat, prevlon = None, None
-                for point in shapeRecord.shape.points:
-                    lon, lat = transformer.transform(point[0], point[1])
-                    p = esdl.Point(lat=lat, lon=lon)
-                    line.point.append(p)
-                    if prevlat is not None:
-                        d = d + distance((prevlat, prevlon), (lat, lon))
-                    prevlat, prevlon = lat, lon
-                pipe.length = d * 1000  # in m instead of km
-
-                # diameter was put in mm!
-                pipe.innerDiameter = float(self.get_recordproperty(shapeRecord.record, inner_diameter_keys, 0.0)) / 1000
-                pipe.outerDiameter = float(self.get_recordproperty(shapeRecord.record, outer_diameter_keys, 0.0)) / 1000
-
-                pipe.geometry = line
-                inport = esdl.InPort(id=str(uuid4()), name='InPort')
-                outport = esdl.OutPort(id=str(uuid4()), name='OutPort')
-                pipe.port.extend((inport, outport))
-                area.asset.append(pipe)
-
-            if shapeRecord.shape.shapeType == shapefile.POINT:
-                # probably an asset
-
-                if energy_asset == "type_record":
-                    esdl_type = self.get_type(shapeRecord.record)
-                    esdl_object = esdl_type(name=self.get_name(shapeRecord.record), id=str(uuid4()))
-                else:
-                    module = importlib.import_module('esdl.esdl')
-                    class_ = getattr(module, energy_asset)
-                    esdl_object = class_()
-                    esdl_object.id = str(uuid4())
-                    esdl_object.name = self.get_name(shapeRecord.record)
-
-                # instance = esdl.GenericProducer(name=get_name(shapeRecord.record), id=str(uuid4()))
-                point = shapeRecord.shape.points[0]
-                lon, lat = transformer.transform(point[0], point[1])
-                p = esdl.Point(lat=lat, lon=lon)
-                esdl_object.geometry = p
-                area.asset.append(esdl_object)
-                inport = esdl.InPort(id=str(uuid4()), name='InPort')
-                outport = esdl.OutPort(id=str(uuid4()), name='OutPort')
-                esdl_object.port.extend((inport, outport))
-
-            if shapeRecord.shape.shapeType == shapefile.POLYGON \
-                    or shapeRecord.shape.shapeType == shapefile.POLYGONM \
-                    or shapeRecord.shape.shapeType == shapefile.POLYGONZ:
-
-                # If it's a polygon, polygonm or polygonz, we ignore measures and z-coordinates for now
-                # we also ignore holes and multipolygons
-
-                if energy_asset == "type_record":
-                    esdl_type = self.get_type(shapeRecord.record)
-                    esdl_object = esdl_type(name=self.get_name(shapeRecord.record), id=str(uuid4()))
-                elif energy_asset == "esdl_area":
-                    esdl_object = esdl.Area(id=str(uuid4()), name=self.get_name(shapeRecord.record))
-                else:
-                    module = importlib.import_module('esdl.esdl')
-                    class_ = getattr(module, energy_asset)
-                    esdl_object = class_()
-                    esdl_object.id = str(uuid4())
-                    esdl_object.name = self.get_name(shapeRecord.record)
-
-                # This function only supports polygons without holes (so far).
-                parts_len = len(shapeRecord.shape.parts)
-                print(parts_len)
-                if parts_len > 1:
-                    multi_polygon = esdl.MultiPolygon()
-                point_idx = 0
-                for pol in range(0, parts_len):
-                    if parts_len == 1:
-                        # If only one polygon,
-                        length_of_this_polygon = len(shapeRecord.shape.points)
+                    if energy_asset == "type_record":
+                        esdl_type = self.get_type(shapeRecord.record)
+                        esdl_object = esdl_type(name=self.get_name(shapeRecord.record), id=str(uuid4()))
                     else:
-                        if pol == parts_len-1:
-                            length_of_this_polygon = len(shapeRecord.shape.points) - shapeRecord.shape.parts[pol]
-                        else:
-                            length_of_this_polygon = shapeRecord.shape.parts[pol+1]
-
-                    print('- {}'.format(length_of_this_polygon))
-                    exterior = esdl.SubPolygon()
-                    polygon = esdl.Polygon(exterior=exterior)
-    
-                    for pi in range(0, length_of_this_polygon):
-                        point = shapeRecord.shape.points[point_idx]
-                        lon, lat = transformer.transform(point[0], point[1])
-                        p = esdl.Point(lat=lat, lon=lon)
-                        exterior.point.append(p)
-                        point_idx += 1
-
-                    if parts_len > 1:
-                        multi_polygon.polygon.append(polygon)
-
-                if parts_len > 1:
-                    esdl_object.geometry = multi_polygon
-                else:
-                    esdl_object.geometry = polygon
-
-                if energy_asset == "esdl_area":
-                    area.area.append(esdl_object)
-                else:
-                    area.asset.append(esdl_object)
+                        module = importlib.import_module('esdl.esdl')
+                        class_ = getattr(module, energy_asset)
+                        esdl_object = class_()
+                        esdl_object.id = str(uuid4())
+                        esdl_object.name = self.get_name(shapeRecord.record)
+
+                    # instance = esdl.GenericProducer(name=get_name(shapeRecord.record), id=str(uuid4()))
+                    p = esdl.Point(lat=lats[0], lon=lons[0])
+                    esdl_object.geometry = p
+                    assets.append(esdl_object)
                     inport = esdl.InPort(id=str(uuid4()), name='InPort')
                     outport = esdl.OutPort(id=str(uuid4()), name='OutPort')
                     esdl_object.port.extend((inport, outport))
 
+                if shapeRecord.shape.shapeType == shapefile.POLYGON \
+                        or shapeRecord.shape.shapeType == shapefile.POLYGONM \
+                        or shapeRecord.shape.shapeType == shapefile.POLYGONZ:
+
+                    # If it's a polygon, polygonm or polygonz, we ignore measures and z-coordinates for now
+                    # we also ignore holes and multipolygons
+
+                    if energy_asset == "type_record":
+                        esdl_type = self.get_type(shapeRecord.record)
+                        esdl_object = esdl_type(name=self.get_name(shapeRecord.record), id=str(uuid4()))
+                    elif energy_asset == "esdl_area":
+                        esdl_object = esdl.Area(id=str(uuid4()), name=self.get_name(shapeRecord.record))
+                    else:
+                        module = importlib.import_module('esdl.esdl')
+                        class_ = getattr(module, energy_asset)
+                        esdl_object = class_()
+                        esdl_object.id = str(uuid4())
+                        esdl_object.name = self.get_name(shapeRecord.record)
+
+                    # This function only supports polygons without holes (so far), every part is a polygon
+                    parts = list(shapeRecord.shape.parts)
+                    polygons = []
+                    for start, end in zip(parts, parts[1:] + [len(lats)]):
+                        exterior = esdl.SubPolygon()
+                        create_points(exterior, lons[start:end], lats[start:end], settings.COMPACT_GEOMETRY_MIN_POINTS)
+                        polygons.append(esdl.Polygon(exterior=exterior))
+
+                    if len(polygons) > 1:
+                        esdl_object.geometry = esdl.MultiPolygon(polygon=polygons)
+                    else:
+                        esdl_object.geometry = polygons[0]
+
+                    if energy_asset == "esdl_area":
+                        areas.append(esdl_object)
+                    else:
+                        assets.append(esdl_object)
+                        inport = esdl.InPort(id=str(uuid4()), name='InPort')
+                        outport = esdl.OutPort(id=str(uuid4()), name='OutPort')
+                        esdl_object.port.extend((inport, outport))
+
+            area.asset.extend(assets)
+            area.area.extend(areas)
+            if progress_callback:
+                progress_callback(i)
+
     """
     if the shape record contains the type field, use that to find the appropriate ESDL class
     """
@@ -17,16 +17,18 @@ from flask_socketio import SocketIO, emit
 from flask_executor import Executor
 from datetime import datetime
 from dateutil import rrule
-from influxdb import InfluxDBClient
-from geojson import Feature, MultiLineString, FeatureCollection, dumps
-from math import fabs
 import pytz
+import numpy as np
 
 from extensions.session_manager import get_handler, get_session, set_session
 from extensions.settings_storage import SettingsStorage
 from extensions.mapeditor_settings import MapEditorSettings, MAPEDITOR_UI_SETTINGS
+from esdl import esdl
+from esdl.processing import ESDLGeometry
 
 import src.settings as settings
+import src.timeseries as timeseries
+import src.time_dimension_data as time_dimension_data
 import src.log as log
 
 logger = log.get_logger(__name__)
@@ -42,6 +44,38 @@ def send_alert(message):
     emit('alert', message, namespace='/esdl')
 
 
+def build_asset_table(data, get_asset, colors, es_id, boundaries):
+    """
+    Returns the static geometry and style of the assets of a simulation, by asset index: the (lon, lat) coordinates of
+    the line of a conductor (None if the asset or its line is not in the energy system), the stroke colour of its
+    carrier and the min/max value of its network (to scale the stroke width)
+    :param data: SimulationData of the simulation
+    :param get_asset: function that returns the asset with an id
+    """
+    strokes = dict()    # carrier id -> stroke colour
+    table = {'ids': data.asset_ids, 'coordinates': list(), 'stroke': list(), 'min': list(), 'max': list()}
+    for asset_id, network, carrier_id in zip(data.asset_ids, data.networks, data.carriers):
+        asset = get_asset(asset_id)
+        coordinates = None
+        if asset is not None and isinstance(asset.geometry, esdl.Line):
+            coordinates = ESDLGeometry.get_coordinates(asset.geometry)
+        table['coordinates'].append(coordinates)
+        if carrier_id not in strokes:
+            color = colors.get(es_id + carrier_id) if colors and carrier_id else None
+            strokes[carrier_id] = color["color"] if color else None
+        table['stroke'].append(strokes[carrier_id])
+        min_en, max_en = boundaries.get(network, (None, None))
+        table['min'].append(min_en)
+        table['max'].append(max_en)
+    return table
+
+
+def build_frames(window):
+    """Returns the times and the values of the frames of a window of SimulationData, by asset index"""
+    return {'times': [time_dimension_data.to_iso(t) for t in window['times']],
+            'loads': time_dimension_data.to_json_values(window['mean'])}
+
+
 # ---------------------------------------------------------------------------------------------------------------------
 #  TimeDimension
 # ---------------------------------------------------------------------------------------------------------------------
@@ -60,6 +94,8 @@ class TimeDimension:
 
         self.simulation_result_keys = None             # To store the simulation data keys
         self.preloaded_simulation_data = dict()        # To store the simulation data in a dict (networks) of dicts (times)
+        self.simulation_data = None                    # SimulationData with the columnar series of all assets
+        self.asset_tables = dict()                     # (es id, simulation run) -> geometry and style of the assets
 
         self.start_dt = None
         self.stop_dt = None
@@ -67,6 +103,7 @@ class TimeDimension:
         # TODO: Hardcoded parameters, change later.
         self.scenario_id = "i-elgas"
         self.simulation_parameter = "allocationEnergy"
+        self.simulation_run = "start_test_run"
 
     def init_config(self):
         return settings.essim_config
@@ -112,12 +149,44 @@ class TimeDimension:
         def timedimension_get_asset_ids():
             return self.asset_ids
 
+        @self.socketio.on('timedimension_get_asset_table', namespace='/esdl')
+        def timedimension_get_asset_table():
+            return self.get_asset_table()
+
+        @self.socketio.on('timedimension_get_assets', namespace='/esdl')
+        def timedimension_get_assets():
+            """Static information of the assets of the simulation, the values of a window are keyed by asset index"""
+            if not self.simulation_data:
+                return None
+            return {'assets': self.simulation_data.assets(), 'boundaries': self.allocation_boundaries}
+
+        @self.socketio.on('timedimension_get_window', namespace='/esdl')
+        def timedimension_get_window(start, end, resolution=None):
+            """
+            Values of all assets in [start, end) (ISO dates), aggregated per bucket of resolution seconds (None for
+            the time steps of the simulation). Returns times of the buckets and mean, min and max per bucket and asset
+            index.
+            """
+            if not self.simulation_data:
+                return None
+            sdt = datetime.strptime(start, '%Y-%m-%dT%H:%M:%S.%f%z')
+            edt = datetime.strptime(end, '%Y-%m-%dT%H:%M:%S.%f%z')
+            window = self.simulation_data.window(sdt.timestamp(), edt.timestamp(), resolution)
+            result = {'times': [time_dimension_data.to_iso(t) for t in window['times']],
+                      'mean': time_dimension_data.to_json_values(window['mean'])}
+            if resolution:
+                result['min'] = time_dimension_data.to_json_values(window['min'])
+                result['max'] = time_dimension_data.to_json_values(window['max'])
+            return result
+
     def connect_to_database(self):
-        self.database_client = InfluxDBClient(host=self.config['ESSIM_database_server'],
-                                              port=self.config['ESSIM_database_port'], database=self.scenario_id)
+        self.database_client = timeseries.get_client(host=self.config['ESSIM_database_server'],
+                                                     port=self.config['ESSIM_database_port'], database=self.scenario_id)
 
     def preprocess_data(self):
         self.connect_to_database()
+        self.networks = list()
+        self.asset_ids = dict()
 
         logger.debug("finding all IDs from assets")
         query = "SHOW TAG VALUES WITH KEY=\"assetId\""
@@ -133,33 +202,28 @@ class TimeDimension:
                     asset_list.append(kv["value"])
                 self.asset_ids[key[0]] = asset_list
 
-        logger.debug("calculating min/max per carrier")
-        query = "SELECT MIN({}), MAX({}) FROM {}".format(self.simulation_parameter, self.simulation_parameter, ",".join(self.networks))
-        result = allocation_energy = self.database_client.query(query)
-        if result:
-            for key in list(allocation_energy.keys()):
-                series = allocation_energy[key]
-                for item in series:
-                    self.allocation_boundaries[key] = (item['min'], item['max'])
-
-            logger.debug(self.allocation_boundaries)
-
-    def generate_timed_geojson_for_line(self, coordinates, time, load, allocationEnergy, id, es_id, carrier_id, min_en, max_en):
-        my_feature = Feature(geometry=MultiLineString(coordinates))
-        my_feature['properties']['id'] = id
-        my_feature['properties']['time'] = time
-        my_feature['properties']['load'] = allocationEnergy
-        my_feature['properties']['stroke'] = self.colors[es_id+carrier_id]["color"]
-        if allocationEnergy < 0:
-            val = 10*fabs(allocationEnergy/min_en) + 3
-            my_feature['properties']['pos'] = False
-        else:
-            val = 10*allocationEnergy/max_en + 3
-            my_feature['properties']['pos'] = True
-
-        # val = 10*((fabs(allocationEnergy)  - min_en)/(max_en - min_en)) + 3
-        my_feature['properties']['strokeWidth'] = val
-        return my_feature
+        logger.debug("loading simulation data")
+        self.simulation_data = time_dimension_data.get_simulation_data(self.database_client, self.scenario_id,
+                                                                       self.asset_ids, self.simulation_parameter,
+                                                                       self.simulation_run)
+        self.allocation_boundaries = self.simulation_data.boundaries()
+        logger.debug(self.allocation_boundaries)
+
+    def get_asset_table(self):
+        """Returns the geometry and style table of the assets of the active energy system, it is built once per
+        simulation"""
+        if not self.simulation_data:
+            return None
+        active_es_id = get_session('active_es_id')
+        key = (active_es_id, self.simulation_run)
+        table = self.asset_tables.get(key)
+        if table is None or table['ids'] is not self.simulation_data.asset_ids:
+            esh = get_handler()
+            uuid_dict = esh.get_resource(active_es_id).uuid_dict
+            table = build_asset_table(self.simulation_data, uuid_dict.get, self.colors, active_es_id,
+                                      self.allocation_boundaries)
+            self.asset_tables[key] = table
+        return table
 
     def get_windowed_simulation_data(self, start, end):
         logger.debug("--- Retrieving Simulation Data ---")
@@ -170,8 +234,6 @@ class TimeDimension:
 
         sdt = datetime.strptime(start, '%Y-%m-%dT%H:%M:%S.%f%z')
         edt = datetime.strptime(end, '%Y-%m-%dT%H:%M:%S.%f%z')
-        influxdb_startdate = sdt.strftime('%Y-%m-%dT%H:%M:%SZ')
-        influxdb_enddate = edt.strftime('%Y-%m-%dT%H:%M:%SZ')
 
         esh = get_handler()
         monitor_asset_ids = get_session('ielgas_monitor_ids')
@@ -196,40 +258,30 @@ class TimeDimension:
                 'data': monitor_asset_data
             }
 
-        sim_results = None
-        try:
-            query = 'SELECT * FROM '+ ",".join(self.networks) +' WHERE (time >= \'' + influxdb_startdate + '\' AND time < \'' + influxdb_enddate + '\' AND "simulationRun" = \'start_test_run\')'
-            sim_results = self.database_client.query(query)
-        except Exception as e:
-            logger.error('error with query: ', str(e))
-
-        feature_collection_json_string = "{}"
-        if sim_results:
-            feature_list = []
-            for key in list(sim_results.keys()):
-                series = sim_results[key]
-                fid = 1
-                for item in series:
-                    current_asset = esh.get_by_id(active_es_id, item['assetId'])
-                    coordinates = [[(current_asset.geometry.point.items[0].lon, current_asset.geometry.point.items[0].lat),
-                                    (current_asset.geometry.point.items[1].lon, current_asset.geometry.point.items[1].lat)]]
-                    feature_list.append(
-                        self.generate_timed_geojson_for_line(coordinates, item['time'], 0.5,
-                                                             item[self.simulation_parameter], item['assetId'], active_es_id, item['carrierId'],
-                                                             self.allocation_boundaries[key][0], self.allocation_boundaries[key][1]))
-                    fid += 1
-                    if 'data' in monitor_data and item['assetId'] in monitor_data['data']:
-                        monitor_data['data'][item['assetId']]['data_x'].append(item['time'].split('T')[1].strip('Z'))
-                        monitor_data['data'][item['assetId']]['data_y'].append(item[self.simulation_parameter])
-
-            feature_collection = FeatureCollection(feature_list)
-            feature_collection_json_string = dumps(feature_collection)
+        window = None
+        if self.simulation_data:
+            window = self.simulation_data.window(sdt.timestamp(), edt.timestamp())
+
+        frames = {'times': [], 'loads': []}
+        if window is not None and len(window['times']):
+            data = self.simulation_data
+            values = window['mean']
+            frames = build_frames(window)
+
+            if 'data' in monitor_data:
+                for aid in monitor_data['data']:
+                    index = data.asset_index.get(aid)
+                    if index is None:
+                        continue
+                    for t_index in np.flatnonzero(~np.isnan(values[:, index])):
+                        monitor_data['data'][aid]['data_x'].append(frames['times'][t_index].split('T')[1].strip('Z'))
+                        monitor_data['data'][aid]['data_y'].append(float(values[t_index, index]))
         else:
-            logger.warn('query yielded no results')
+            logger.warn('no simulation data for the time window')
 
         if monitor_asset_ids:
             # logger.debug(monitor_data)
             emit('ielgas_monitor_asset_data', monitor_data);
 
-        return feature_collection_json_string
+        return frames
 
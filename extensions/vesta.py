@@ -15,7 +15,7 @@
 from flask import Flask, jsonify
 from flask_socketio import SocketIO, emit
 from extensions.settings_storage import SettingsStorage
-from extensions.session_manager import get_handler, get_session
+from extensions.session_manager import get_handler, get_session, with_session_lock
 from esdl import esdl
 from esdl.processing import ESDLAsset, ESDLEnergySystem
 import src.settings as settings
@@ -60,6 +60,7 @@ class Vesta:
         logger.info("Registering VESTA extension")
 
         @self.socketio.on('vesta_area_restrictions', namespace='/esdl')
+        @with_session_lock
         def set_area_restrictions(area_id):
             with self.flask_app.app_context():
                 esh = get_handler()
@@ -89,6 +90,7 @@ class Vesta:
                 emit('vesta_restrictions_data', data)
 
         @self.socketio.on('select_area_restrictions', namespace='/esdl')
+        @with_session_lock
         def select_area_restrictions(measures_data):
             area_id = measures_data['area_id']
             measures = measures_data['selected_measures']
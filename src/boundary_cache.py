@@ -0,0 +1,145 @@
+#  This work is based on original code developed and copyrighted by TNO 2020.
+#  Subsequent contributions are licensed to you by the developers of such code and are
+#  made available to the Project under one or several contributor license agreements.
+#
+#  This work is licensed to you under the Apache License, Version 2.0.
+#  You may obtain a copy of the license at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#      TNO         - Initial implementation
+#  Manager:
+#      TNO
+
+"""
+Two-tier cache for the boundaries of the boundary service, keyed by year and boundary code:
+
+- an in-memory LRU cache, limited by the total size of the cached boundaries
+- an on-disk store (one JSON file per boundary in a directory per year) with a time-to-live, shared by all worker
+  processes and kept when the mapeditor restarts
+
+Boundaries are cached in their serialized JSON form and a new object is returned by every get(), such that callers
+can't change the boundaries in the cache of other users.
+"""
+
+from collections import OrderedDict
+from urllib.parse import quote
+import json
+import os
+import tempfile
+import threading
+import time
+import src.log as log
+
+logger = log.get_logger(__name__)
+
+
+class BoundaryCache:
+    def __init__(self, directory=None, memory_size=0, ttl=0):
+        """
+        :param directory: directory of the on-disk store, None to only cache in memory
+        :param memory_size: maximum total size in bytes of the boundaries in memory, 0 for no limit
+        :param ttl: number of seconds a boundary in the on-disk store is valid, 0 for no limit
+        """
+        self.directory = directory
+        self.memory_size = memory_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.boundaries = OrderedDict()     # (year, code) -> JSON bytes, least recently used first
+        self.size = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _path(self, year, code):
+        # codes are only checked for a valid prefix, so quote them to get a safe file name
+        return os.path.join(self.directory, quote(str(year), safe=''), quote(code, safe='') + '.json')
+
+    def _put_in_memory(self, key, data):
+        with self.lock:
+            old = self.boundaries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self.boundaries[key] = data
+            self.size += len(data)
+            while self.memory_size and self.size > self.memory_size and len(self.boundaries) > 1:
+                _, evicted = self.boundaries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def _is_on_disk(self, year, code):
+        try:
+            return not self.ttl or time.time() - os.stat(self._path(year, code)).st_mtime <= self.ttl
+        except OSError:
+            return False
+
+    def _read_from_disk(self, year, code):
+        if not self._is_on_disk(year, code):
+            return None
+        try:
+            with open(self._path(year, code), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning('Cannot read boundary {} {} from cache: {}'.format(year, code, e))
+            return None
+
+    def _write_to_disk(self, year, code, data):
+        directory = os.path.dirname(self._path(year, code))
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(year, code))
+        except OSError as e:
+            logger.warning('Cannot write boundary {} {} to cache: {}'.format(year, code, e))
+
+    def get(self, year, code):
+        """Returns the boundary for the year and code or None if it is not in the cache"""
+        key = (str(year), code)
+        with self.lock:
+            data = self.boundaries.get(key)
+            if data is not None:
+                self.boundaries.move_to_end(key)
+                self.hits += 1
+        if data is None and self.directory:
+            data = self._read_from_disk(year, code)
+            if data is not None:
+                self.disk_hits += 1
+                self._put_in_memory(key, data)
+        if data is None:
+            self.misses += 1
+            return None
+        return json.loads(data)
+
+    def __contains__(self, key):
+        year, code = key
+        with self.lock:
+            if (str(year), code) in self.boundaries:
+                return True
+        return self.directory is not None and self._is_on_disk(year, code)
+
+    def put(self, year, code, boundary):
+        """Stores a boundary (a JSON serializable object or its serialized JSON string or bytes) in the cache"""
+        if isinstance(boundary, str):
+            data = boundary.encode('utf-8')
+        elif isinstance(boundary, bytes):
+            data = boundary
+        else:
+            data = json.dumps(boundary).encode('utf-8')
+        self._put_in_memory((str(year), code), data)
+        if self.directory:
+            self._write_to_disk(year, code, data)
+
+    def clear(self):
+        """Clears the in-memory cache, the on-disk store is kept"""
+        with self.lock:
+            self.boundaries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            return {'boundaries_in_memory': len(self.boundaries), 'memory_size': self.size, 'hits': self.hits,
+                    'disk_hits': self.disk_hits, 'misses': self.misses}
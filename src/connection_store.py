@@ -0,0 +1,130 @@
+#  This work is based on original code developed and copyrighted by TNO 2020.
+#  Subsequent contributions are licensed to you by the developers of such code and are
+#  made available to the Project under one or several contributor license agreements.
+#
+#  This work is licensed to you under the Apache License, Version 2.0.
+#  You may obtain a copy of the license at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#      TNO         - Initial implementation
+#  Manager:
+#      TNO
+
+import sys
+
+ASSET_ID_KEYS = ('from-asset-id', 'to-asset-id')
+PORT_ID_KEYS = ('from-port-id', 'to-port-id')
+# approximate memory used per connection (the dict, its ids and coordinates and the entries in the indexes), see
+# ConnectionStore.estimate_memory_size()
+CONNECTION_MEMORY_SIZE = 1600
+
+
+class ConnectionStore:
+    """
+    Stores the connections that are shown in the UI (dicts with 'from-port-id', 'from-port-carrier', 'from-asset-id',
+    'from-asset-coord' and the same 'to-' keys) and indexes them by asset id and port id, such that the connections
+    of an asset or port can be found and updated in a time proportional to the number of connections of that asset.
+
+    Iterating over the store returns the connections in insertion order. Use to_list() to send them to the UI.
+    Connections must not be changed directly, use update_connection() instead: it keeps the indexes consistent and
+    increments the version, which the session store uses to detect changes in place.
+    """
+    def __init__(self, conn_list=None):
+        self.connections = dict()   # id(conn) -> conn
+        self.by_asset = dict()      # asset id -> {id(conn): conn}
+        self.by_port = dict()       # port id -> {id(conn): conn}
+        self.version = 0            # incremented on every change
+        if conn_list is not None:
+            self.extend(conn_list)
+
+    def __iter__(self):
+        return iter(list(self.connections.values()))
+
+    def __len__(self):
+        return len(self.connections)
+
+    def to_list(self):
+        return list(self.connections.values())
+
+    def estimate_memory_size(self):
+        """Returns the approximate memory used by this store in bytes, based on the number of connections"""
+        return sys.getsizeof(self.connections) + sys.getsizeof(self.by_asset) + sys.getsizeof(self.by_port) + \
+            len(self.connections) * CONNECTION_MEMORY_SIZE
+
+    def __getstate__(self):
+        # the indexes are keyed by id(conn), which changes when unpickling, so only store the connections
+        return {'connections': self.to_list()}
+
+    def modification_version(self):
+        return self.version
+
+    def __setstate__(self, state):
+        self.__init__(state['connections'])
+
+    def _index(self, conn):
+        key = id(conn)
+        for k in ASSET_ID_KEYS:
+            self.by_asset.setdefault(conn[k], dict())[key] = conn
+        for k in PORT_ID_KEYS:
+            self.by_port.setdefault(conn[k], dict())[key] = conn
+
+    def _unindex(self, conn):
+        key = id(conn)
+        for index, keys in ((self.by_asset, ASSET_ID_KEYS), (self.by_port, PORT_ID_KEYS)):
+            for k in keys:
+                conns = index.get(conn[k])
+                if conns is not None:
+                    conns.pop(key, None)
+                    if not conns:
+                        del index[conn[k]]
+
+    def append(self, conn):
+        self.version += 1
+        self.connections[id(conn)] = conn
+        self._index(conn)
+
+    def extend(self, conn_list):
+        for conn in conn_list:
+            self.append(conn)
+
+    def remove(self, conn):
+        if id(conn) in self.connections:
+            self.version += 1
+            self._unindex(conn)
+            del self.connections[id(conn)]
+
+    def clear(self):
+        self.version += 1
+        self.connections.clear()
+        self.by_asset.clear()
+        self.by_port.clear()
+
+    def update_connection(self, conn, changes):
+        """Updates the values of a connection (e.g. a new asset id) and keeps the indexes consistent"""
+        self.version += 1
+        self._unindex(conn)
+        conn.update(changes)
+        self._index(conn)
+
+    def get_connections_for_asset(self, asset_id):
+        return list(self.by_asset.get(asset_id, dict()).values())
+
+    def get_connections_for_port(self, port_id):
+        return list(self.by_port.get(port_id, dict()).values())
+
+    def remove_connections_for_asset(self, asset_id):
+        conns = self.get_connections_for_asset(asset_id)
+        for conn in conns:
+            self.remove(conn)
+        return conns
+
+    def remove_connections_between_ports(self, port1_id, port2_id):
+        """Removes the connections between two ports, in both directions"""
+        removed = []
+        for conn in self.get_connections_for_port(port1_id):
+            if {conn['from-port-id'], conn['to-port-id']} == {port1_id, port2_id}:
+                self.remove(conn)
+                removed.append(conn)
+        return removed
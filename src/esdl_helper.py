@@ -14,6 +14,7 @@
 
 from flask_socketio import emit
 from esdl import esdl
+from esdl.esdl_handler import PortIndex
 from esdl.processing import ESDLGeometry, ESDLAsset, ESDLQuantityAndUnits
 from extensions.session_manager import get_handler, get_session, get_session_for_esid
 from extensions.profiles import Profiles
@@ -78,10 +79,9 @@ def get_asset_geom_info(asset):
             lon = geom.lon
             return (lat, lon)
         if isinstance(geom, esdl.Line):
-            points = geom.point
-            first = (points[0].lat, points[0].lon)
-            last = (points[len(points) - 1].lat, points[len(points) - 1].lon)
-            return [first, last]
+            first = ESDLGeometry.get_coordinate(geom, 0)
+            last = ESDLGeometry.get_coordinate(geom, -1)
+            return [(first[1], first[0]), (last[1], last[0])]
         if isinstance(geom, esdl.Polygon):
             center = ESDLGeometry.calculate_polygon_center(geom)
             return center
@@ -93,21 +93,31 @@ def get_asset_from_port_id(esh, es_id, pid):
     return port.eContainer()
 
 
-def get_asset_and_coord_from_port_id(esh, es_id, pid):
-    port = esh.get_by_id(es_id, pid)
-    asset = port.eContainer()
-    if asset.geometry:
-        coord = get_asset_geom_info(asset)
-        if isinstance(asset.geometry, esdl.Line):
-            # Take care of returning first coordinate for first port and last coordinate for second port
-            if asset.port[0].id == pid:
-                return {'asset': asset, 'coord': coord[0]}
-            if asset.port[1].id == pid:
-                return {'asset': asset, 'coord': coord[1]}
-        else:
-            return {'asset': asset, 'coord': coord}
+def get_port_info(esh, es_id, pid):
+    """
+    Returns information about a port using the PortIndex of the energy system
+    :returns dict with 'asset', 'port', 'ordinal', 'coord', 'carrier_id' and 'building'
+    """
+    port_info = esh.get_port_index(es_id).get(pid)
+    if port_info is None:
+        # port is not part of the area tree of the energy system, resolve it using the uuid_dict
+        port = esh.get_by_id(es_id, pid)
+        asset = port.eContainer()
+        ordinal = list(asset.port).index(port)
+        port_info = {
+            'asset': asset,
+            'port': port,
+            'ordinal': ordinal,
+            'coord': PortIndex.port_coordinate(asset, ordinal),
+            'carrier_id': port.carrier.id if port.carrier else None,
+            'building': asset.containingBuilding
+        }
+    return port_info
 
-    return {'asset': asset, 'coord': ()}
+
+def get_asset_and_coord_from_port_id(esh, es_id, pid):
+    port_info = get_port_info(esh, es_id, pid)
+    return {'asset': port_info['asset'], 'coord': port_info['coord']}
 
 
 def energy_asset_to_ui(esh, es_id, asset): # , port_asset_mapping):
@@ -146,9 +156,7 @@ def energy_asset_to_ui(esh, es_id, asset): # , port_asset_mapping):
             capability_type = ESDLAsset.get_asset_capability_type(asset)
             return ['point', 'asset', asset.name, asset.id, type(asset).__name__, [lat, lon], port_list, capability_type], conn_list
         elif isinstance(geom, esdl.Line):
-            coords = []
-            for point in geom.point:
-                coords.append([point.lat, point.lon])
+            coords = [[lat, lon] for lon, lat in ESDLGeometry.get_coordinates(geom)]
             return ['line', 'asset', asset.name, asset.id, type(asset).__name__, coords, port_list], conn_list
         elif isinstance(geom, esdl.Polygon):
             if isinstance(asset, esdl.WindParc) or isinstance(asset, esdl.PVParc) or isinstance(asset, esdl.WindPark) \
@@ -170,10 +178,48 @@ def update_carrier_conn_list():
     for c in conn_list:
         from_port = esh.get_by_id(active_es_id, c['from-port-id'])
         if from_port.carrier:
-            c['from-port-carrier'] = from_port.carrier.id
+            conn_list.update_connection(c, {'from-port-carrier': from_port.carrier.id})
         to_port = esh.get_by_id(active_es_id, c['from-port-id'])
         if to_port.carrier:
-            c['to-port-carrier'] = to_port.carrier.id
+            conn_list.update_connection(c, {'to-port-carrier': to_port.carrier.id})
 
     emit('clear_connections')  # clear current active layer connections
-    emit('add_connections', {'es_id': active_es_id, 'conn_list': conn_list})
+    emit('add_connections', {'es_id': active_es_id, 'conn_list': conn_list.to_list()})
+
+
+def send_connection_updates(es_id, changed_conn_list):
+    """Redraws only the given connections in the UI, instead of clearing and redrawing all connections"""
+    removed = set()
+    for c in changed_conn_list:
+        # remove_single_connection removes both directions of a connection
+        key = frozenset((c['from-port-id'], c['to-port-id']))
+        if key not in removed:
+            removed.add(key)
+            emit('remove_single_connection', {'es_id': es_id, 'from-port-id': c['from-port-id'], 'to-port-id': c['to-port-id']})
+    if changed_conn_list:
+        emit('add_connections', {'es_id': es_id, 'add_to_building': False, 'conn_list': changed_conn_list})
+
+
+def create_load_callbacks(filename):
+    """
+    Creates the progress and batch callbacks for EnergySystemHandler.load_from_string() and load_file(), that show the
+    progress of loading an ESDL file and the areas and buildings that have been parsed so far in the UI
+    :returns (progress_callback, batch_callback)
+    """
+    def progress_callback(bytes_read, total_bytes):
+        emit('esdl_load_progress', {'filename': filename, 'bytes_read': bytes_read, 'total_bytes': total_bytes})
+
+    def batch_callback(objects):
+        area_bld_list = []
+        for obj in objects:
+            level = 0
+            container = obj.eContainer()
+            while isinstance(container, (esdl.Area, esdl.AbstractBuilding)):
+                level = level + 1
+                container = container.eContainer()
+            obj_type = 'Area' if isinstance(obj, esdl.Area) else 'Building'
+            area_bld_list.append([obj_type, obj.id, obj.name, level])
+        emit('esdl_load_batch', {'filename': filename, 'area_bld_list': area_bld_list})
+
+    progress_callback(0, None)
+    return progress_callback, batch_callback
@@ -16,12 +16,17 @@ from flask import Flask
 from flask_socketio import SocketIO, emit
 from extensions.session_manager import get_handler, get_session
 import src.settings as settings
-from influxdb import InfluxDBClient
+import src.timeseries as timeseries
+from src.ldc import ldc_cache
+from esdl.esdl_handler import walk_contents
+from esdl import esdl
 from datetime import datetime
 import src.log as log
 
 logger = log.get_logger(__name__)
 
+LDC_BATCH_SIZE = 200    # number of assets per (grouped) query of a batch of load duration curves
+
 
 class ESSIM_KPIs:
     def __init__(self, flask_app: Flask, socket: SocketIO):
@@ -41,6 +46,13 @@ class ESSIM_KPIs:
 
                 self.calculate_load_duration_curve(asset_id, asset.name)
 
+        @self.socketio.on('calculate_load_duration_curves', namespace='/esdl')
+        def calculate_ldcs(info):
+            """info: {'asset_ids': [...]} or {'asset_type': 'Pipe'} for all assets of a type"""
+            with self.flask_app.app_context():
+                self.calculate_load_duration_curves(asset_ids=info.get('asset_ids'),
+                                                    asset_type=info.get('asset_type'))
+
     def send_alert(self, msg):
         logger.warn(msg)
         self.socketio.emit('alert', msg, namespace='/esdl')
@@ -69,8 +81,8 @@ class ESSIM_KPIs:
         self.simulationRun = simulationRun
 
     def connect_to_database(self):
-        self.database_client = InfluxDBClient(host=self.config['ESSIM_database_server'],
-                                              port=self.config['ESSIM_database_port'], database=self.scenario_id)
+        self.database_client = timeseries.get_client(host=self.config['ESSIM_database_server'],
+                                                     port=self.config['ESSIM_database_port'], database=self.scenario_id)
 
     def calculate_load_duration_curve(self, asset_id, asset_name):
         logger.debug("--- calculate_load_duration_curve ---")
@@ -87,45 +99,96 @@ class ESSIM_KPIs:
 
             sim_id = active_simulation['sim_id']
             asset = esh.get_by_id(active_es_id, asset_id)
-            power = None
-            if hasattr(asset, 'power'):
-                power = asset.power
-            elif hasattr(asset, 'capacity'):
-                power = asset.capacity
+            power = self.get_asset_power(asset)
             power_pos = None
             power_neg = None
 
-            allocation_energy = None
+            ldc = None
             try:
                 query = 'SELECT "allocationEnergy" FROM /' + es.name + '.*/ WHERE (time >= \'' + influxdb_startdate + '\' AND time < \'' + influxdb_enddate + '\' AND "simulationRun" = \'' + sim_id + '\' AND "assetId" = \''+asset_id+'\')'
-                logger.debug(query)
-                allocation_energy = self.database_client.query(query)
+                ldc = ldc_cache.get_curve((self.scenario_id, sim_id, asset_id, 'allocationEnergy'),
+                                          self.database_client, query, 'allocationEnergy')
             except Exception as e:
-                logger.error('error with query: ', str(e))
-
-            if allocation_energy:
-                # logger.debug(allocation_energy)
-                first_key = list(allocation_energy.keys())[0]
-                series = allocation_energy[first_key]
-
-                ldc_series = []
-                for item in series:
-                    ldc_series.append(item['allocationEnergy'])
-                ldc_series.sort(reverse=True)
-
-                ldc_series_decimate = []
-                for idx, item in enumerate(ldc_series):
-                    if idx % 40 == 0:
-                        ldc_series_decimate.append(item / 3600)
-                        if item > 0:
-                            power_pos = power
-                        if item < 0:
-                            power_neg = -power
-
-                # logger.debug(ldc_series_decimate)
-                emit('ldc-data', {'asset_name': asset_name, 'ldc_series': ldc_series_decimate, 'power_pos': power_pos, 'power_neg': power_neg})
+                logger.error('error with query: {}'.format(e))
+
+            if ldc:
+                if ldc.has_positive:
+                    power_pos = power
+                if ldc.has_negative:
+                    power_neg = -power
+                emit('ldc-data', {'asset_name': asset_name, 'ldc_series': ldc.to_list(1 / 3600),
+                                  'power_pos': power_pos, 'power_neg': power_neg})
 
             else:
                 logger.warn('query returned no results')
         else:
-            self.send_alert('No active simulation')
\ No newline at end of file
+            self.send_alert('No active simulation')
+
+    @staticmethod
+    def get_asset_power(asset):
+        if hasattr(asset, 'power'):
+            return asset.power
+        elif hasattr(asset, 'capacity'):
+            return asset.capacity
+        return None
+
+    def calculate_load_duration_curves(self, asset_ids=None, asset_type=None):
+        """
+        Calculates the load duration curves and summary statistics of a list of assets, or of all assets of a type.
+        The assets are queried in batches of LDC_BATCH_SIZE with a single query grouped by assetId, the results of
+        each batch are emitted as a chunk of 'ldc-batch-data'.
+        """
+        active_simulation = get_session('active_simulation')
+        if not active_simulation:
+            self.send_alert('No active simulation')
+            return
+
+        active_es_id = get_session('active_es_id')
+        esh = get_handler()
+        es = esh.get_energy_system(active_es_id)
+        if asset_type:
+            eclass = esdl.getEClassifier(asset_type)
+            if eclass is None or not issubclass(eclass, esdl.EnergyAsset):
+                self.send_alert('Unknown asset type: {}'.format(asset_type))
+                return
+            assets = [obj for obj in walk_contents(es.instance[0].area) if isinstance(obj, eclass)]
+        else:
+            assets = [esh.get_by_id(active_es_id, asset_id) for asset_id in asset_ids or []]
+            assets = [asset for asset in assets if asset is not None]
+
+        sdt = datetime.strptime(active_simulation['startDate'], '%Y-%m-%dT%H:%M:%S%z')
+        edt = datetime.strptime(active_simulation['endDate'], '%Y-%m-%dT%H:%M:%S%z')
+        influxdb_startdate = sdt.strftime('%Y-%m-%dT%H:%M:%SZ')
+        influxdb_enddate = edt.strftime('%Y-%m-%dT%H:%M:%SZ')
+        sim_id = active_simulation['sim_id']
+
+        def query(ids):
+            return 'SELECT "allocationEnergy" FROM /' + es.name + '.*/ WHERE (time >= \'' + influxdb_startdate + \
+                   '\' AND time < \'' + influxdb_enddate + '\' AND "simulationRun" = \'' + sim_id + '\' AND ' + \
+                   timeseries.tag_filter('assetId', ids) + ') GROUP BY "assetId"'
+
+        total = len(assets)
+        for start in range(0, total, LDC_BATCH_SIZE):
+            batch = assets[start:start + LDC_BATCH_SIZE]
+            keys = {asset.id: (self.scenario_id, sim_id, asset.id, 'allocationEnergy') for asset in batch}
+            curves = dict()
+            try:
+                curves = ldc_cache.get_curves(keys, self.database_client, query, 'allocationEnergy')
+            except Exception as e:
+                logger.error('error with query: {}'.format(e))
+
+            results = list()
+            for asset in batch:
+                ldc = curves.get(asset.id)
+                if ldc is None:
+                    continue
+                power = self.get_asset_power(asset)
+                results.append({'asset_id': asset.id, 'asset_name': asset.name,
+                                'ldc_series': ldc.to_list(1 / 3600),
+                                'power_pos': power if ldc.has_positive else None,
+                                'power_neg': -power if ldc.has_negative and power is not None else None,
+                                'stats': ldc.stats(1 / 3600, power)})
+            emit('ldc-batch-data', {'results': results, 'done': min(start + LDC_BATCH_SIZE, total), 'total': total})
+
+        if total == 0:
+            emit('ldc-batch-data', {'results': [], 'done': 0, 'total': 0})
\ No newline at end of file
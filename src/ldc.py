@@ -0,0 +1,239 @@
+#  This work is based on original code developed and copyrighted by TNO 2020.
+#  Subsequent contributions are licensed to you by the developers of such code and are
+#  made available to the Project under one or several contributor license agreements.
+#
+#  This work is licensed to you under the Apache License, Version 2.0.
+#  You may obtain a copy of the license at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#      TNO         - Initial implementation
+#  Manager:
+#      TNO
+
+"""
+Load duration curves (LDC) of simulation results in the time series databases.
+
+The values of a field of a series are loaded in a NumPy array and sorted in descending order. The curve is downsampled
+to a fixed number of points at evenly spaced percentiles, such that the maximum and minimum values are always part of
+the curve. Curves are cached in an LRU cache keyed by (database, simulation run, asset id, field), such that repeated
+requests for the same asset don't query the database again.
+
+Curves of many assets are calculated at once from the result of a single query with GROUP BY assetId: the series are
+put in one (assets x time steps) array, padded with NaN, and sorted, downsampled and summarized along its rows.
+"""
+
+from collections import OrderedDict
+import threading
+import numpy as np
+import src.settings as settings
+import src.log as log
+
+logger = log.get_logger(__name__)
+
+LDC_POINTS = 220    # number of points of a load duration curve (a year of hourly values / 40)
+
+
+class LoadDurationCurve:
+    def __init__(self, curve, count, peak, total_positive, total_negative):
+        """
+        :param curve: NumPy array with the downsampled curve, in descending order
+        :param count: number of values of the series
+        :param peak: largest absolute value of the series
+        :param total_positive: sum of the positive values of the series
+        :param total_negative: sum of the negative values of the series
+        """
+        self.curve = curve
+        self.count = count
+        self.peak = peak
+        self.total_positive = total_positive
+        self.total_negative = total_negative
+
+    @property
+    def has_positive(self):
+        return self.total_positive > 0
+
+    @property
+    def has_negative(self):
+        return self.total_negative < 0
+
+    @classmethod
+    def from_values(cls, values, num_points=LDC_POINTS):
+        return load_duration_curves([values], num_points)[0]
+
+    def to_list(self, scale=1.0):
+        return (self.curve * scale).tolist()
+
+    def stats(self, scale=1.0, power=None):
+        """
+        Summary of the series: peak, total positive and negative values and full load hours (the total positive
+        value divided by the power, or by the peak if the power is not known)
+        :param scale: factor to convert a value to the unit of power (e.g. 1 / 3600 for energy in J per hour to W)
+        :param power: nominal power of the asset
+        """
+        peak = self.peak * scale
+        total_positive = self.total_positive * scale
+        reference = power if power else peak
+        return {'peak': peak, 'total_positive': total_positive, 'total_negative': self.total_negative * scale,
+                'full_load_hours': total_positive / reference if reference else None}
+
+
+def load_duration_curves(arrays, num_points=LDC_POINTS):
+    """
+    Returns a LoadDurationCurve per NumPy array of values (NaN for missing values), or None for arrays without values.
+    All curves are calculated at once on a (series x values) array.
+    """
+    if not arrays:
+        return []
+    matrix = np.full((len(arrays), max(len(a) for a in arrays)), np.nan)
+    for row, values in enumerate(arrays):
+        matrix[row, :len(values)] = values
+
+    valid = ~np.isnan(matrix)
+    counts = valid.sum(axis=1)
+    values = np.where(valid, matrix, 0.0)
+    peaks = np.abs(values).max(axis=1)
+    totals_positive = np.where(values > 0, values, 0.0).sum(axis=1)
+    totals_negative = np.where(values < 0, values, 0.0).sum(axis=1)
+    # descending, with the NaN padding at the end of each row
+    sorted_desc = -np.sort(-matrix, axis=1)
+    # percentiles of the long series by linear interpolation between the sorted values (as np.percentile does)
+    long_series = counts > num_points
+    positions = (counts[long_series] - 1)[:, None] * np.linspace(0, 1, num_points)[None, :]
+    lower = np.floor(positions).astype(int)
+    upper = np.minimum(lower + 1, (counts[long_series] - 1)[:, None])
+    rows = sorted_desc[long_series]
+    lower_values = np.take_along_axis(rows, lower, axis=1)
+    percentiles = lower_values + (positions - lower) * (np.take_along_axis(rows, upper, axis=1) - lower_values)
+
+    curves = []
+    long_index = 0
+    for row, count in enumerate(counts):
+        if count == 0:
+            curve = None
+        else:
+            if long_series[row]:
+                ldc = percentiles[long_index]
+                long_index += 1
+            else:
+                ldc = sorted_desc[row, :count]
+            curve = LoadDurationCurve(ldc, int(count), float(peaks[row]), float(totals_positive[row]),
+                                      float(totals_negative[row]))
+        curves.append(curve)
+    return curves
+
+
+def _column_values(series, field):
+    columns = series['columns']
+    if field not in columns:
+        return None
+    index = columns.index(field)
+    rows = series.get('values', [])
+    return np.fromiter((np.nan if row[index] is None else row[index] for row in rows), dtype=float, count=len(rows))
+
+
+def series_values(result, field):
+    """Returns the values of a field of the first series of a query result as a NumPy array, None if there are none"""
+    if not result:
+        return None
+    series = result.raw.get('series') if hasattr(result, 'raw') else None
+    if not series:
+        return None
+    return _column_values(series[0], field)
+
+
+def grouped_series_values(result, field, tag='assetId'):
+    """
+    Returns a dict with the values of a field as a NumPy array per value of the tag, for the result of a query with
+    GROUP BY tag. Only the first series of a tag value is used (a tag value can occur in multiple measurements).
+    """
+    grouped = dict()
+    series_list = result.raw.get('series') if result and hasattr(result, 'raw') else None
+    for series in series_list or []:
+        tag_value = series.get('tags', {}).get(tag)
+        if tag_value is None or tag_value in grouped:
+            continue
+        values = _column_values(series, field)
+        if values is not None and len(values) > 0:
+            grouped[tag_value] = values
+    return grouped
+
+
+class LDCCache:
+    def __init__(self, size):
+        """:param size: maximum number of cached curves"""
+        self.size = size
+        self.lock = threading.Lock()
+        self.curves = OrderedDict()     # key -> LoadDurationCurve, least recently used first
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            curve = self.curves.get(key)
+            if curve is not None:
+                self.curves.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+            return curve
+
+    def put(self, key, curve):
+        with self.lock:
+            self.curves[key] = curve
+            self.curves.move_to_end(key)
+            while len(self.curves) > self.size:
+                self.curves.popitem(last=False)
+
+    def get_curve(self, key, client, query, field):
+        """
+        Returns the LoadDurationCurve for the key, the curve is calculated from the field of the result of the query
+        if it isn't cached. Returns None if the query has no results (which is not cached).
+        :param key: (database, simulation run, asset id, field) tuple
+        """
+        curve = self.get(key)
+        if curve is None:
+            logger.debug(query)
+            values = series_values(client.query(query), field)
+            if values is None:
+                return None
+            curve = LoadDurationCurve.from_values(values)
+            if curve is None:
+                return None
+            self.put(key, curve)
+        return curve
+
+    def get_curves(self, keys, client, query, field, tag='assetId'):
+        """
+        Returns a dict with the LoadDurationCurve per asset id, only for the assets that have values that are not NULL
+        or NaN. The curves that aren't cached are calculated from the result of a single query, grouped by the tag.
+        :param keys: dict with the cache key per asset id
+        :param query: function that returns the query (with GROUP BY tag) for a list of asset ids
+        """
+        curves = dict()
+        missing = list()
+        for asset_id, key in keys.items():
+            curve = self.get(key)
+            if curve is None:
+                missing.append(asset_id)
+            else:
+                curves[asset_id] = curve
+        if missing:
+            q = query(missing)
+            logger.debug(q)
+            grouped = grouped_series_values(client.query(q), field, tag)
+            asset_ids = [asset_id for asset_id in missing if asset_id in grouped]
+            for asset_id, curve in zip(asset_ids, load_duration_curves([grouped[a] for a in asset_ids])):
+                # series with only NULL values have no curve, these are left out like assets without a series
+                if curve is not None:
+                    self.put(keys[asset_id], curve)
+                    curves[asset_id] = curve
+        return curves
+
+    def stats(self):
+        with self.lock:
+            return {'curves': len(self.curves), 'hits': self.hits, 'misses': self.misses}
+
+
+ldc_cache = LDCCache(settings.LDC_CACHE_SIZE)
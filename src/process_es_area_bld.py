@@ -20,15 +20,28 @@ from flask import session
 from flask_socketio import emit
 
 from esdl import esdl
+from esdl.esdl_handler import ModelAnalysis, walk_contents
 from esdl.processing import ESDLGeometry, ESDLAsset, ESDLEnergySystem
-from extensions.boundary_service import BoundaryService, is_valid_boundary_id
-from extensions.session_manager import set_handler, get_handler, get_session, set_session_for_esid
-from src.esdl_helper import generate_profile_info, get_asset_and_coord_from_port_id
+from extensions.boundary_service import BoundaryService, is_valid_boundary_id, boundary_zoom_level, zoom_for_bounds, \
+    BOUNDARY_ZOOM_LEVELS
+from extensions.session_manager import set_handler, get_handler, get_session, get_session_for_esid, set_session_for_esid, \
+    with_session_lock
+from src.esdl_helper import generate_profile_info, get_port_info
+from src.connection_store import ConnectionStore
 from src.shape import Shape, ShapePoint
 from utils.RDWGSConverter import RDWGSConverter
+import src.settings as settings
 import shapely
+import numpy as np
 import math
 
+try:
+    from shapely import contains_xy, prepare, points    # shapely 2
+except ImportError:
+    from shapely.vectorized import contains as contains_xy
+    prepare = None
+    points = None
+
 
 # ---------------------------------------------------------------------------------------------------------------------
 #  Generic functions
@@ -38,6 +51,17 @@ def send_alert(message):
     emit('alert', message, namespace='/esdl')
 
 
+def get_area_analysis(area):
+    """Returns the ModelAnalysis of an area, the analysis of the top-level area of an energy system is cached"""
+    instance = area.eContainer()
+    if isinstance(instance, esdl.Instance) and isinstance(instance.eContainer(), esdl.EnergySystem):
+        es = instance.eContainer()
+        esh = get_handler()
+        if esh.get_energy_system(es.id) is es:
+            return esh.get_model_analysis(es.id)
+    return ModelAnalysis(area)
+
+
 # ---------------------------------------------------------------------------------------------------------------------
 #   Update asset geometries
 # ---------------------------------------------------------------------------------------------------------------------
@@ -166,22 +190,27 @@ def calc_possible_locations_in_area(shape, num_assets_in_area):
     delta_y = bbox_height / (ny + 1)
     delta_x = bbox_width / (nx + 1)
 
-    possible_locations = list()
+    # generate raster based on bbox and add points from raster that are within shape to possible_locations list,
+    # testing all points of the raster at once against the prepared shape
+    grid_x, grid_y = np.meshgrid(bbox[0] + np.arange(1, nx + 1) * delta_x, bbox[1] + np.arange(1, ny + 1) * delta_y,
+                                 indexing='ij')
+    grid_x = grid_x.ravel()
+    grid_y = grid_y.ravel()
+    if prepare is not None:
+        prepare(shape.shape)
+    inside = contains_xy(shape.shape, grid_x, grid_y)
 
-    # generate raster based on bbox and add points from raster that are within shape to possible_locations list
-    for x_iter in range(nx):
-        for y_iter in range(ny):
-            p = shapely.geometry.Point(bbox[0] + (x_iter+1)*delta_x, bbox[1] + (y_iter+1)*delta_y)
-            if p.within(shape.shape):
-                possible_locations.append(ShapePoint(p))
-
-    return possible_locations
+    coords = np.column_stack((grid_x[inside], grid_y[inside]))
+    if points is not None:
+        return list(points(coords))
+    return [shapely.geometry.Point(x, y) for x, y in coords.tolist()]
 
 
 def choose_location(possible_locations):
+    # swap the chosen location with the last one, such that it can be removed in constant time
     idx = random.randrange(0, len(possible_locations))
-    location = possible_locations.pop(idx)
-    return location
+    possible_locations[idx], possible_locations[-1] = possible_locations[-1], possible_locations[idx]
+    return ShapePoint(possible_locations.pop())
 
 
 def update_asset_geometries_shape(area, shape):
@@ -246,16 +275,39 @@ def create_building_KPIs(building):
     return KPIs
 
 
-def find_area_info_geojson(area_list, pot_list, this_area):
+def get_boundaries_of_areas(top_area, zoom=None):
+    """
+    Gets the boundaries from the boundary service of all areas without a geometry (in parallel), simplified for the
+    zoom level of the map. If the zoom level is not known, the level at which all boundaries fit the map is used.
+    :return: dict of area id -> boundary, the zoom level of the boundaries
+    """
+    boundary_service = BoundaryService.get_instance()
+    user = get_session('user-email')
+    user_settings = boundary_service.get_user_settings(user)
+    boundaries_year = user_settings['boundaries_year']
+
+    scopes_and_ids = [(area.scope, str.upper(area.id)) for area in get_area_analysis(top_area).boundary_areas
+                      if is_valid_boundary_id(area.id)]
+    boundaries = boundary_service.get_boundaries_from_service(boundaries_year, scopes_and_ids)
+
+    if zoom is None:
+        bounds = [shapely.geometry.shape(b['geom']).bounds for b in boundaries.values() if b]
+        if not bounds:
+            return boundaries, None
+        zoom = zoom_for_bounds((min(b[0] for b in bounds), min(b[1] for b in bounds),
+                                max(b[2] for b in bounds), max(b[3] for b in bounds)))
+    return boundary_service.simplify_boundaries(boundaries_year, boundaries, zoom), boundary_zoom_level(zoom)
+
+
+def find_area_info_geojson(area_list, pot_list, this_area, boundaries=None, assign_locations=True):
     area_id = this_area.id
     area_name = this_area.name
     if not area_name: area_name = ""
     area_scope = this_area.scope
     area_geometry = this_area.geometry
 
-    user = get_session('user-email')
-    user_settings = BoundaryService.get_instance().get_user_settings(user)
-    boundaries_year = user_settings['boundaries_year']
+    if boundaries is None:
+        boundaries, _ = get_boundaries_of_areas(this_area)
 
     geojson_KPIs = {}
     area_KPIs = this_area.KPIs
@@ -302,8 +354,7 @@ def find_area_info_geojson(area_list, pot_list, this_area):
     else:
         if area_id and area_scope.name != 'UNDEFINED':
             if is_valid_boundary_id(area_id):
-                # print('Retrieve boundary from boundary service')
-                boundary_wgs = BoundaryService.get_instance().get_boundary_from_service(boundaries_year, area_scope, str.upper(area_id))
+                boundary_wgs = boundaries.get(str.upper(area_id))
                 if boundary_wgs:
                     sh = Shape.parse_geojson_geometry(boundary_wgs['geom'])
                     num_sub_polygons = len(sh.shape.geoms)
@@ -323,7 +374,7 @@ def find_area_info_geojson(area_list, pot_list, this_area):
 
     # assign random coordinates if boundary is given and area contains assets without coordinates
     # and gives assets within buildings a proper coordinate
-    if area_shape:
+    if area_shape and assign_locations:
         update_asset_geometries_shape(this_area, area_shape)
 
     potentials = this_area.potential
@@ -341,26 +392,42 @@ def find_area_info_geojson(area_list, pot_list, this_area):
                 }))
 
     for area in this_area.area:
-        find_area_info_geojson(area_list, pot_list, area)
+        find_area_info_geojson(area_list, pot_list, area, boundaries, assign_locations)
 
 
-def create_area_info_geojson(area):
+def create_area_info_geojson(area, zoom=None, assign_locations=True):
+    """
+    :param zoom: zoom level of the map, None if unknown
+    :param assign_locations: assign coordinates to the assets without a geometry in areas with a boundary, False to
+                             leave the energy system unchanged
+    :return: the area and potential geojson features, the zoom level of the boundaries in the area features
+    """
     area_list = []
     pot_list = []
     print("- Finding ESDL boundaries...")
     BoundaryService.get_instance().preload_area_subboundaries_in_cache(area)
-    find_area_info_geojson(area_list, pot_list, area)
+    boundaries, zoom_level = get_boundaries_of_areas(area, zoom)
+    find_area_info_geojson(area_list, pot_list, area, boundaries, assign_locations)
     print("- Done")
-    return area_list, pot_list
+    return area_list, pot_list, zoom_level
+
+
+def emit_area_geojson(area_list, zoom_level, replace=False):
+    """
+    :param zoom_level: zoom level of the boundaries, the client requests other boundaries if its zoom level changes
+    :param replace: replace the areas shown by the client (when the boundaries of another zoom level are sent)
+    """
+    emit('geojson', {"layer": "area_layer", "geojson": area_list, "zoom_level": zoom_level,
+                     "zoom_levels": BOUNDARY_ZOOM_LEVELS, "replace": replace})
 
 
 def find_boundaries_in_ESDL(top_area):
     print("Finding area and potential boundaries in ESDL")
-    area_list, pot_list = create_area_info_geojson(top_area)
+    area_list, pot_list, zoom_level = create_area_info_geojson(top_area)
 
     # Sending an empty list triggers removing the legend at client side
     print('- Sending area information to client, size={}'.format(getsizeof(area_list)))
-    emit('geojson', {"layer": "area_layer", "geojson": area_list})
+    emit_area_geojson(area_list, zoom_level)
     # Buildings are now taken care of in process_building
     # print('- Sending building information to client, size={}'.format(getsizeof(building_list)))
     # emit('geojson', {"layer": "bld_layer", "geojson": building_list})
@@ -369,34 +436,19 @@ def find_boundaries_in_ESDL(top_area):
 
 
 def add_missing_coordinates(area):
-    min_lat = float("inf")
-    max_lat = -float("inf")
-    min_lon = float("inf")
-    max_lon = -float("inf")
-
-    for child in area.eAllContents():
-        point = None
-        if isinstance(child, esdl.Polygon):
-            if child.CRS != "Simple": point = child.exterior.point[0]     # take first coordinate of exterior of polygon
-        if isinstance(child, esdl.Point):
-            if child.CRS != "Simple": point = child
-        if point:
-            if point.lat < min_lat: min_lat = point.lat
-            if point.lat > max_lat: max_lat = point.lat
-            if point.lon < min_lon: min_lon = point.lon
-            if point.lon > max_lon: max_lon = point.lon
-            point = None
-
-    delta_x = max_lon - min_lon
-    delta_y = max_lat - min_lat
-    center = [(min_lon + max_lon)/2, (min_lat + max_lat)/2]
-    RD_coords = (max_lat > 180 and max_lon > 180)               # boolean indicating if RD CRS is used
-
-    for child in area.eAllContents():
-        if isinstance(child, esdl.EnergyAsset) or isinstance(child, esdl.AggregatedBuilding) or isinstance(child, esdl.Building):
-            if not child.geometry:
-                print("add missing coordinates for asset {}".format(child.name))
-                child.geometry = calc_random_location_around_center(center, delta_x / 4, delta_y / 4, RD_coords)
+    analysis = get_area_analysis(area)
+    if not analysis.missing_geometry:
+        return
+
+    delta_x = analysis.max_lon - analysis.min_lon
+    delta_y = analysis.max_lat - analysis.min_lat
+    center = [(analysis.min_lon + analysis.max_lon)/2, (analysis.min_lat + analysis.max_lat)/2]
+    RD_coords = analysis.rd_coordinates                         # boolean indicating if RD CRS is used
+
+    for child in analysis.missing_geometry:
+        if not child.geometry:
+            print("add missing coordinates for asset {}".format(child.name))
+            child.geometry = calc_random_location_around_center(center, delta_x / 4, delta_y / 4, RD_coords)
 
 
 # ---------------------------------------------------------------------------------------------------------------------
@@ -480,11 +532,11 @@ def process_building(esh, es_id, asset_list, building_list, area_bld_list, conn_
                 if conn_to:
                     for pc in conn_to:
                         in_different_buildings = False
-                        pc_asset = get_asset_and_coord_from_port_id(esh, es_id, pc.id)
+                        pc_asset = get_port_info(esh, es_id, pc.id)
 
                         # If the asset the current asset connects to, is in a building...
-                        if pc_asset['asset'].containingBuilding:
-                            bld_pc_asset = pc_asset['asset'].containingBuilding
+                        if pc_asset['building']:
+                            bld_pc_asset = pc_asset['building']
                             bld_basset = basset.containingBuilding
                             # If the asset is in a different building ...
                             if not bld_pc_asset == bld_basset:
@@ -516,9 +568,7 @@ def process_building(esh, es_id, asset_list, building_list, area_bld_list, conn_
                                 # ... just use asset's location
                                 pc_asset_coord = pc_asset['coord']
 
-                        pc_carr_id = None
-                        if pc.carrier:
-                            pc_carr_id = pc.carrier.id
+                        pc_carr_id = pc_asset['carrier_id']
                         # Add connections if we're editing a building or if the connection is between two different buildings
                         # ( The case of an asset in an area that is connected with an asset in a building is handled
                         #   in process_area (now all connections are added twice, from both sides) )
@@ -550,75 +600,74 @@ def process_area(esh, es_id, asset_list, building_list, area_bld_list, conn_list
         if isinstance(asset, esdl.AbstractBuilding):
             process_building(esh, es_id, asset_list, building_list, area_bld_list, conn_list, asset, False, level+1)
         if isinstance(asset, esdl.EnergyAsset):
-            port_list = []
-            ports = asset.port
-            for p in ports:
-                p_asset = get_asset_and_coord_from_port_id(esh, es_id, p.id)
-                p_asset_coord = p_asset['coord']        # get proper coordinate if asset is line
-                conn_to_ids = [cp.id for cp in p.connectedTo]
-                profile = p.profile
-                profile_info_list = []
-                p_carr_id = None
-                if p.carrier:
-                    p_carr_id = p.carrier.id
-                if profile:
-                    profile_info_list = generate_profile_info(profile)
-                port_list.append({'name': p.name, 'id': p.id, 'type': type(p).__name__, 'conn_to': conn_to_ids, 'profile': profile_info_list, 'carrier': p_carr_id})
-                if conn_to_ids:
-                    for pc in p.connectedTo:
-                        pc_asset = get_asset_and_coord_from_port_id(esh, es_id, pc.id)
-                        if pc_asset['asset'].containingBuilding:
-                            bld_pc_asset = pc_asset['asset'].containingBuilding
-                            if bld_pc_asset.geometry:
-                                if isinstance(bld_pc_asset.geometry, esdl.Point):
-                                    pc_asset_coord = (bld_pc_asset.geometry.lat, bld_pc_asset.geometry.lon)
-                                elif isinstance(bld_pc_asset.geometry, esdl.Polygon):
-                                    pc_asset_coord = ESDLGeometry.calculate_polygon_center(bld_pc_asset.geometry)
-                        else:
-                            pc_asset_coord = pc_asset['coord']
-
-                        pc_carr_id = None
-                        if pc.carrier:
-                            pc_carr_id = pc.carrier.id
-                        conn_list.append({'from-port-id': p.id, 'from-port-carrier': p_carr_id, 'from-asset-id': p_asset['asset'].id, 'from-asset-coord': p_asset_coord,
-                                          'to-port-id': pc.id, 'to-port-carrier': pc_carr_id, 'to-asset-id': pc_asset['asset'].id, 'to-asset-coord': pc_asset_coord})
-
-            geom = asset.geometry
-            if geom:
-                if isinstance(geom, esdl.Point):
-                    lat = geom.lat
-                    lon = geom.lon
-
-                    capability_type = ESDLAsset.get_asset_capability_type(asset)
-                    asset_list.append(['point', 'asset', asset.name, asset.id, type(asset).__name__, [lat, lon], port_list, capability_type])
-                if isinstance(geom, esdl.Line):
-                    coords = []
-                    for point in geom.point:
-                        coords.append([point.lat, point.lon])
-                    asset_list.append(['line', 'asset', asset.name, asset.id, type(asset).__name__, coords, port_list])
-                if isinstance(geom, esdl.Polygon):
-                    # if isinstance(asset, esdl.WindParc) or isinstance(asset, esdl.PVParc) or isinstance(asset, esdl.WindPark) or isinstance(asset, esdl.PVPark):
-                    coords = ESDLGeometry.parse_esdl_subpolygon(geom.exterior, False)   # [lon, lat]
-                    coords = ESDLGeometry.exchange_coordinates(coords)                  # --> [lat, lon]
-                    capability_type = ESDLAsset.get_asset_capability_type(asset)
-                    # print(coords)
-                    asset_list.append(['polygon', 'asset', asset.name, asset.id, type(asset).__name__, coords, port_list, capability_type])
+            process_area_asset(esh, es_id, asset_list, conn_list, asset)
 
     for potential in area.potential:
-        geom = potential.geometry
-        if geom:
-            if isinstance(geom, esdl.Point):
-                lat = geom.lat
-                lon = geom.lon
-
-                asset_list.append(
-                    ['point', 'potential', potential.name, potential.id, type(potential).__name__, [lat, lon]])
-            if isinstance(geom, esdl.Polygon):
-                coords = []
-
-                for point in geom.exterior.point:
-                    coords.append([point.lat, point.lon])
-                asset_list.append(['polygon', 'potential', potential.name, potential.id, type(potential).__name__, coords])
+        process_area_potential(asset_list, potential)
+
+
+def process_area_asset(esh, es_id, asset_list, conn_list, asset):
+    port_list = []
+    ports = asset.port
+    for p in ports:
+        p_asset = get_port_info(esh, es_id, p.id)
+        p_asset_coord = p_asset['coord']        # get proper coordinate if asset is line
+        conn_to_ids = [cp.id for cp in p.connectedTo]
+        profile = p.profile
+        profile_info_list = []
+        p_carr_id = p_asset['carrier_id']
+        if profile:
+            profile_info_list = generate_profile_info(profile)
+        port_list.append({'name': p.name, 'id': p.id, 'type': type(p).__name__, 'conn_to': conn_to_ids, 'profile': profile_info_list, 'carrier': p_carr_id})
+        if conn_to_ids:
+            for pc in p.connectedTo:
+                pc_asset = get_port_info(esh, es_id, pc.id)
+                if pc_asset['building']:
+                    bld_pc_asset = pc_asset['building']
+                    if bld_pc_asset.geometry:
+                        if isinstance(bld_pc_asset.geometry, esdl.Point):
+                            pc_asset_coord = (bld_pc_asset.geometry.lat, bld_pc_asset.geometry.lon)
+                        elif isinstance(bld_pc_asset.geometry, esdl.Polygon):
+                            pc_asset_coord = ESDLGeometry.calculate_polygon_center(bld_pc_asset.geometry)
+                else:
+                    pc_asset_coord = pc_asset['coord']
+
+                pc_carr_id = pc_asset['carrier_id']
+                conn_list.append({'from-port-id': p.id, 'from-port-carrier': p_carr_id, 'from-asset-id': p_asset['asset'].id, 'from-asset-coord': p_asset_coord,
+                                  'to-port-id': pc.id, 'to-port-carrier': pc_carr_id, 'to-asset-id': pc_asset['asset'].id, 'to-asset-coord': pc_asset_coord})
+
+    geom = asset.geometry
+    if geom:
+        if isinstance(geom, esdl.Point):
+            lat = geom.lat
+            lon = geom.lon
+
+            capability_type = ESDLAsset.get_asset_capability_type(asset)
+            asset_list.append(['point', 'asset', asset.name, asset.id, type(asset).__name__, [lat, lon], port_list, capability_type])
+        if isinstance(geom, esdl.Line):
+            coords = [[lat, lon] for lon, lat in ESDLGeometry.get_coordinates(geom)]
+            asset_list.append(['line', 'asset', asset.name, asset.id, type(asset).__name__, coords, port_list])
+        if isinstance(geom, esdl.Polygon):
+            # if isinstance(asset, esdl.WindParc) or isinstance(asset, esdl.PVParc) or isinstance(asset, esdl.WindPark) or isinstance(asset, esdl.PVPark):
+            coords = ESDLGeometry.parse_esdl_subpolygon(geom.exterior, False)   # [lon, lat]
+            coords = ESDLGeometry.exchange_coordinates(coords)                  # --> [lat, lon]
+            capability_type = ESDLAsset.get_asset_capability_type(asset)
+            # print(coords)
+            asset_list.append(['polygon', 'asset', asset.name, asset.id, type(asset).__name__, coords, port_list, capability_type])
+
+
+def process_area_potential(asset_list, potential):
+    geom = potential.geometry
+    if geom:
+        if isinstance(geom, esdl.Point):
+            lat = geom.lat
+            lon = geom.lon
+
+            asset_list.append(
+                ['point', 'potential', potential.name, potential.id, type(potential).__name__, [lat, lon]])
+        if isinstance(geom, esdl.Polygon):
+            coords = [[lat, lon] for lon, lat in ESDLGeometry.get_coordinates(geom.exterior)]
+            asset_list.append(['polygon', 'potential', potential.name, potential.id, type(potential).__name__, coords])
 
 
 # ---------------------------------------------------------------------------------------------------------------------
@@ -643,12 +692,243 @@ def get_building_information(building):
     }
 
 
+# ---------------------------------------------------------------------------------------------------------------------
+#  Incremental update after changes to an energy system
+#  Uses the changes recorded by the ChangeTracker of the EnergySystemHandler to only send the objects that were added,
+#  removed or modified to the frontend, instead of processing and sending the complete energy system again.
+# ---------------------------------------------------------------------------------------------------------------------
+INCREMENTAL_UPDATE_MAX_CHANGES = 5000
+
+
+def get_area_level(area):
+    level = 0
+    container = area.eContainer()
+    while isinstance(container, esdl.Area):
+        level = level + 1
+        container = container.eContainer()
+    return level
+
+
+def can_process_area_incrementally(area):
+    # Areas with boundaries, buildings or assets without coordinates require a full update
+    if area.geometry:
+        return False
+    for obj in walk_contents(area):
+        if obj is area:
+            continue
+        if isinstance(obj, esdl.AbstractBuilding):
+            return False
+        if isinstance(obj, esdl.Area) and obj.geometry:
+            return False
+        if isinstance(obj, (esdl.EnergyAsset, esdl.Potential)) and not obj.geometry:
+            return False
+    return True
+
+
+def insert_area_in_area_bld_list(area_bld_list, area, new_area_bld_list):
+    parent = area.eContainer()
+    idx = len(area_bld_list)
+    for i, item in enumerate(area_bld_list):
+        if item[1] == parent.id:
+            # skip all subareas and buildings of the parent area
+            idx = i + 1
+            while idx < len(area_bld_list) and area_bld_list[idx][3] > item[3]:
+                idx = idx + 1
+            break
+    area_bld_list[idx:idx] = new_area_bld_list
+
+
+def process_energy_system_changes(esh, es_id):
+    """
+    Sends the objects of the energy system that were added, removed or modified since the last time it was processed
+    :returns False if the changes can't be processed incrementally, the energy system needs a full update then
+    """
+    tracker = esh.get_change_tracker(es_id)
+    # an energy system that is loaded again with the same id is a new object, the tracker belongs to the old one
+    if tracker is None or tracker.energy_system is not esh.get_energy_system(es_id):
+        return False
+
+    asset_list = get_session_for_esid(es_id, 'asset_list')
+    conn_list = get_session_for_esid(es_id, 'conn_list')
+    area_bld_list = get_session_for_esid(es_id, 'area_bld_list')
+    if asset_list is None or conn_list is None or area_bld_list is None:
+        return False
+
+    changes = tracker.collect()
+    added = changes['added']
+    removed = changes['removed']
+    modified = changes['modified']
+    if changes['full_update'] or len(added) + len(removed) + len(modified) > INCREMENTAL_UPDATE_MAX_CHANGES:
+        return False
+    for obj in added:
+        if isinstance(obj, esdl.Area):
+            if not can_process_area_incrementally(obj):
+                return False
+        elif not obj.geometry:
+            # find_boundaries_in_ESDL and add_missing_coordinates are required to determine a location
+            return False
+    tracker.clear()
+
+    emit('set_active_layer_id', es_id)
+
+    # Remove changed objects and all connections to or from them
+    changed_ids = set(obj.id for obj in removed + modified)
+    for obj_id in changed_ids:
+        emit('delete_esdl_object', {'asset_id': obj_id})
+
+    affected_ids = set(changed_ids)
+    for obj in added:
+        affected_ids.add(obj.id)
+    removed_conns = set()
+    for obj_id in affected_ids:
+        for conn in conn_list.remove_connections_for_asset(obj_id):
+            key = frozenset((conn['from-port-id'], conn['to-port-id']))
+            if key not in removed_conns:
+                removed_conns.add(key)
+                emit('remove_single_connection', {'es_id': es_id, 'from-port-id': conn['from-port-id'],
+                                                  'to-port-id': conn['to-port-id']})
+
+    # Process changed and added objects
+    new_asset_list = []
+    new_conn_list = []
+    for obj in modified + added:
+        if isinstance(obj, esdl.EnergyAsset):
+            process_area_asset(esh, es_id, new_asset_list, new_conn_list, obj)
+        elif isinstance(obj, esdl.Potential):
+            process_area_potential(new_asset_list, obj)
+        elif isinstance(obj, esdl.Area):
+            new_area_bld_list = []
+            process_area(esh, es_id, new_asset_list, [], new_area_bld_list, new_conn_list, obj, get_area_level(obj))
+            insert_area_in_area_bld_list(area_bld_list, obj, new_area_bld_list)
+            for asset in walk_contents(obj):
+                if isinstance(asset, (esdl.EnergyAsset, esdl.Potential)):
+                    affected_ids.add(asset.id)
+
+    # Connections are listed from both sides, also add the connection from the side of the unchanged asset. Skip
+    # connections to assets that are no longer in the energy system (e.g. removed in the same change set)
+    uuid_dict = esh.get_resource(es_id).uuid_dict
+    for conn in list(new_conn_list):
+        if conn['to-asset-id'] not in affected_ids:
+            to_asset = uuid_dict.get(conn['to-asset-id'])
+            if to_asset is not None and not to_asset.containingBuilding:
+                new_conn_list.append({'from-port-id': conn['to-port-id'], 'from-port-carrier': conn['to-port-carrier'],
+                                      'from-asset-id': conn['to-asset-id'], 'from-asset-coord': conn['to-asset-coord'],
+                                      'to-port-id': conn['from-port-id'], 'to-port-carrier': conn['from-port-carrier'],
+                                      'to-asset-id': conn['from-asset-id'], 'to-asset-coord': conn['from-asset-coord']})
+
+    asset_list = [a for a in asset_list if a[3] not in changed_ids] + new_asset_list
+    conn_list.extend(new_conn_list)
+
+    emit('add_esdl_objects', {'es_id': es_id, 'asset_pot_list': new_asset_list, 'zoom': False})
+    emit('add_connections', {'es_id': es_id, 'add_to_building': False, 'conn_list': new_conn_list})
+    if any(isinstance(obj, esdl.Area) for obj in added):
+        emit('area_bld_list', {'es_id': es_id, 'area_bld_list': area_bld_list})
+
+    set_session_for_esid(es_id, 'conn_list', conn_list)
+    set_session_for_esid(es_id, 'asset_list', asset_list)
+    set_session_for_esid(es_id, 'area_bld_list', area_bld_list)
+    return True
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+#  Viewport based loading of large energy systems
+#  Large energy systems are not sent to the client at once, the client requests the objects that are located in its
+#  viewport when the map is moved. If the map is zoomed out, the objects are aggregated in clusters.
+# ---------------------------------------------------------------------------------------------------------------------
+VIEWPORT_CLUSTER_SIZE_PIXELS = 80   # size of the cells of the grid in which objects are clustered
+VIEWPORT_MAX_OBJECTS = 5000         # viewports with more objects are also clustered above VIEWPORT_CLUSTER_ZOOM
+VIEWPORT_TYPES = (esdl.EnergyAsset, esdl.Potential, esdl.AbstractBuilding)
+
+
+def is_viewport_loading_required(asset_list, building_list):
+    threshold = settings.VIEWPORT_LOADING_THRESHOLD
+    return threshold > 0 and len(asset_list) + len(building_list) > threshold
+
+
+def emit_viewport_loading(esh, es_id, enabled):
+    """Tells the client whether it must request the objects in its viewport, instead of receiving all objects"""
+    message = {'es_id': es_id, 'enabled': enabled, 'cluster_zoom': settings.VIEWPORT_CLUSTER_ZOOM, 'bounds': None}
+    if enabled:
+        bounds = esh.get_spatial_index(es_id).bounds()
+        if bounds:
+            message['bounds'] = [[bounds[1], bounds[0]], [bounds[3], bounds[2]]]    # [[south, west], [north, east]]
+    emit('viewport_loading', message)
+
+
+def is_shown_on_map(obj):
+    # assets and potentials in buildings are only shown in the building editor
+    return isinstance(obj, esdl.AbstractBuilding) or not isinstance(obj.eContainer(), esdl.AbstractBuilding)
+
+
+def create_clusters(index, objects, zoom, center_lat):
+    """
+    Aggregates objects in the cells of a grid with cells of VIEWPORT_CLUSTER_SIZE_PIXELS at the zoom level of the map
+    :returns: list of [lat, lon, count], with the average location of the objects in a cell
+    """
+    cell_width = 360.0 / (256 * 2 ** zoom) * VIEWPORT_CLUSTER_SIZE_PIXELS
+    cell_height = cell_width * max(math.cos(math.radians(center_lat)), 0.01)
+    cells = dict()
+    for obj in objects:
+        geometry = index.get_geometry(obj)
+        point = geometry if geometry.geom_type == 'Point' else geometry.centroid
+        key = (int(point.x // cell_width), int(point.y // cell_height))
+        cell = cells.get(key)
+        if cell is None:
+            cells[key] = [point.y, point.x, 1]
+        else:
+            cell[0] += point.y
+            cell[1] += point.x
+            cell[2] += 1
+    return [[lat / count, lon / count, count] for lat, lon, count in cells.values()]
+
+
+def process_viewport(esh, es_id, bounds, zoom):
+    """
+    Sends the objects of a large energy system that are located in the viewport of the client, as individual objects
+    or as clusters below VIEWPORT_CLUSTER_ZOOM
+    :param bounds: the Leaflet bounds of the viewport: [[south, west], [north, east]]
+    """
+    asset_list = get_session_for_esid(es_id, 'asset_list')
+    building_list = get_session_for_esid(es_id, 'building_list')
+    conn_list = get_session_for_esid(es_id, 'conn_list')
+    if asset_list is None or building_list is None or conn_list is None:
+        return
+
+    (south, west), (north, east) = bounds
+    index = esh.get_spatial_index(es_id)
+    objects = [obj for obj in index.query_bbox(west, south, east, north, VIEWPORT_TYPES) if is_shown_on_map(obj)]
+
+    emit('clear_viewport', {'es_id': es_id})
+    if zoom < settings.VIEWPORT_CLUSTER_ZOOM or len(objects) > VIEWPORT_MAX_OBJECTS:
+        emit('add_clusters', {'es_id': es_id, 'cluster_list': create_clusters(index, objects, zoom, (south + north) / 2)})
+        return
+
+    ids = set(obj.id for obj in objects)
+    # connections of assets in buildings are drawn from the building
+    conn_ids = set(ids)
+    for obj in objects:
+        if isinstance(obj, esdl.AbstractBuilding):
+            conn_ids.update(asset.id for asset in walk_contents(obj) if isinstance(asset, esdl.EnergyAsset))
+    viewport_conn_list = []
+    for obj_id in conn_ids:
+        viewport_conn_list.extend(conn for conn in conn_list.get_connections_for_asset(obj_id)
+                                  if conn['from-asset-id'] == obj_id)
+
+    viewport_building_list = [bld for bld in building_list if bld[2] in ids]
+    if viewport_building_list:
+        emit('add_building_objects', {'es_id': es_id, 'building_list': viewport_building_list, 'zoom': False})
+    emit('add_esdl_objects', {'es_id': es_id, 'asset_pot_list': [a for a in asset_list if a[3] in ids], 'zoom': False})
+    emit('add_connections', {'es_id': es_id, 'add_to_building': False, 'conn_list': viewport_conn_list})
+
+
 # ---------------------------------------------------------------------------------------------------------------------
 #  Initialization after new or load energy system
 #  If this function is run through process_energy_system.submit(filename, es_title) it is executed
-#  in a separate thread.
+#  in a separate thread, while holding the lock of the session.
 # ---------------------------------------------------------------------------------------------------------------------
-def process_energy_system(esh, filename=None, es_title=None, app_context=None, force_update_es_id=None):
+@with_session_lock
+def process_energy_system(esh, filename=None, es_title=None, app_context=None, force_update_es_id=None,
+                          incremental=True):
     # emit('clear_ui')
     print("Processing energysystems in esh")
 
@@ -669,6 +949,12 @@ def process_energy_system(esh, filename=None, es_title=None, app_context=None, f
         if es.id is None:
             es.id = str(uuid.uuid4())
 
+        if incremental and es.id == force_update_es_id and es.id in es_info_list:
+            # only send changes since last time this energy system was processed, if possible
+            if process_energy_system_changes(esh, es.id):
+                print("- Processed changes of energysystem with id {}".format(es.id))
+                continue
+
         if es.id not in es_info_list or es.id == force_update_es_id or force_update_es_id == "all":
             print("- Processing energysystem with id {}".format(es.id))
             name = es.name
@@ -680,6 +966,10 @@ def process_energy_system(esh, filename=None, es_title=None, app_context=None, f
             emit('create_new_esdl_layer', {'es_id': es.id, 'title': title})
             emit('set_active_layer_id', es.id)
 
+            if settings.COMPACT_GEOMETRY_MIN_POINTS:
+                # store the points of large networks as arrays of coordinates to reduce memory usage
+                esh.compact_geometries(es.id, settings.COMPACT_GEOMETRY_MIN_POINTS)
+
             area = es.instance[0].area
             find_boundaries_in_ESDL(area)       # also adds coordinates to assets if possible
             carrier_list = ESDLEnergySystem.get_carrier_list(es)
@@ -702,14 +992,22 @@ def process_energy_system(esh, filename=None, es_title=None, app_context=None, f
             print('- Processing area')
             process_area(esh, es.id, asset_list, building_list, area_bld_list, conn_list, area, 0)
 
-            emit('add_building_objects', {'es_id': es.id, 'building_list': building_list, 'zoom': False})
-            emit('add_esdl_objects', {'es_id': es.id, 'asset_pot_list': asset_list, 'zoom': True})
+            # large energy systems are sent per viewport, the client requests the objects when the map is moved
+            viewport_loading = is_viewport_loading_required(asset_list, building_list)
+            emit_viewport_loading(esh, es.id, viewport_loading)
+            if not viewport_loading:
+                emit('add_building_objects', {'es_id': es.id, 'building_list': building_list, 'zoom': False})
+                emit('add_esdl_objects', {'es_id': es.id, 'asset_pot_list': asset_list, 'zoom': True})
             emit('area_bld_list', {'es_id': es.id,  'area_bld_list': area_bld_list})
-            emit('add_connections', {'es_id': es.id, 'add_to_building': False, 'conn_list': conn_list})
+            if not viewport_loading:
+                emit('add_connections', {'es_id': es.id, 'add_to_building': False, 'conn_list': conn_list})
 
-            set_session_for_esid(es.id, 'conn_list', conn_list)
+            set_session_for_esid(es.id, 'conn_list', ConnectionStore(conn_list))
+            set_session_for_esid(es.id, 'building_list', building_list if viewport_loading else None)
             set_session_for_esid(es.id, 'asset_list', asset_list)
             set_session_for_esid(es.id, 'area_bld_list', area_bld_list)
+            # record changes from now on, such that a next update can be done incrementally
+            esh.start_change_tracking(es.id)
 
             # TODO: update asset_list???
             es_info_list[es.id] = {
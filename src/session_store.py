@@ -0,0 +1,730 @@
+#  This work is based on original code developed and copyrighted by TNO 2020.
+#  Subsequent contributions are licensed to you by the developers of such code and are
+#  made available to the Project under one or several contributor license agreements.
+#
+#  This work is licensed to you under the Apache License, Version 2.0.
+#  You may obtain a copy of the license at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#      TNO         - Initial implementation
+#  Manager:
+#      TNO
+
+"""
+Session backends of the session manager. A backend stores the session of every client (a dict-like object with
+key-value pairs) by client_id:
+
+- MemorySessionBackend keeps all sessions in a dict in this process, a client must always be served by the same
+  worker process.
+- DiskSessionBackend stores the sessions in a directory (one subdirectory per client) and keeps the most recently
+  used sessions in memory. Every worker process that uses the same directory can serve every client: a request
+  locks the session of its client with a file lock (see lock_session()) until its changes are written, such that
+  processes don't overwrite each other's changes.
+
+Both backends keep track of the approximate memory used by the sessions in memory and can enforce a memory budget,
+by removing the least recently used sessions from memory (written to disk if possible).
+"""
+
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+from datetime import datetime
+from hashlib import sha1
+from urllib.parse import quote, unquote
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import src.log as log
+
+try:
+    import fcntl
+except ImportError:     # e.g. on Windows, changes of other processes are then still detected but writes are not locked
+    fcntl = None
+
+logger = log.get_logger(__name__)
+
+LAST_ACCESSED_KEY = 'last-accessed'
+SIZE_SAMPLE_THRESHOLD = 1000    # the size of larger lists is estimated from a sample of their items
+SIZE_SAMPLE_COUNT = 100
+SIZE_REFRESH_INTERVAL = 60      # seconds after which the sizes of all values of a session are calculated again
+
+
+def estimate_size(value, seen=None):
+    """
+    Returns the approximate memory used by a value in bytes, including the values it contains. Objects can provide
+    their own estimate by implementing estimate_memory_size() (e.g. the EnergySystemHandler and ConnectionStore).
+    The size of large lists and tuples (e.g. the per energy system asset lists) is their length times the average
+    size of a sample of their items.
+    """
+    if seen is None:
+        seen = set()
+    size = 0
+    stack = [value]
+    while stack:
+        v = stack.pop()
+        if id(v) in seen:
+            continue
+        seen.add(id(v))
+        if hasattr(v, 'estimate_memory_size'):
+            size += v.estimate_memory_size()
+            continue
+        size += sys.getsizeof(v)
+        if isinstance(v, (list, tuple)) and len(v) > SIZE_SAMPLE_THRESHOLD:
+            step = len(v) // SIZE_SAMPLE_COUNT
+            sample_size = sum(estimate_size(v[i], seen) for i in range(0, step * SIZE_SAMPLE_COUNT, step))
+            size += len(v) * sample_size // SIZE_SAMPLE_COUNT
+        elif isinstance(v, dict):
+            stack.extend(v.keys())
+            stack.extend(v.values())
+        elif isinstance(v, (list, tuple, set, frozenset)):
+            stack.extend(v)
+        elif hasattr(v, '__dict__') and not isinstance(v, type):
+            stack.append(v.__dict__)
+    return size
+
+
+def modification_version(value):
+    """
+    Returns a value that changes when a session value is changed in place. Objects provide it by implementing
+    modification_version() with a version counter (e.g. the EnergySystemHandler and ConnectionStore), also as the
+    values of a dict (e.g. the per energy system values). Other values are only written when they are set again or
+    marked with mark_changed(), so None is returned for them.
+    """
+    if hasattr(value, 'modification_version'):
+        return value.modification_version()
+    if isinstance(value, dict) and any(hasattr(v, 'modification_version') for v in value.values()):
+        return tuple((k, v.modification_version() if hasattr(v, 'modification_version') else None)
+                     for k, v in value.items())
+    return None
+
+
+def anonymize_client_id(client_id):
+    """The client_id is the session cookie, so it is not shown in e.g. statistics"""
+    return sha1(str(client_id).encode('utf-8')).hexdigest()[:12]
+
+
+class SizeAccounting:
+    """
+    Keeps track of the approximate memory used by the values of a session. The size of a value is calculated again
+    after it has been set (or loaded). Values that are changed in place are accounted for by calculating the sizes of
+    all values again every SIZE_REFRESH_INTERVAL seconds.
+    """
+    def init_size_accounting(self):
+        self.sizes = dict()         # key -> size in bytes
+        self.changed = set()        # keys of which the size must be calculated again
+        self.sized_at = time.monotonic()
+
+    def values_in_memory(self):
+        """Returns the key-value pairs of this session that are in memory"""
+        raise NotImplementedError
+
+    def update_sizes(self):
+        now = time.monotonic()
+        if now - self.sized_at > SIZE_REFRESH_INTERVAL:
+            self.changed.update(self.sizes.keys())
+            self.sized_at = now
+        if self.changed:
+            values = self.values_in_memory()
+            for key in self.changed:
+                if key in values:
+                    self.sizes[key] = estimate_size(values[key])
+                else:
+                    self.sizes.pop(key, None)
+            self.changed.clear()
+        return self.memory_size()
+
+    def memory_size(self):
+        return sum(self.sizes.values())
+
+
+class SessionBackend:
+    """
+    Stores the sessions of all clients. Can be used as a (read-only) dict of client_id -> session.
+
+    Subclasses keep the sessions that are in memory in self.sessions, ordered from least to most recently used.
+    """
+    name = None
+    locks_sessions = False      # if sessions are locked during a request with lock_session()
+
+    def __init__(self, memory_budget=0):
+        self.memory_budget = memory_budget      # in bytes, 0 is unlimited
+        self.sessions = OrderedDict()           # client_id -> session, least recently used first
+        self.evictions = 0
+        self.budget_exceeded = False            # a warning is logged once when sessions cannot be evicted
+        self.lock = threading.RLock()
+
+    def get(self, client_id):
+        """Returns the session of a client, or None if the client has no session"""
+        raise NotImplementedError
+
+    def create(self, client_id):
+        """Returns the session of a client, creates an empty session if the client has no session yet"""
+        raise NotImplementedError
+
+    def delete(self, client_id):
+        raise NotImplementedError
+
+    def lock_session(self, client_id, create=False):
+        """
+        Returns the session of a client (see get() and create()), locked for other threads and processes until
+        unlock_session() is called if the backend is shared by processes. Used for the duration of a request.
+        """
+        return self.create(client_id) if create else self.get(client_id)
+
+    def unlock_session(self, client_session):
+        pass
+
+    def client_ids(self):
+        raise NotImplementedError
+
+    def can_evict(self, client_session):
+        """Returns if a session can be removed from memory without losing it"""
+        return True
+
+    def evict(self, client_id, client_session):
+        """Removes a session from memory, called when the memory budget is exceeded"""
+        raise NotImplementedError
+
+    def flush(self):
+        """Persists all changes to the sessions and enforces the memory budget, called at the end of every request"""
+        self.enforce_memory_budget()
+
+    def clean_up(self, timeout):
+        """Deletes all sessions that were not accessed for timeout seconds"""
+        raise NotImplementedError
+
+    def memory_size(self):
+        with self.lock:
+            return sum(client_session.update_sizes() for client_session in self.sessions.values())
+
+    def enforce_memory_budget(self):
+        """Evicts the least recently used sessions until the sessions in memory fit in the memory budget"""
+        if not self.memory_budget:
+            return
+        with self.lock:
+            total_size = self.memory_size()
+            # the most recently used session is never evicted, it is probably used by the current request
+            for client_id, client_session in list(self.sessions.items())[:-1]:
+                if total_size <= self.memory_budget:
+                    break
+                if not self.can_evict(client_session):
+                    continue
+                del self.sessions[client_id]
+                total_size -= client_session.memory_size()
+                logger.info('Memory budget of {} MB exceeded, evicting session {} ({} MB)'.format(
+                    self.memory_budget // 2**20, anonymize_client_id(client_id), client_session.memory_size() // 2**20))
+                self.evict(client_id, client_session)
+                self.evictions += 1
+            if total_size > self.memory_budget and not self.budget_exceeded:
+                logger.warning('Memory budget of {} MB exceeded ({} MB), the sessions that are in use or that cannot '
+                               'be stored are not evicted'.format(self.memory_budget // 2**20, total_size // 2**20))
+            self.budget_exceeded = total_size > self.memory_budget
+
+    def stats(self):
+        with self.lock:
+            sessions = []
+            for client_id, client_session in self.sessions.items():
+                sessions.append({
+                    'session': anonymize_client_id(client_id),
+                    'size': client_session.update_sizes(),
+                    'keys': dict(client_session.sizes)
+                })
+            sessions.sort(key=lambda s: s['size'], reverse=True)
+            return {
+                'backend': self.name,
+                'memory_budget': self.memory_budget,
+                'memory_size': sum(s['size'] for s in sessions),
+                'sessions_total': len(self.client_ids()),
+                'sessions_in_memory': len(sessions),
+                'evictions': self.evictions,
+                'sessions': sessions
+            }
+
+    def __contains__(self, client_id):
+        return self.get(client_id) is not None
+
+    def __getitem__(self, client_id):
+        client_session = self.get(client_id)
+        if client_session is None:
+            raise KeyError(client_id)
+        return client_session
+
+    def __delitem__(self, client_id):
+        self.delete(client_id)
+
+    def __iter__(self):
+        return iter(self.client_ids())
+
+    def __len__(self):
+        return len(self.client_ids())
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+#  In-memory backend
+# ---------------------------------------------------------------------------------------------------------------------
+class MemorySession(SizeAccounting, dict):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.init_size_accounting()
+        self.changed.update(self.keys())
+
+    def values_in_memory(self):
+        return self
+
+    def __setitem__(self, key, value):
+        self.changed.add(key)
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self.changed.add(key)
+        super().__delitem__(key)
+
+    def mark_changed(self, key):
+        self.changed.add(key)
+
+
+class MemorySessionBackend(SessionBackend):
+    """
+    Keeps the sessions in memory. If the memory budget is exceeded, the least recently used sessions are written to
+    spill_directory and are loaded again when they are accessed. Without a spill_directory sessions are never evicted,
+    the memory budget is then only reported.
+    """
+    name = 'memory'
+
+    def __init__(self, memory_budget=0, spill_directory=None, separate_keys=()):
+        super().__init__(memory_budget)
+        self.spill_directory = spill_directory
+        self.separate_keys = tuple(separate_keys)
+        self.spilled = set()    # client_ids of the sessions that are written to the spill directory
+
+    def _spill_session(self, client_id):
+        return DiskSession(os.path.join(self.spill_directory, quote(str(client_id), safe='')), self.separate_keys)
+
+    def get(self, client_id):
+        with self.lock:
+            client_session = self.sessions.get(client_id)
+            if client_session is not None:
+                self.sessions.move_to_end(client_id)
+                return client_session
+            if client_id in self.spilled:
+                spilled_session = self._spill_session(client_id)
+                client_session = MemorySession((key, spilled_session[key]) for key in spilled_session)
+                logger.debug('Loaded spilled session {}'.format(anonymize_client_id(client_id)))
+                self.spilled.discard(client_id)
+                shutil.rmtree(spilled_session.directory, ignore_errors=True)
+                self.sessions[client_id] = client_session
+                return client_session
+            return None
+
+    def create(self, client_id):
+        with self.lock:
+            client_session = self.get(client_id)
+            if client_session is None:
+                client_session = MemorySession()
+                self.sessions[client_id] = client_session
+            return client_session
+
+    def delete(self, client_id):
+        with self.lock:
+            self.sessions.pop(client_id, None)
+            if client_id in self.spilled:
+                self.spilled.discard(client_id)
+                shutil.rmtree(self._spill_session(client_id).directory, ignore_errors=True)
+
+    def client_ids(self):
+        with self.lock:
+            return list(self.sessions.keys()) + list(self.spilled)
+
+    def can_evict(self, client_session):
+        return bool(self.spill_directory)
+
+    def evict(self, client_id, client_session):
+        spilled_session = self._spill_session(client_id)
+        os.makedirs(spilled_session.directory, exist_ok=True)
+        for key, value in dict.items(client_session):
+            spilled_session[key] = value
+        spilled_session.flush()
+        self.spilled.add(client_id)
+
+    def clean_up(self, timeout):
+        now = datetime.now()
+        for client_id in self.client_ids():
+            with self.lock:
+                if client_id in self.sessions:
+                    last_accessed = dict.get(self.sessions[client_id], LAST_ACCESSED_KEY)
+                elif client_id in self.spilled:
+                    last_accessed = self._spill_session(client_id).last_accessed()
+                else:
+                    continue
+                if last_accessed is not None and (now - last_accessed).total_seconds() > timeout:
+                    logger.info('Cleaning up session with client_id={}'.format(client_id))
+                    self.delete(client_id)
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+#  On-disk backend
+# ---------------------------------------------------------------------------------------------------------------------
+SESSION_GROUP = '_session'
+PICKLE_EXTENSION = '.pickle'
+LOCK_FILE = '.lock'
+
+
+class SessionConflictError(Exception):
+    """A session value has been written by another process while it was changed by this process"""
+    pass
+
+
+class DiskSession(SizeAccounting, MutableMapping):
+    """
+    Session of one client that is stored in a directory. Large values (e.g. the EnergySystemHandler and the per
+    energy system lists) are stored in a file per key and are only loaded when they are accessed, all other values
+    are stored together in one file.
+
+    Values that are set or deleted are written in the next flush(). The EnergySystemHandler and connections are often
+    changed in place, so the modification_version() of a value is recorded when it is first read and values of which
+    it has changed are written as well, just like values that are marked with mark_changed(). Values that have been written by another
+    process since they were loaded are loaded again when they are accessed.
+
+    A request holds the lock of the session with acquire() and release(), a lock on a file in the directory, from its
+    first access until its changes have been written, such that no other process can change the session in between.
+    Writes outside of acquire() only lock the file while writing, so a file may have been written by another process
+    since it was loaded. The changed keys are then merged into the values of the other process for the shared file,
+    and a SessionConflictError is raised for a file of a separate key.
+    """
+    def __init__(self, directory, separate_keys):
+        self.directory = directory
+        self.separate_keys = separate_keys
+        self.values = dict()        # group -> {key: value}
+        self.stamps = dict()        # group -> (inode, modification time) of the file when it was loaded or written
+        self.dirty = dict()         # group -> keys that are changed and must be written in the next flush
+        self.versions = dict()      # key -> modification version of the value when it was first read
+        self.accessed = set()       # keys that have been read since the last flush
+        self.lock = threading.RLock()
+        self.lock_count = 0         # number of nested acquire() calls of the thread that holds self.lock
+        self.lock_file = None       # the locked file while acquired
+        self.init_size_accounting()
+
+    def _group(self, key):
+        return key if key in self.separate_keys else SESSION_GROUP
+
+    def _path(self, group):
+        return os.path.join(self.directory, group + PICKLE_EXTENSION)
+
+    @staticmethod
+    def _stamp(path):
+        """Returns the (inode, modification time) of a file, which changes when a file is replaced, or None"""
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return dict()
+        except Exception as e:
+            logger.error('Error loading session data from {}: {}'.format(path, e))
+            return dict()
+
+    def _lock_file(self):
+        f = open(os.path.join(self.directory, LOCK_FILE), 'a')
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        return f
+
+    @staticmethod
+    def _unlock_file(f):
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_UN)
+        f.close()
+
+    @contextmanager
+    def _file_lock(self):
+        """Serializes the writes of all processes that use this session"""
+        if self.lock_count:
+            # the session is already locked by this thread with acquire()
+            yield
+            return
+        f = self._lock_file()
+        try:
+            yield
+        finally:
+            self._unlock_file(f)
+
+    def acquire(self):
+        """
+        Locks this session for the other threads of this process and for all other processes, until release() is
+        called. Can be nested.
+        """
+        self.lock.acquire()
+        try:
+            if self.lock_count == 0:
+                self.lock_file = self._lock_file()
+        except Exception:
+            self.lock.release()
+            raise
+        self.lock_count += 1
+
+    def release(self):
+        self.lock_count -= 1
+        if self.lock_count == 0:
+            self._unlock_file(self.lock_file)
+            self.lock_file = None
+        self.lock.release()
+
+    def is_locked(self):
+        return self.lock_count > 0
+
+    def _forget(self, keys):
+        for key in keys:
+            self.versions.pop(key, None)
+            self.accessed.discard(key)
+        self.changed.update(keys)
+
+    def _load(self, group):
+        path = self._path(group)
+        stamp = self._stamp(path)
+        if group in self.values and (group in self.dirty or self.stamps.get(group) == stamp):
+            return self.values[group]
+
+        values = self._read(path) if stamp is not None else dict()
+        self._forget(list(self.values.get(group, dict()).keys()) + list(values.keys()))
+        self.values[group] = values
+        self.stamps[group] = stamp
+        return values
+
+    def _mark_dirty(self, key):
+        self.dirty.setdefault(self._group(key), set()).add(key)
+
+    def _write(self, group, keys):
+        """Writes the values of a group of which the given keys have been changed"""
+        path = self._path(group)
+        with self._file_lock():
+            stamp = self._stamp(path)
+            if stamp != self.stamps.get(group):
+                if group != SESSION_GROUP:
+                    # the value of the other process is loaded again when it is accessed
+                    self._forget(list(self.values.pop(group, dict()).keys()))
+                    self.stamps.pop(group, None)
+                    raise SessionConflictError('Session value {} in {} has been written by another process, the '
+                                               'changes of this process are lost'.format(group, self.directory))
+                # keep the values of the other process, except for the keys that have been changed here
+                values = self.values[group]
+                stored = self._read(path) if stamp is not None else dict()
+                self._forget([key for key in set(values.keys()) | set(stored.keys()) if key not in keys])
+                for key in keys:
+                    if key in values:
+                        stored[key] = values[key]
+                    else:
+                        stored.pop(key, None)
+                self.values[group] = stored
+
+            values = self.values.get(group)
+            if not values:
+                if stamp is not None:
+                    os.remove(path)
+                self.stamps[group] = None
+                return
+
+            try:
+                data = pickle.dumps(values, protocol=pickle.HIGHEST_PROTOCOL)
+            except Exception:
+                # store the values that can be pickled, the others are only available in this process
+                picklable = dict()
+                for key, value in values.items():
+                    try:
+                        pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+                        picklable[key] = value
+                    except Exception as e:
+                        logger.warning('Session value for key {} cannot be stored: {}'.format(key, e))
+                data = pickle.dumps(picklable, protocol=pickle.HIGHEST_PROTOCOL)
+
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self.stamps[group] = self._stamp(path)
+
+    def flush(self):
+        # a session that is in use by another thread is flushed later, at the end of the request of that thread
+        if not self.lock.acquire(blocking=False):
+            return
+        try:
+            # values that have been read are written as well if they have been changed in place
+            for key in self.accessed:
+                values = self.values.get(self._group(key), dict())
+                if key in values and key in self.versions:
+                    version = modification_version(values[key])
+                    if version != self.versions[key]:
+                        self.versions[key] = version
+                        self._mark_dirty(key)
+                        self.changed.add(key)
+            self.accessed.clear()
+            for group, keys in list(self.dirty.items()):
+                try:
+                    self._write(group, keys)
+                except Exception as e:
+                    logger.error('Error writing session data to {}: {}'.format(self._path(group), e))
+            self.dirty.clear()
+        finally:
+            self.lock.release()
+
+    def mark_changed(self, key):
+        """Marks a value that has been changed in place, such that it is written in the next flush()"""
+        with self.lock:
+            self._mark_dirty(key)
+            self.changed.add(key)
+
+    def values_in_memory(self):
+        with self.lock:
+            values = dict()
+            for group_values in self.values.values():
+                values.update(group_values)
+            return values
+
+    def __getitem__(self, key):
+        with self.lock:
+            value = self._load(self._group(key))[key]
+            if key not in self.versions:
+                self.versions[key] = modification_version(value)
+            self.accessed.add(key)
+            return value
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            self._load(self._group(key))[key] = value
+            self._mark_dirty(key)
+            self.versions.pop(key, None)
+            self.changed.add(key)
+
+    def __delitem__(self, key):
+        with self.lock:
+            del self._load(self._group(key))[key]
+            self._mark_dirty(key)
+            self.versions.pop(key, None)
+            self.changed.add(key)
+
+    def __contains__(self, key):
+        with self.lock:
+            group = self._group(key)
+            if group != SESSION_GROUP and group not in self.values:
+                # a separate file only exists if it contains its value, so there is no need to load it
+                return os.path.exists(self._path(group))
+            return key in self._load(group)
+
+    def __iter__(self):
+        with self.lock:
+            keys = [key for key in self.separate_keys if key in self]
+            keys.extend(self._load(SESSION_GROUP).keys())
+            return iter(keys)
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+    def last_accessed(self):
+        """Returns the last time a file of this session was written"""
+        mtimes = [os.stat(os.path.join(self.directory, f)).st_mtime for f in os.listdir(self.directory)
+                  if f.endswith(PICKLE_EXTENSION)]
+        return datetime.fromtimestamp(max(mtimes)) if mtimes else None
+
+
+class DiskSessionBackend(SessionBackend):
+    """
+    Stores the sessions in a directory and keeps at most max_in_memory sessions in memory, within the memory budget
+    (least recently used sessions are removed from memory after they have been written to disk).
+    """
+    name = 'disk'
+    locks_sessions = True
+
+    def __init__(self, directory, max_in_memory, separate_keys=(), memory_budget=0):
+        super().__init__(memory_budget)
+        self.directory = directory
+        self.max_in_memory = max_in_memory
+        self.separate_keys = tuple(separate_keys)
+        os.makedirs(self.directory, exist_ok=True)
+        logger.info('Storing sessions in {}'.format(self.directory))
+
+    def _client_directory(self, client_id):
+        return os.path.join(self.directory, quote(str(client_id), safe=''))
+
+    def get(self, client_id):
+        with self.lock:
+            client_session = self.sessions.get(client_id)
+            if client_session is not None:
+                self.sessions.move_to_end(client_id)
+                return client_session
+
+            client_directory = self._client_directory(client_id)
+            if not os.path.isdir(client_directory):
+                return None
+            client_session = DiskSession(client_directory, self.separate_keys)
+            self.sessions[client_id] = client_session
+            return client_session
+
+    def create(self, client_id):
+        with self.lock:
+            os.makedirs(self._client_directory(client_id), exist_ok=True)
+            return self.get(client_id)
+
+    def delete(self, client_id):
+        with self.lock:
+            self.sessions.pop(client_id, None)
+            shutil.rmtree(self._client_directory(client_id), ignore_errors=True)
+
+    def lock_session(self, client_id, create=False):
+        while True:
+            client_session = self.create(client_id) if create else self.get(client_id)
+            if client_session is None:
+                return None
+            client_session.acquire()
+            # the session may have been removed from memory while waiting for the lock, then lock the new one
+            with self.lock:
+                if self.sessions.get(client_id) is client_session:
+                    return client_session
+            client_session.release()
+
+    def unlock_session(self, client_session):
+        client_session.flush()
+        client_session.release()
+
+    def client_ids(self):
+        return [unquote(name) for name in os.listdir(self.directory)
+                if os.path.isdir(os.path.join(self.directory, name))]
+
+    def can_evict(self, client_session):
+        return not client_session.is_locked()
+
+    def evict(self, client_id, client_session):
+        # all changes have already been written in flush()
+        logger.debug('Removed session with client_id={} from memory'.format(client_id))
+
+    def flush(self):
+        with self.lock:
+            for client_session in self.sessions.values():
+                client_session.flush()
+            for client_id, client_session in list(self.sessions.items()):
+                if len(self.sessions) <= self.max_in_memory:
+                    break
+                if self.can_evict(client_session):
+                    del self.sessions[client_id]
+                    self.evict(client_id, client_session)
+        super().flush()
+
+    def clean_up(self, timeout):
+        now = datetime.now()
+        for client_id in self.client_ids():
+            client_session = DiskSession(self._client_directory(client_id), self.separate_keys)
+            last_accessed = client_session.last_accessed()
+            if last_accessed is None or (now - last_accessed).total_seconds() > timeout:
+                logger.info('Cleaning up session with client_id={}'.format(client_id))
+                self.delete(client_id)
@@ -32,6 +32,17 @@ OIDC_CLIENT_SECRETS = os.environ.get('OIDC_CLIENT_SECRETS', None) # 'credentials
 _use_gevent = os.environ.get('MAPEDITOR_USE_GEVENT', '')
 USE_GEVENT = (_use_gevent.upper() == 'TRUE' or _use_gevent == '1')
 
+# Session backend: 'memory' (sessions are kept in the worker process) or 'disk' (sessions are stored in
+# SESSION_STORE_DIR, such that multiple worker processes can serve the same client)
+SESSION_BACKEND = os.environ.get('MAPEDITOR_SESSION_BACKEND', 'memory')
+SESSION_STORE_DIR = os.environ.get('MAPEDITOR_SESSION_STORE_DIR', '/tmp/mapeditor_sessions')
+SESSION_MAX_IN_MEMORY = int(os.environ.get('MAPEDITOR_SESSION_MAX_IN_MEMORY', '20'))
+# Memory budget for all sessions in memory of a worker process, least recently used sessions are evicted (0 = no limit).
+# The memory backend writes evicted sessions to SESSION_STORE_DIR if SESSION_SPILL_TO_DISK is enabled.
+SESSION_MEMORY_BUDGET_MB = int(os.environ.get('MAPEDITOR_SESSION_MEMORY_BUDGET_MB', '2048'))
+_session_spill_to_disk = os.environ.get('MAPEDITOR_SESSION_SPILL_TO_DISK', 'TRUE')
+SESSION_SPILL_TO_DISK = (_session_spill_to_disk.upper() == 'TRUE' or _session_spill_to_disk == '1')
+
 settings_storage_config = {
     "host": os.environ.get('SETTINGS_STORAGE_HOST', None),  # "mongo",
     "port": os.environ.get('SETTINGS_STORAGE_PORT', "27017"),
@@ -51,6 +62,35 @@ boundaries_config = {
     "path_boundaries": "/boundaries"
 }
 
+# Boundaries of the boundary service are cached in memory and in BOUNDARY_CACHE_DIR (an empty value disables the
+# on-disk cache). Missing boundaries are fetched with at most BOUNDARY_SERVICE_MAX_CONNECTIONS parallel requests
+BOUNDARY_CACHE_DIR = os.environ.get('MAPEDITOR_BOUNDARY_CACHE_DIR', '/tmp/mapeditor_boundaries')
+BOUNDARY_CACHE_MEMORY_MB = int(os.environ.get('MAPEDITOR_BOUNDARY_CACHE_MEMORY_MB', '256'))
+BOUNDARY_CACHE_TTL_DAYS = int(os.environ.get('MAPEDITOR_BOUNDARY_CACHE_TTL_DAYS', '30'))
+BOUNDARY_SERVICE_MAX_CONNECTIONS = int(os.environ.get('MAPEDITOR_BOUNDARY_SERVICE_MAX_CONNECTIONS', '16'))
+
+# Energy systems with more than VIEWPORT_LOADING_THRESHOLD assets, potentials and buildings (0 = no limit) are not sent
+# to the client at once, the client requests the objects in its viewport instead. Objects are aggregated in clusters if
+# the map is zoomed out below VIEWPORT_CLUSTER_ZOOM
+VIEWPORT_LOADING_THRESHOLD = int(os.environ.get('MAPEDITOR_VIEWPORT_LOADING_THRESHOLD', '10000'))
+VIEWPORT_CLUSTER_ZOOM = int(os.environ.get('MAPEDITOR_VIEWPORT_CLUSTER_ZOOM', '15'))
+
+# Memory budget of the cache of the vector tiles of energy systems (/tiles/<es_id>/<z>/<x>/<y>.mvt)
+VECTOR_TILE_CACHE_MEMORY_MB = int(os.environ.get('MAPEDITOR_VECTOR_TILE_CACHE_MEMORY_MB', '128'))
+
+# The points of lines and polygons with at least COMPACT_GEOMETRY_MIN_POINTS points are stored as arrays of coordinates
+# after an energy system is loaded, which reduces memory usage of large networks (0 = disabled)
+COMPACT_GEOMETRY_MIN_POINTS = int(os.environ.get('MAPEDITOR_COMPACT_GEOMETRY_MIN_POINTS', '0'))
+
+# Clients of the InfluxDB time series databases are shared per host and user (see src/timeseries.py): timeout in
+# seconds of a request, number of attempts of a request and number of keep-alive connections per client
+INFLUXDB_TIMEOUT = int(os.environ.get('MAPEDITOR_INFLUXDB_TIMEOUT', '30'))
+INFLUXDB_RETRIES = int(os.environ.get('MAPEDITOR_INFLUXDB_RETRIES', '3'))
+INFLUXDB_POOL_SIZE = int(os.environ.get('MAPEDITOR_INFLUXDB_POOL_SIZE', '10'))
+
+# Maximum number of load duration curves of simulation results that are cached (see src/ldc.py)
+LDC_CACHE_SIZE = int(os.environ.get('MAPEDITOR_LDC_CACHE_SIZE', '1000'))
+
 profile_database_config = {
     "protocol": "http",
     "host": os.environ.get('PROFILE_DATABASE_HOST', None),  # "influxdb",
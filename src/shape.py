@@ -17,6 +17,7 @@ import json
 from shapely import wkt, wkb
 from shapely.geometry import Point, LineString, Polygon, MultiPolygon, shape
 from shapely_geojson import Feature, dumps
+from esdl.processing.ESDLGeometry import get_coordinates
 import esdl
 
 
@@ -173,10 +174,7 @@ class ShapeLine(Shape):
     @staticmethod
     def parse_esdl(esdl_geometry):
         if isinstance(esdl_geometry, esdl.Line):
-            linestring = list()
-            for p in esdl_geometry.point:
-                linestring.append((p.lon, p.lat))
-            return LineString(linestring)
+            return LineString(get_coordinates(esdl_geometry))
         else:
             raise Exception("Cannot instantiate a Shapely LineString with an ESDL geometry other than esdl.Line")
 
@@ -212,15 +210,8 @@ class ShapePolygon(Shape):
     @staticmethod
     def parse_esdl(esdl_geometry):
         if isinstance(esdl_geometry, esdl.Polygon):
-            exterior = list()
-            interiors = list()
-            for p in esdl_geometry.exterior.point:
-                exterior.append([p.lon, p.lat])
-            for pol in esdl_geometry.interior:
-                interior = list()
-                for p in pol.point:
-                    interior.append([p.lon, p.lat])
-                interiors.append(interior)
+            exterior = get_coordinates(esdl_geometry.exterior)
+            interiors = [get_coordinates(pol) for pol in esdl_geometry.interior]
             return Polygon(exterior, interiors)
         else:
             raise Exception("Cannot instantiate a Shapely Polygon with an ESDL geometry other than esdl.Polygon")
@@ -0,0 +1,171 @@
+#  This work is based on original code developed and copyrighted by TNO 2020.
+#  Subsequent contributions are licensed to you by the developers of such code and are
+#  made available to the Project under one or several contributor license agreements.
+#
+#  This work is licensed to you under the Apache License, Version 2.0.
+#  You may obtain a copy of the license at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#      TNO         - Initial implementation
+#  Manager:
+#      TNO
+
+"""
+Columnar storage of the simulation results shown by the time dimension.
+
+The series of all assets of a simulation are loaded once into a (assets x time steps) NumPy array, with a common and
+sorted time axis. Any time window can then be served from memory at any resolution: the time steps are aggregated per
+bucket (mean, min and max). The values of a window are keyed by asset index, the static information of the assets
+(id, network, carrier) is sent once.
+"""
+
+from collections import OrderedDict
+from datetime import datetime, timezone
+import threading
+import numpy as np
+import src.timeseries as timeseries
+import src.log as log
+
+logger = log.get_logger(__name__)
+
+QUERY_BATCH_SIZE = 200          # number of assets per query when loading a simulation
+CACHE_SIZE = 4                  # number of simulations that are kept in memory
+
+
+class SimulationData:
+    def __init__(self, asset_ids, networks, carriers, times, values):
+        """
+        :param asset_ids: list of asset ids, the asset index is the position in this list
+        :param networks: list with the network (measurement) per asset index
+        :param carriers: list with the carrier id per asset index
+        :param times: sorted NumPy array of time steps, in seconds since the epoch
+        :param values: NumPy array (assets x time steps), NaN if an asset has no value at a time step
+        """
+        self.asset_ids = asset_ids
+        self.networks = networks
+        self.carriers = carriers
+        self.times = times
+        self.values = values
+        self.asset_index = {asset_id: index for index, asset_id in enumerate(asset_ids)}
+
+    @classmethod
+    def from_series(cls, series):
+        """
+        :param series: list of (asset_id, network, carrier_id, times, values) tuples, times and values as NumPy arrays
+        """
+        times = np.unique(np.concatenate([s[3] for s in series])) if series else np.empty(0, dtype=np.int64)
+        values = np.full((len(series), len(times)), np.nan, dtype=np.float32)
+        for row, (_, _, _, series_times, series_values) in enumerate(series):
+            values[row, np.searchsorted(times, series_times)] = series_values
+        return cls([s[0] for s in series], [s[1] for s in series], [s[2] for s in series], times, values)
+
+    def assets(self):
+        """Returns the static information of the assets, by asset index"""
+        return [{'id': asset_id, 'network': network, 'carrier': carrier}
+                for asset_id, network, carrier in zip(self.asset_ids, self.networks, self.carriers)]
+
+    def boundaries(self):
+        """Returns the (min, max) value per network"""
+        networks = np.array(self.networks)
+        result = dict()
+        for network in sorted(set(self.networks)):
+            rows = self.values[networks == network]
+            if rows.size and not np.isnan(rows).all():
+                result[network] = (float(np.nanmin(rows)), float(np.nanmax(rows)))
+        return result
+
+    def window(self, start, end, resolution=None):
+        """
+        Returns the values of the time steps in [start, end), aggregated per bucket of resolution seconds
+        :param start: start of the window, in seconds since the epoch
+        :param end: end of the window, in seconds since the epoch
+        :param resolution: length of a bucket in seconds, None for the time steps of the simulation
+        :return: dict with the times of the buckets (NumPy array) and the mean, min and max values (NumPy arrays of
+                 buckets x assets, NaN if an asset has no value in a bucket). Empty buckets are left out.
+        """
+        first, last = np.searchsorted(self.times, [start, end])
+        times = self.times[first:last]
+        values = self.values[:, first:last]
+        if resolution is None or len(times) == 0:
+            return {'times': times, 'mean': values.T, 'min': values.T, 'max': values.T}
+
+        buckets = (times - start) // resolution
+        bucket_starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        valid = ~np.isnan(values)
+        counts = np.add.reduceat(valid, bucket_starts, axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.add.reduceat(np.where(valid, values, 0), bucket_starts, axis=1) / counts
+        minimum = np.minimum.reduceat(np.where(valid, values, np.inf), bucket_starts, axis=1)
+        maximum = np.maximum.reduceat(np.where(valid, values, -np.inf), bucket_starts, axis=1)
+        empty = counts == 0
+        minimum[empty] = np.nan
+        maximum[empty] = np.nan
+        return {'times': start + buckets[bucket_starts] * resolution, 'mean': mean.T, 'min': minimum.T,
+                'max': maximum.T}
+
+
+def to_json_values(values, decimals=3):
+    """Returns an array as (nested) lists of rounded values, with None for NaN as JSON has no NaN"""
+    rounded = np.round(values.astype(np.float64), decimals).astype(object)
+    rounded[np.isnan(values)] = None
+    return rounded.tolist()
+
+
+def to_iso(epoch_seconds):
+    return datetime.fromtimestamp(int(epoch_seconds), timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def load_simulation_data(client, asset_ids, field, simulation_run):
+    """
+    Loads the series of a field of all assets from the database, per network and per batch of QUERY_BATCH_SIZE assets
+    :param asset_ids: dict with the list of asset ids per network (measurement)
+    """
+    series = list()
+    for network, ids in asset_ids.items():
+        for start in range(0, len(ids), QUERY_BATCH_SIZE):
+            query = 'SELECT "' + field + '", "carrierId" FROM "' + network + '" WHERE "simulationRun" = \'' + \
+                    simulation_run + '\' AND ' + timeseries.tag_filter('assetId', ids[start:start + QUERY_BATCH_SIZE]) + \
+                    ' GROUP BY "assetId"'
+            logger.debug(query)
+            result = client.query(query, epoch='s')
+            for s in result.raw.get('series', []) if result else []:
+                rows = s.get('values', [])
+                if not rows:
+                    continue
+                columns = s['columns']
+                time_index, field_index, carrier_index = columns.index('time'), columns.index(field), \
+                    columns.index('carrierId')
+                times = np.fromiter((row[time_index] for row in rows), dtype=np.int64, count=len(rows))
+                values = np.fromiter((np.nan if row[field_index] is None else row[field_index] for row in rows),
+                                     dtype=np.float64, count=len(rows))
+                series.append((s['tags']['assetId'], network, rows[0][carrier_index], times, values))
+    return SimulationData.from_series(series)
+
+
+_lock = threading.Lock()
+_cache = OrderedDict()      # (database, simulation run, field) -> SimulationData, least recently used first
+
+
+def get_simulation_data(client, database, asset_ids, field, simulation_run):
+    """Returns the SimulationData of a simulation, it is loaded from the database on first use"""
+    key = (database, simulation_run, field)
+    with _lock:
+        data = _cache.get(key)
+        if data is not None:
+            _cache.move_to_end(key)
+            return data
+    data = load_simulation_data(client, asset_ids, field, simulation_run)
+    logger.info('Loaded {} time steps of {} assets of simulation {}'.format(len(data.times), len(data.asset_ids),
+                                                                            simulation_run))
+    with _lock:
+        _cache[key] = data
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return data
+
+
+def clear_simulation_data(database, field, simulation_run):
+    with _lock:
+        _cache.pop((database, simulation_run, field), None)
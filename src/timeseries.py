@@ -0,0 +1,165 @@
+#  This work is based on original code developed and copyrighted by TNO 2020.
+#  Subsequent contributions are licensed to you by the developers of such code and are
+#  made available to the Project under one or several contributor license agreements.
+#
+#  This work is licensed to you under the Apache License, Version 2.0.
+#  You may obtain a copy of the license at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#      TNO         - Initial implementation
+#  Manager:
+#      TNO
+
+"""
+Shared access layer for the InfluxDB time series databases (simulation results, profiles, user logging):
+
+- one client per host, port and user, shared by all sessions, extensions and databases, such that the keep-alive
+  HTTP connections in its pool are reused instead of connecting for every request. The database is passed with every
+  query and write, so the number of clients doesn't grow with the number of databases that are used.
+- configurable timeout, number of retries and pool size (see INFLUXDB_* in settings)
+- query metrics per host and database: number of queries and errors, latency and number of rows and points written
+"""
+
+from influxdb import InfluxDBClient
+from influxdb.resultset import ResultSet
+import re
+import threading
+import time
+import src.settings as settings
+import src.log as log
+
+logger = log.get_logger(__name__)
+
+
+class QueryMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queries = 0
+        self.errors = 0
+        self.rows = 0
+        self.points_written = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def add(self, duration, rows=0, points_written=0, error=False):
+        with self.lock:
+            if error:
+                self.errors += 1
+            else:
+                self.queries += 1
+            self.rows += rows
+            self.points_written += points_written
+            self.total_time += duration
+            if duration > self.max_time:
+                self.max_time = duration
+
+    def stats(self):
+        with self.lock:
+            count = self.queries + self.errors
+            return {'queries': self.queries, 'errors': self.errors, 'rows': self.rows,
+                    'points_written': self.points_written,
+                    'average_ms': round(1000 * self.total_time / count, 1) if count else 0,
+                    'max_ms': round(1000 * self.max_time, 1)}
+
+
+def count_rows(result):
+    """Returns the number of rows in the result of a query (a ResultSet or a list of them for multiple statements)"""
+    if isinstance(result, list):
+        return sum(count_rows(r) for r in result)
+    if isinstance(result, ResultSet):
+        return sum(len(series.get('values', [])) for series in result.raw.get('series', []))
+    return 0
+
+
+def tag_filter(tag, values):
+    """Returns a WHERE clause condition that matches any of the values of a tag"""
+    return '"' + tag + '" =~ /^(' + '|'.join(re.escape(v).replace('/', '\\/') for v in values) + ')$/'
+
+
+class TimeSeriesClient:
+    """
+    Wraps a shared InfluxDBClient for one database and records metrics of its queries and writes. Only the methods
+    below are available: methods that change the shared client (e.g. switch_database(), switch_user() or close()) would
+    affect all other users of the client. Methods that take a database use the database of this client.
+    """
+    def __init__(self, client, database, metrics):
+        self.client = client
+        self.database = database
+        self.metrics = metrics
+
+    def query(self, query, *args, **kwargs):
+        if self.database is not None:
+            kwargs.setdefault('database', self.database)
+        start = time.monotonic()
+        try:
+            result = self.client.query(query, *args, **kwargs)
+        except Exception:
+            self.metrics.add(time.monotonic() - start, error=True)
+            raise
+        self.metrics.add(time.monotonic() - start, rows=count_rows(result))
+        return result
+
+    def write_points(self, points, *args, **kwargs):
+        if self.database is not None:
+            kwargs.setdefault('database', self.database)
+        start = time.monotonic()
+        try:
+            result = self.client.write_points(points, *args, **kwargs)
+        except Exception:
+            self.metrics.add(time.monotonic() - start, error=True)
+            raise
+        self.metrics.add(time.monotonic() - start, points_written=len(points))
+        return result
+
+    def ping(self):
+        return self.client.ping()
+
+    def get_list_database(self):
+        return self.client.get_list_database()
+
+    def get_list_measurements(self):
+        # InfluxDBClient.get_list_measurements() uses the default database of the shared client
+        return list(self.query('SHOW MEASUREMENTS').get_points())
+
+    def get_list_series(self, measurement=None, tags=None):
+        return self.client.get_list_series(database=self.database, measurement=measurement, tags=tags)
+
+    def get_list_retention_policies(self):
+        return self.client.get_list_retention_policies(database=self.database)
+
+    def create_database(self, dbname=None):
+        """Creates the database of this client (or dbname), an existing database is not changed"""
+        return self.client.create_database(dbname if dbname is not None else self.database)
+
+
+_lock = threading.Lock()
+_clients = dict()       # (host, port, username, password, timeout) -> InfluxDBClient
+_metrics = dict()       # 'host:port/database' -> QueryMetrics
+
+
+def get_client(host, port=8086, database=None, username='root', password='root', timeout=None):
+    """
+    Returns a client for a database that uses the shared client of the host, which is created on first use
+    :param timeout: timeout in seconds of a request, None for settings.INFLUXDB_TIMEOUT
+    """
+    if timeout is None:
+        timeout = settings.INFLUXDB_TIMEOUT
+    key = (host, int(port), username, password, timeout)
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            logger.info('Creating InfluxDB client for {}:{}'.format(host, port))
+            client = InfluxDBClient(host=host, port=int(port), username=username, password=password, timeout=timeout,
+                                    retries=settings.INFLUXDB_RETRIES, pool_size=settings.INFLUXDB_POOL_SIZE)
+            _clients[key] = client
+        metrics = _metrics.setdefault('{}:{}/{}'.format(host, port, database), QueryMetrics())
+    return TimeSeriesClient(client, database, metrics)
+
+
+def get_metrics():
+    """Returns the query metrics per host and database"""
+    with _lock:
+        metrics = dict(_metrics)
+    return {key: m.stats() for key, m in metrics.items()}
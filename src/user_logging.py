@@ -13,7 +13,7 @@
 #      TNO
 
 import src.settings as settings
-from influxdb import InfluxDBClient
+import src.timeseries as timeseries
 from datetime import datetime
 import src.log as log
 import threading
@@ -41,7 +41,7 @@ class UserLogging:
         else:
             logger.info("Connecting for user_login {}:{} Database: {}".format(self.config['host'],
                   self.config['port'], self.config['database']))
-            client = InfluxDBClient(host=self.config['host'],
+            client = timeseries.get_client(host=self.config['host'],
                   port=self.config['port'], database=self.config['database'], timeout=5)
             if self.config['database'] not in client.get_list_database():
                 # client.drop_database(self.config['database'])
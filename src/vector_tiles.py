@@ -0,0 +1,474 @@
+#  This work is based on original code developed and copyrighted by TNO 2020.
+#  Subsequent contributions are licensed to you by the developers of such code and are
+#  made available to the Project under one or several contributor license agreements.
+#
+#  This work is licensed to you under the Apache License, Version 2.0.
+#  You may obtain a copy of the license at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Contributors:
+#      TNO         - Initial implementation
+#  Manager:
+#      TNO
+
+"""
+Mapbox Vector Tiles (https://github.com/mapbox/vector-tile-spec) of an energy system, with the layers:
+
+- assets: the assets, potentials and buildings with a point or polygon geometry
+- conductors: the assets with a line geometry (pipes, cables, ...)
+- connections: the connections between the ports of assets, as shown in the map
+- areas: the area boundaries, as created by find_area_info_geojson()
+
+Tiles are rendered from the in-memory model, using the SpatialIndex of the energy system to find the objects in a
+tile, and are cached until the energy system changes.
+"""
+
+from collections import OrderedDict
+from shapely.geometry import LineString, MultiLineString, MultiPoint, MultiPolygon, box, shape as shapely_shape
+from shapely.geometry.polygon import orient
+from shapely.ops import clip_by_rect, transform
+from shapely.strtree import STRtree
+from esdl import esdl
+from esdl.processing import ESDLAsset
+import shapely
+from extensions.boundary_service import boundary_zoom_level
+from src.process_es_area_bld import create_area_info_geojson, is_shown_on_map, VIEWPORT_TYPES
+import numpy as np
+import math
+import struct
+import threading
+import src.log as log
+
+logger = log.get_logger(__name__)
+
+TILE_EXTENT = 4096      # coordinates in a tile range from 0 to TILE_EXTENT
+TILE_BUFFER = 64        # tile coordinates outside the tile that are included, such that lines continue in the next tile
+CONNECTIONS_MIN_ZOOM = 12   # connections are not shown in tiles of lower zoom levels
+FEATURE_MEMORY_SIZE = 512   # approximate memory in bytes of a cached feature besides its coordinates
+
+MVT_VERSION = 2
+MVT_POINT = 1
+MVT_LINESTRING = 2
+MVT_POLYGON = 3
+MVT_MOVE_TO = 1
+MVT_LINE_TO = 2
+MVT_CLOSE_PATH = 7
+
+_MULTI_TYPES = (('Polygon', MultiPolygon), ('LineString', MultiLineString), ('Point', MultiPoint))
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+#  Tile coordinates
+# ---------------------------------------------------------------------------------------------------------------------
+def tile_bounds(z, x, y, buffer=0):
+    """
+    Returns the bounds (min_lon, min_lat, max_lon, max_lat) of a tile, extended with buffer tile coordinates
+    """
+    n = 2 ** z
+    margin = buffer / TILE_EXTENT
+
+    def lat(tile_y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * tile_y / n))))
+
+    return (max((x - margin) / n * 360 - 180, -180), lat(min(y + 1 + margin, n)),
+            min((x + 1 + margin) / n * 360 - 180, 180), lat(max(y - margin, 0)))
+
+
+def tile_projection(z, x, y):
+    """Returns a function that converts lon, lat (WGS84) to the coordinates of a tile (Web Mercator, y down)"""
+    n = 2 ** z
+
+    def project(lon, lat):
+        lon = np.asarray(lon, dtype=float)
+        lat = np.clip(np.asarray(lat, dtype=float), -85.0511, 85.0511)
+        tx = ((lon + 180) / 360 * n - x) * TILE_EXTENT
+        ty = ((1 - np.arcsinh(np.tan(np.radians(lat))) / math.pi) / 2 * n - y) * TILE_EXTENT
+        return tx, ty
+
+    return project
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+#  Protocol buffers encoding of vector tiles
+# ---------------------------------------------------------------------------------------------------------------------
+def _varint(out, value):
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _zigzag(value):
+    return value << 1 if value >= 0 else (-value << 1) - 1
+
+
+def _key(out, field, wire_type):
+    _varint(out, (field << 3) | wire_type)
+
+
+def _bytes_field(out, field, data):
+    _key(out, field, 2)
+    _varint(out, len(data))
+    out.extend(data)
+
+
+def _packed_field(out, field, values):
+    if max(values, default=0) <= 0x7f:
+        data = bytes(values)    # all values fit in a single byte, which is common for small relative coordinates
+    else:
+        data = bytearray()
+        for value in values:
+            _varint(data, value)
+    _bytes_field(out, field, data)
+
+
+def _encode_value(value):
+    out = bytearray()
+    if isinstance(value, bool):
+        _key(out, 7, 0)
+        _varint(out, int(value))
+    elif isinstance(value, int):
+        _key(out, 6, 0)
+        _varint(out, _zigzag(value))
+    elif isinstance(value, float):
+        _key(out, 3, 1)
+        out.extend(struct.pack('<d', value))
+    else:
+        _bytes_field(out, 1, str(value).encode('utf-8'))
+    return out
+
+
+class _GeometryEncoder:
+    """Encodes the parts of a geometry as commands with coordinates relative to the previous position"""
+    def __init__(self):
+        self.commands = []
+        self.cx = 0
+        self.cy = 0
+
+    def _add_points(self, points):
+        append = self.commands.append
+        cx, cy = self.cx, self.cy
+        for px, py in points:
+            append(_zigzag(px - cx))
+            append(_zigzag(py - cy))
+            cx, cy = px, py
+        self.cx, self.cy = cx, cy
+
+    def add_points(self, points):
+        self.commands.append(MVT_MOVE_TO | (len(points) << 3))
+        self._add_points(points)
+
+    def add_line(self, points, close=False):
+        self.commands.append(MVT_MOVE_TO | (1 << 3))
+        self._add_points(points[:1])
+        self.commands.append(MVT_LINE_TO | ((len(points) - 1) << 3))
+        self._add_points(points[1:])
+        if close:
+            self.commands.append(MVT_CLOSE_PATH | (1 << 3))
+
+
+def _round_coords(coords):
+    """Rounds coordinates to integers and removes consecutive duplicates"""
+    points = []
+    for coord in coords:
+        point = (int(round(coord[0])), int(round(coord[1])))
+        if not points or point != points[-1]:
+            points.append(point)
+    return points
+
+
+def _signed_area(points):
+    return sum(x0 * y1 - x1 * y0 for (x0, y0), (x1, y1) in zip(points, points[1:] + points[:1])) / 2
+
+
+def _parts(geometry):
+    return getattr(geometry, 'geoms', [geometry])
+
+
+def encode_geometry(geometry):
+    """
+    Encodes a shapely geometry in tile coordinates
+    :return: the MVT geometry type and the commands, or None if nothing remains after rounding the coordinates
+    """
+    encoder = _GeometryEncoder()
+    geom_type = geometry.geom_type
+    if geom_type in ('Point', 'MultiPoint'):
+        points = [p for part in _parts(geometry) for p in _round_coords(part.coords)]
+        if not points:
+            return None
+        encoder.add_points(points)
+        return MVT_POINT, encoder.commands
+    if geom_type in ('LineString', 'MultiLineString'):
+        for part in _parts(geometry):
+            points = _round_coords(part.coords)
+            if len(points) >= 2:
+                encoder.add_line(points)
+        return (MVT_LINESTRING, encoder.commands) if encoder.commands else None
+    if geom_type in ('Polygon', 'MultiPolygon'):
+        for part in _parts(geometry):
+            # exterior rings have a positive area in tile coordinates (clockwise, y is down), interior rings negative
+            part = orient(part, sign=1.0)
+            exterior = _round_coords(part.exterior.coords)[:-1]
+            if len(exterior) < 3 or _signed_area(exterior) <= 0:
+                continue
+            encoder.add_line(exterior, close=True)
+            for interior in part.interiors:
+                ring = _round_coords(interior.coords)[:-1]
+                if len(ring) >= 3 and _signed_area(ring) < 0:
+                    encoder.add_line(ring, close=True)
+        return (MVT_POLYGON, encoder.commands) if encoder.commands else None
+    if geom_type == 'GeometryCollection':
+        # clipping can result in a collection of different geometry types, only keep the parts of the highest dimension
+        for part_type, multi_type in _MULTI_TYPES:
+            parts = [p for part in geometry.geoms if part.geom_type.endswith(part_type) for p in _parts(part)]
+            if parts:
+                return encode_geometry(multi_type(parts))
+    return None
+
+
+def encode_layer(name, features):
+    """
+    Encodes a layer of a vector tile
+    :param features: list of (geometry in tile coordinates, dict of properties)
+    """
+    keys = OrderedDict()
+    values = OrderedDict()
+    encoded_features = []
+    for geometry, properties in features:
+        encoded_geometry = encode_geometry(geometry)
+        if encoded_geometry is None:
+            continue
+        geom_type, commands = encoded_geometry
+        tags = []
+        for key, value in properties.items():
+            if value is None:
+                continue
+            tags.append(keys.setdefault(key, len(keys)))
+            tags.append(values.setdefault((type(value), value), len(values)))
+        feature = bytearray()
+        if tags:
+            _packed_field(feature, 2, tags)
+        _key(feature, 3, 0)
+        _varint(feature, geom_type)
+        _packed_field(feature, 4, commands)
+        encoded_features.append(feature)
+
+    out = bytearray()
+    _key(out, 15, 0)
+    _varint(out, MVT_VERSION)
+    _bytes_field(out, 1, name.encode('utf-8'))
+    for feature in encoded_features:
+        _bytes_field(out, 2, feature)
+    for key in keys:
+        _bytes_field(out, 3, key.encode('utf-8'))
+    for _, value in values:
+        _bytes_field(out, 4, _encode_value(value))
+    _key(out, 5, 0)
+    _varint(out, TILE_EXTENT)
+    return out
+
+
+def encode_tile(layers):
+    """
+    Encodes a vector tile
+    :param layers: list of (layer name, list of (geometry in tile coordinates, dict of properties))
+    """
+    out = bytearray()
+    for name, features in layers:
+        _bytes_field(out, 3, encode_layer(name, features))
+    return bytes(out)
+
+
+# ---------------------------------------------------------------------------------------------------------------------
+#  Tiles of an energy system
+# ---------------------------------------------------------------------------------------------------------------------
+def _port_carrier_id(asset):
+    for port in asset.port:
+        if port.carrier:
+            return port.carrier.id
+    return None
+
+
+def _object_properties(obj):
+    properties = {'id': obj.id, 'name': obj.name, 'type': type(obj).__name__}
+    if isinstance(obj, esdl.EnergyAsset):
+        properties['capability'] = ESDLAsset.get_asset_capability_type(obj)
+        properties['carrier'] = _port_carrier_id(obj)
+    elif isinstance(obj, esdl.Potential):
+        properties['capability'] = 'Potential'
+    else:
+        properties['capability'] = 'Building'
+    return properties
+
+
+def _connection_features(conn_list):
+    """Creates the geometries and properties of the connections, connections are listed from both sides"""
+    features = []
+    seen = set()
+    for conn in conn_list:
+        key = frozenset((conn['from-port-id'], conn['to-port-id']))
+        if key in seen:
+            continue
+        seen.add(key)
+        (from_lat, from_lon), (to_lat, to_lon) = conn['from-asset-coord'], conn['to-asset-coord']
+        carrier = conn['from-port-carrier']
+        features.append((LineString([(from_lon, from_lat), (to_lon, to_lat)]), {
+            'from_port_id': conn['from-port-id'],
+            'to_port_id': conn['to-port-id'],
+            'carrier': carrier if carrier == conn['to-port-carrier'] else 'conflicting_carriers'
+        }))
+    return features
+
+
+def _area_features(area, zoom):
+    # tiles are read-only, the random locations of assets without a geometry are assigned when the area is loaded
+    area_list, _, _ = create_area_info_geojson(area, zoom, assign_locations=False)
+    features = []
+    for feature in area_list:
+        properties = {'id': feature['properties']['id'], 'name': feature['properties']['name']}
+        for kpi_name, kpi_value in feature['properties'].get('KPIs', {}).items():
+            if isinstance(kpi_value, (int, float, str)):
+                properties['KPI ' + kpi_name] = kpi_value
+        features.append((shapely_shape(feature['geometry']), properties))
+    return features
+
+
+class _FeatureTree:
+    """STRtree of (geometry, properties) features that are not in the SpatialIndex of the energy system"""
+    def __init__(self, features):
+        self.features = [f for f in features if not f[0].is_empty]
+        self.tree = STRtree([geometry for geometry, _ in self.features]) if self.features else None
+        self.index = {id(geometry): i for i, (geometry, _) in enumerate(self.features)}
+        self.size = sum(len(geometry.wkb) + FEATURE_MEMORY_SIZE for geometry, _ in self.features)
+
+    def query(self, bbox):
+        if self.tree is None:
+            return []
+        # shapely 2 returns the indices of the geometries, shapely 1.x the geometries themselves
+        return [self.features[self.index[id(r)] if hasattr(r, 'geom_type') else int(r)]
+                for r in self.tree.query(bbox)]
+
+
+def _to_tile(features, project, clip_bounds, simplify=False):
+    """Converts the geometries of features to tile coordinates and clips them to clip_bounds"""
+    if not features:
+        return []
+    if hasattr(shapely, 'transform'):
+        # shapely 2 transforms the coordinates of all geometries at once
+        geometries = shapely.transform(np.array([geometry for geometry, _ in features], dtype=object),
+                                       lambda coords: np.column_stack(project(coords[:, 0], coords[:, 1])))
+    else:
+        geometries = [transform(project, geometry) for geometry, _ in features]
+
+    min_x, min_y, max_x, max_y = clip_bounds
+    tile_features = []
+    for geometry, (_, properties) in zip(geometries, features):
+        bounds = geometry.bounds
+        if bounds[2] < min_x or bounds[0] > max_x or bounds[3] < min_y or bounds[1] > max_y:
+            continue
+        if geometry.geom_type != 'Point':
+            if bounds[0] < min_x or bounds[2] > max_x or bounds[1] < min_y or bounds[3] > max_y:
+                geometry = clip_by_rect(geometry, *clip_bounds)
+                if geometry.is_empty:
+                    continue
+            if simplify:
+                geometry = geometry.simplify(1, preserve_topology=True)
+        tile_features.append((geometry, properties))
+    return tile_features
+
+
+class VectorTileCache:
+    """
+    Cache of the vector tiles of energy systems, and of the connection and area features from which they are rendered.
+    Both are cached in one LRU cache with a memory budget, keyed by the version of the SpatialIndex of the energy system
+    (and of its connections), such that a change of the energy system invalidates them. Entries of energy systems that
+    changed or that are no longer used (e.g. the session ended) are evicted as they are the least recently used.
+    """
+    def __init__(self, memory_size=0):
+        """:param memory_size: maximum total size in bytes of the cached tiles and features, 0 for no limit"""
+        self.memory_size = memory_size
+        self.lock = threading.Lock()
+        # ('tile', es_id, version, z, x, y) -> bytes, ('connections', es_id, version) -> _FeatureTree and
+        # ('areas', es_id, version, boundary zoom level) -> _FeatureTree, least recently used first
+        self.entries = OrderedDict()
+        self.size = 0
+
+    @staticmethod
+    def _entry_size(value):
+        return len(value) if isinstance(value, bytes) else value.size
+
+    def _get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def _put(self, key, value):
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= self._entry_size(previous)
+            self.entries[key] = value
+            self.size += self._entry_size(value)
+            while self.memory_size and self.size > self.memory_size and len(self.entries) > 1:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= self._entry_size(evicted)
+
+    def _feature_tree(self, key, create_features):
+        tree = self._get(key)
+        if tree is None:
+            tree = _FeatureTree(create_features())
+            self._put(key, tree)
+        return tree
+
+    def get_tile(self, esh, es_id, conn_list, z, x, y):
+        """
+        Returns the vector tile of an energy system, from the cache if the energy system didn't change. The caller must
+        hold the session lock, such that the energy system doesn't change while the tile is rendered.
+        :param conn_list: the connections of the energy system as shown in the map (ConnectionStore)
+        """
+        index = esh.get_spatial_index(es_id)
+        if index is None:
+            return None
+        key = ('tile', es_id, index.version, getattr(conn_list, 'version', None), z, x, y)
+        tile = self._get(key)
+        if tile is None:
+            tile = self.render_tile(esh, es_id, conn_list, z, x, y)
+            self._put(key, tile)
+        return tile
+
+    def render_tile(self, esh, es_id, conn_list, z, x, y):
+        index = esh.get_spatial_index(es_id)
+        bbox = tile_bounds(z, x, y, TILE_BUFFER)
+        project = tile_projection(z, x, y)
+        clip_bounds = (-TILE_BUFFER, -TILE_BUFFER, TILE_EXTENT + TILE_BUFFER, TILE_EXTENT + TILE_BUFFER)
+
+        assets = []
+        conductors = []
+        for obj in index.query_bbox(*bbox, types=VIEWPORT_TYPES):
+            if not is_shown_on_map(obj):
+                continue
+            geometry = index.get_geometry(obj)
+            if geometry.geom_type in ('LineString', 'MultiLineString'):
+                conductors.append((geometry, _object_properties(obj)))
+            else:
+                assets.append((geometry, _object_properties(obj)))
+
+        connections = []
+        if z >= CONNECTIONS_MIN_ZOOM and conn_list is not None:
+            key = ('connections', es_id, index.version, getattr(conn_list, 'version', None))
+            connections = self._feature_tree(key, lambda: _connection_features(conn_list)).query(box(*bbox))
+
+        # boundaries of the boundary service are simplified for the zoom level
+        area = esh.get_energy_system(es_id).instance[0].area
+        key = ('areas', es_id, index.version, boundary_zoom_level(z))
+        areas = self._feature_tree(key, lambda: _area_features(area, z)).query(box(*bbox))
+
+        return encode_tile([
+            ('areas', _to_tile(areas, project, clip_bounds, simplify=True)),
+            ('connections', _to_tile(connections, project, clip_bounds)),
+            ('conductors', _to_tile(conductors, project, clip_bounds)),
+            ('assets', _to_tile(assets, project, clip_bounds)),
+        ])
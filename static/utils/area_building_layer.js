@@ -803,12 +803,30 @@ function add_potential_geojson_layer(geojson_pontential_data) {
     }).addTo(get_layers(active_layer_id, 'pot_layer'));
 }
 
+// Area boundaries are simplified by the server for the zoom level of the map, boundaries of another level are
+// requested when the zoom level changes
+var area_zoom_level = null;
+var area_zoom_levels = [];
+
+function get_area_zoom_level(zoom) {
+    let level = area_zoom_levels[0];
+    for (let i = 0; i < area_zoom_levels.length; i++) {
+        if (zoom >= area_zoom_levels[i]) level = area_zoom_levels[i];
+    }
+    return level;
+}
+
 function add_geojson_listener(socket, map) {
     socket.on('geojson', function(message) {
         let layer = message['layer'];
         hide_loader();
 
         if (layer == 'area_layer') {
+            if (message['replace']) {
+                clear_layers(active_layer_id, 'area_layer');
+            }
+            area_zoom_level = message['zoom_level'];
+            if (message['zoom_levels']) area_zoom_levels = message['zoom_levels'];
             geojson_area_data = message['geojson'];     // store for redraw based on other KPI
             add_area_geojson_layer_with_legend(geojson_area_data);
         }
@@ -823,6 +841,16 @@ function add_geojson_listener(socket, map) {
             add_potential_geojson_layer(message['geojson']);
         }
     });
+
+    map.on('zoomend', function() {
+        if (area_zoom_level != null && geojson_area_data && geojson_area_data.length) {
+            let zoom_level = get_area_zoom_level(map.getZoom());
+            if (zoom_level != area_zoom_level) {
+                area_zoom_level = zoom_level;       // don't request the same level again
+                socket.emit('get_area_boundaries', {'zoom': map.getZoom()});
+            }
+        }
+    });
 }
 
 // ------------------------------------------------------------------------------------------------------------
@@ -16,6 +16,7 @@
 
 class LoadDurationCurve {
     constructor() {
+        this.batch_results = {};    // asset id -> result of calculate_load_duration_curves
         this.initSocketIO();
     }
 
@@ -26,12 +27,26 @@ class LoadDurationCurve {
             ldc_control = L.control.load_duration_curve('ldccontrol', {position: 'bottomright', data: ldc_data});
             ldc_control.addTo(map);
         });
+
+        socket.on('ldc-batch-data', function(chunk) {
+            for (let result of chunk['results']) {
+                load_duration_curve.batch_results[result['asset_id']] = result;
+            }
+            console.log('Load duration curves: ' + chunk['done'] + ' of ' + chunk['total'] + ' assets');
+        });
     }
 
     calculate_load_duration_curve(event, id) {
         socket.emit('calculate_load_duration_curve', id);
     }
 
+    // Batch of load duration curves and statistics of a list of asset ids or of all assets of a type (e.g. 'Pipe'),
+    // the results are received in chunks and collected in batch_results
+    calculate_load_duration_curves(asset_ids, asset_type) {
+        this.batch_results = {};
+        socket.emit('calculate_load_duration_curves', {asset_ids: asset_ids, asset_type: asset_type});
+    }
+
     static create(event) {
         if (event.type === 'client_connected') {
             load_duration_curve = new LoadDurationCurve();
@@ -179,12 +179,26 @@ class ShapefileConverter {
         socket.emit('shpcvrt_receive_energyasset_info', shapefile_energyasset_list);
     }
 
+    updateProgress(message) {
+        let $td = $('#td_energyasset_'+message['zipfile_row']+'_'+message['row']);
+        let $progress = $td.children('.shpcvrt-progress');
+        if ($progress.length === 0) {
+            $progress = $('<span>').addClass('shpcvrt-progress');
+            $td.append(' ').append($progress);
+        }
+        $progress.text(message['done'] + ' / ' + message['total'] + ' records converted');
+    }
+
     initSocketIO() {
         console.log("Registering socket io bindings for ShapefileConverter")
 
         socket.on('shpcvrt_files_in_zip', function(message) {
             shapefile_converter_window.updateShapefileOverview(message);
         });
+
+        socket.on('shpcvrt_progress', function(message) {
+            shapefile_converter_window.updateProgress(message);
+        });
     }
 
     // all globals in here
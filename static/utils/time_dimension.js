@@ -153,16 +153,47 @@ L.TimeDimension.Layer.WindowedGeoJson = L.TimeDimension.Layer.GeoJson.extend({
 //        });
 //    },
 
+    // Builds the features of the frames of a window from the (static) asset table, which has the geometry and style
+    // of the assets by asset index, and the loads of the frames by asset index
+    buildFeatures: function(frames) {
+        let table = time_dimension.asset_table;
+        let features = [];
+        for (let t = 0; t < frames.times.length; t++) {
+            let loads = frames.loads[t];
+            for (let i = 0; i < loads.length; i++) {
+                let load = loads[i];
+                if (load === null || table.coordinates[i] === null) continue;
+                let width;
+                if (load < 0) {
+                    width = 10 * Math.abs(load / table.min[i]) + 3;
+                } else {
+                    width = 10 * load / table.max[i] + 3;
+                }
+                features.push({
+                    type: 'Feature',
+                    geometry: {type: 'MultiLineString', coordinates: [table.coordinates[i]]},
+                    properties: {
+                        id: table.ids[i],
+                        time: frames.times[t],
+                        load: load,
+                        stroke: table.stroke[i],
+                        pos: load >= 0,
+                        strokeWidth: width
+                    }
+                });
+            }
+        }
+        return {type: 'FeatureCollection', features: features};
+    },
+
     getTimeWindowFromServer: function() {
         // Obtain new date range.
-        socket.emit('get_windowed_simulation_data', this.startDate.toISOString(), this.endDate.toISOString(), (geojson_test) =>
+        socket.emit('get_windowed_simulation_data', this.startDate.toISOString(), this.endDate.toISOString(), (frames) =>
         {
-            if(data == "{}")
-            {
+            if (frames.times.length == 0) {
                 console.log("No data was available for the current time window.");
             }
-            console.log(data);
-            var data = JSON.parse(geojson_test);
+            var data = this.buildFeatures(frames);
 
             var geoJSONLayer = L.geoJSON(data, {
                 style: function(feature) {
@@ -199,8 +230,12 @@ class TimeDimension {
         show_loader();
         socket.emit('timedimension_initialize', function(result) {
             if (result) {
-                hide_loader();
-                time_dimension.addGeoJSONLayer();
+                // geometry and style of the assets, the frames of the time windows only contain their loads
+                socket.emit('timedimension_get_asset_table', function(asset_table) {
+                    hide_loader();
+                    time_dimension.asset_table = asset_table;
+                    time_dimension.addGeoJSONLayer();
+                });
             }
         });
     }
@@ -0,0 +1,97 @@
+/**
+ *  This work is based on original code developed and copyrighted by TNO 2020.
+ *  Subsequent contributions are licensed to you by the developers of such code and are
+ *  made available to the Project under one or several contributor license agreements.
+ *
+ *  This work is licensed to you under the Apache License, Version 2.0.
+ *  You may obtain a copy of the license at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ *  Contributors:
+ *      TNO         - Initial implementation
+ *  Manager:
+ *      TNO
+ */
+
+// ------------------------------------------------------------------------------------------------------------
+//  Viewport based loading of large energy systems
+//  The server doesn't send all objects of a large energy system, the objects in the viewport are requested when
+//  the map is moved. Below the cluster zoom level the server sends clusters of objects instead.
+// ------------------------------------------------------------------------------------------------------------
+var viewport_loading = {};      // es_id -> cluster zoom level, for all energy systems that are loaded per viewport
+var viewport_timer = null;
+
+function request_viewport_objects() {
+    let bounds = map.getBounds().pad(0.2);      // also load objects just outside the viewport
+    for (let es_id in viewport_loading) {
+        if (!(es_id in esdl_list)) {
+            delete viewport_loading[es_id];     // layer was removed
+            continue;
+        }
+        socket.emit('get_viewport_objects', {
+            'es_id': es_id,
+            'zoom': map.getZoom(),
+            'bounds': [[bounds.getSouth(), bounds.getWest()], [bounds.getNorth(), bounds.getEast()]]
+        });
+    }
+}
+
+function get_cluster_size(count) {
+    if (count < 10) return 30;
+    if (count < 1000) return 40;
+    return 50;
+}
+
+function add_viewport_listener(socket, map) {
+    socket.on('viewport_loading', function(message) {
+        let es_id = message['es_id'];
+        if (!message['enabled']) {
+            delete viewport_loading[es_id];
+            return;
+        }
+        viewport_loading[es_id] = message['cluster_zoom'];
+        if (message['bounds']) {
+            map.flyToBounds(message['bounds'], {padding: [50,50], animate: true});    // moveend requests the objects
+        } else {
+            request_viewport_objects();
+        }
+    });
+
+    socket.on('clear_viewport', function(message) {
+        let es_id = message['es_id'];
+        clear_layer = true;
+        clear_layers(es_id, 'esdl_layer');
+        clear_layers(es_id, 'bld_layer');
+        clear_layers(es_id, 'connection_layer');
+        clear_layer = false;
+    });
+
+    socket.on('add_clusters', function(message) {
+        let es_id = message['es_id'];
+        let cluster_list = message['cluster_list'];
+        let cluster_zoom = viewport_loading[es_id];
+
+        for (let i = 0; i < cluster_list.length; i++) {
+            let count = cluster_list[i][2];
+            let size = get_cluster_size(count);
+            let divicon = L.divIcon({
+                className: 'viewport-cluster',
+                html: '<div style="line-height:' + size + 'px">' + count + '</div>',
+                iconSize: [size, size]
+            });
+            let marker = L.marker([cluster_list[i][0], cluster_list[i][1]], {icon: divicon, title: count + ' objects'});
+            marker.on('click', function(e) {
+                map.setView(e.latlng, Math.min(map.getZoom() + 2, cluster_zoom));
+            });
+            add_object_to_layer(es_id, 'esdl_layer', marker);
+        }
+    });
+
+    map.on('moveend', function() {
+        if (jQuery.isEmptyObject(viewport_loading)) return;
+        // wait until the user stops moving the map
+        clearTimeout(viewport_timer);
+        viewport_timer = setTimeout(request_viewport_objects, 250);
+    });
+}
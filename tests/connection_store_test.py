@@ -0,0 +1,71 @@
+import pickle
+from src.connection_store import ConnectionStore
+
+
+def connection(from_asset, from_port, to_asset, to_port):
+    return {'from-port-id': from_port, 'from-port-carrier': None, 'from-asset-id': from_asset,
+            'from-asset-coord': (52.0, 5.0), 'to-port-id': to_port, 'to-port-carrier': None, 'to-asset-id': to_asset,
+            'to-asset-coord': (52.1, 5.1)}
+
+
+def ids(conns):
+    return sorted((c['from-port-id'], c['to-port-id']) for c in conns)
+
+
+if __name__ == '__main__':
+    # pipe1 connects producer and consumer, pipe2 connects consumer and storage
+    c1 = connection('producer', 'producer_out', 'pipe1', 'pipe1_in')
+    c2 = connection('pipe1', 'pipe1_in', 'producer', 'producer_out')
+    c3 = connection('pipe1', 'pipe1_out', 'consumer', 'consumer_in')
+    c4 = connection('consumer', 'consumer_out', 'pipe2', 'pipe2_in')
+    conn_list = ConnectionStore([c1, c2, c3])
+    conn_list.append(c4)
+    print(ids(conn_list))
+    if len(conn_list) != 4 or conn_list.to_list() != [c1, c2, c3, c4]:
+        raise Exception("Serious problem")
+
+    # add: lookup by asset and by port
+    if ids(conn_list.get_connections_for_asset('pipe1')) != ids([c1, c2, c3]):
+        raise Exception("Serious problem")
+    if ids(conn_list.get_connections_for_port('pipe1_in')) != ids([c1, c2]):
+        raise Exception("Serious problem")
+    if conn_list.get_connections_for_asset('unknown') != [] or conn_list.get_connections_for_port('unknown') != []:
+        raise Exception("Serious problem")
+
+    # update: the indexes follow a changed asset and port id
+    version = conn_list.version
+    conn_list.update_connection(c3, {'to-asset-id': 'consumer2', 'to-port-id': 'consumer2_in'})
+    if conn_list.get_connections_for_asset('consumer') != [c4]:
+        raise Exception("Serious problem")
+    if conn_list.get_connections_for_asset('consumer2') != [c3]:
+        raise Exception("Serious problem")
+    if conn_list.get_connections_for_port('consumer_in') != [] or \
+            conn_list.get_connections_for_port('consumer2_in') != [c3]:
+        raise Exception("Serious problem")
+    if conn_list.version == version:
+        raise Exception("Serious problem")
+
+    # remove by port: both directions of the connection between the two ports
+    removed = conn_list.remove_connections_between_ports('pipe1_in', 'producer_out')
+    print(ids(removed))
+    if ids(removed) != ids([c1, c2]) or conn_list.to_list() != [c3, c4]:
+        raise Exception("Serious problem")
+    if conn_list.get_connections_for_asset('producer') != [] or conn_list.get_connections_for_port('pipe1_in') != []:
+        raise Exception("Serious problem")
+
+    # remove by asset
+    removed = conn_list.remove_connections_for_asset('consumer2')
+    if removed != [c3] or conn_list.to_list() != [c4] or conn_list.get_connections_for_asset('pipe1') != []:
+        raise Exception("Serious problem")
+    conn_list.remove(c3)    # removing a connection twice is ignored
+    if len(conn_list) != 1:
+        raise Exception("Serious problem")
+
+    # the indexes are rebuilt when the store is unpickled (e.g. by the disk session backend)
+    restored = pickle.loads(pickle.dumps(conn_list))
+    if restored.to_list() != [c4] or restored.get_connections_for_port('pipe2_in') != restored.to_list():
+        raise Exception("Serious problem")
+
+    conn_list.clear()
+    if len(conn_list) != 0 or conn_list.by_asset or conn_list.by_port:
+        raise Exception("Serious problem")
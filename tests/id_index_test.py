@@ -0,0 +1,80 @@
+from esdl import esdl
+from esdl.esdl_handler import EnergySystemHandler, IdIndex
+from esdl.processing import ESDLAsset, ESDLEnergySystem
+
+
+if __name__ == '__main__':
+    esh = EnergySystemHandler()
+    es = esh.create_empty_energy_system('Id index test', '', 'Instance', 'Area')
+    area = es.instance[0].area
+    subarea = esdl.Area(id='subarea', name='subarea')
+    building = esdl.Building(id='building', name='building')
+    heatpump = esdl.HeatPump(id='heatpump', name='heatpump')
+    heatpump.port.append(esdl.InPort(id='heatpump_in'))
+    building.asset.append(heatpump)
+    subarea.asset.append(building)
+    potential = esdl.WindPotential(id='potential', name='potential')
+    subarea.potential.append(potential)
+    area.area.append(subarea)
+
+    id_index = IdIndex.get_for(es)
+    if IdIndex.get_for(heatpump) is not id_index:
+        raise Exception("Serious problem")
+    if id_index.get('heatpump_in') is not heatpump.port[0]:
+        raise Exception("Serious problem")
+    if ESDLAsset.find_asset(area, 'heatpump') is not heatpump or \
+            ESDLAsset.find_asset_and_container(area, 'heatpump') != (heatpump, building):
+        raise Exception("Serious problem")
+    if ESDLAsset.find_potential(area, 'potential') is not potential or \
+            ESDLEnergySystem.find_area(area, 'subarea') is not subarea:
+        raise Exception("Serious problem")
+    # objects are only found in the given container
+    if id_index.find_in(building, 'potential', esdl.Potential) is not None or \
+            ESDLAsset.find_asset(area, 'unknown') is not None:
+        raise Exception("Serious problem")
+    if ESDLAsset.find_asset_and_container(area, 'unknown') != (None, None):
+        raise Exception("Serious problem")
+
+    # add
+    pv = esdl.PVInstallation(id='pv', name='pv')
+    area.asset.append(pv)
+    if ESDLAsset.find_asset(area, 'pv') is not pv or id_index.find_in(subarea, 'pv', esdl.Asset) is not None:
+        raise Exception("Serious problem")
+
+    # move: the index still refers to a moved object
+    subarea.asset.append(pv)
+    if id_index.find_in(subarea, 'pv', esdl.Asset) is not pv:
+        raise Exception("Serious problem")
+    area.asset.append(heatpump)
+    if ESDLAsset.find_asset_and_container(area, 'heatpump') != (heatpump, area):
+        raise Exception("Serious problem")
+
+    # changed id
+    pv.id = 'pv2'
+    if id_index.get('pv') is not None or id_index.get('pv2') is not pv:
+        raise Exception("Serious problem")
+
+    # remove: a removed area is removed from the index with everything it contains
+    area.area.remove(subarea)
+    for obj_id in ('subarea', 'building', 'potential', 'pv2'):
+        if id_index.get(obj_id) is not None:
+            raise Exception("Serious problem")
+    if ESDLEnergySystem.find_area(area, 'subarea') is not None or ESDLAsset.find_asset(area, 'heatpump') is not heatpump:
+        raise Exception("Serious problem")
+    # objects that are changed after they are removed don't affect the index
+    pv.id = 'pv3'
+    if id_index.get('pv3') is not None:
+        raise Exception("Serious problem")
+
+    errors = esh.check_id_index(es.id)
+    print(errors)
+    if errors:
+        raise Exception("Serious problem")
+
+    # check_consistency() reports objects that are missing or that shouldn't be in the index
+    del id_index.objects['heatpump']
+    id_index.objects['removed'] = subarea
+    errors = id_index.check_consistency()
+    print(errors)
+    if len(errors) != 2:
+        raise Exception("Serious problem")
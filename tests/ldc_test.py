@@ -0,0 +1,47 @@
+import numpy as np
+from influxdb.resultset import ResultSet
+from src.ldc import LDCCache, LoadDurationCurve
+
+
+class QueryClient:
+    """Returns the same series (GROUP BY assetId) for every query and counts the queries"""
+    def __init__(self, series):
+        self.series = series
+        self.queries = 0
+
+    def query(self, query):
+        self.queries += 1
+        return ResultSet({'series': self.series})
+
+
+def series(asset_id, values):
+    return {'name': 'Results', 'tags': {'assetId': asset_id}, 'columns': ['time', 'allocationEnergy'],
+            'values': [[i, v] for i, v in enumerate(values)]}
+
+
+if __name__ == '__main__':
+    ldc = LoadDurationCurve.from_values(np.array([1.0, -2.0, 3.0, np.nan]))
+    print(ldc.to_list(), ldc.stats())
+    if ldc.to_list() != [3.0, 1.0, -2.0] or ldc.count != 3 or ldc.peak != 3.0 or ldc.total_negative != -2.0:
+        raise Exception("Serious problem")
+
+    # an asset of which all values are NULL has no curve: it is not returned and not cached
+    client = QueryClient([series('asset1', [1.0, 2.0, 3.0]), series('empty', [None, None]), series('asset2', [5.0])])
+    cache = LDCCache(10)
+    keys = {asset_id: ('db', 'sim', asset_id, 'allocationEnergy') for asset_id in ('asset1', 'empty', 'asset2')}
+    curves = cache.get_curves(keys, client, lambda asset_ids: 'query', 'allocationEnergy')
+    print(sorted(curves.keys()))
+    if sorted(curves.keys()) != ['asset1', 'asset2'] or curves['asset1'].to_list() != [3.0, 2.0, 1.0]:
+        raise Exception("Serious problem")
+    if cache.stats()['curves'] != 2 or any(curve is None for curve in cache.curves.values()):
+        raise Exception("Serious problem")
+
+    # cached curves are not queried again
+    curves = cache.get_curves({'asset2': keys['asset2']}, client, lambda asset_ids: 'query', 'allocationEnergy')
+    if client.queries != 1 or curves['asset2'].to_list() != [5.0]:
+        raise Exception("Serious problem")
+
+    # long series are downsampled, keeping the maximum and minimum
+    ldc = LoadDurationCurve.from_values(np.arange(8760, dtype=float))
+    if len(ldc.curve) != 220 or ldc.curve[0] != 8759.0 or ldc.curve[-1] != 0.0:
+        raise Exception("Serious problem")
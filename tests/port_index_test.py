@@ -0,0 +1,85 @@
+from esdl import esdl
+from esdl.esdl_handler import EnergySystemHandler
+
+
+def create_asset(asset_class, asset_id, geometry):
+    asset = asset_class(id=asset_id, name=asset_id, geometry=geometry)
+    asset.port.append(esdl.InPort(id=asset_id + '_in'))
+    asset.port.append(esdl.OutPort(id=asset_id + '_out'))
+    return asset
+
+
+def create_line(coordinates):
+    line = esdl.Line()
+    for lat, lon in coordinates:
+        line.point.append(esdl.Point(lat=lat, lon=lon))
+    return line
+
+
+if __name__ == '__main__':
+    esh = EnergySystemHandler()
+    es = esh.create_empty_energy_system('Port index test', '', 'Instance', 'Area')
+    area = es.instance[0].area
+    carrier = esdl.GasCommodity(id='gas', name='gas')
+    es.energySystemInformation = esdl.EnergySystemInformation(id='esi', carriers=esdl.Carriers(id='carriers'))
+    es.energySystemInformation.carriers.carrier.append(carrier)
+
+    producer = create_asset(esdl.GenericProducer, 'producer', esdl.Point(lat=52.0, lon=5.0))
+    pipe = create_asset(esdl.Pipe, 'pipe', create_line([(52.0, 5.0), (52.05, 5.05), (52.1, 5.1)]))
+    area.asset.append(producer)
+    area.asset.append(pipe)
+    producer.port[1].connectedTo.append(pipe.port[0])
+
+    port_index = esh.get_port_index(es.id)
+    info = port_index.get('pipe_in')
+    print({k: v for k, v in info.items() if k not in ('asset', 'port')})
+    if info['asset'] is not pipe or info['ordinal'] != 0 or info['coord'] != (52.0, 5.0):
+        raise Exception("Serious problem")
+    if port_index.get('pipe_out')['coord'] != (52.1, 5.1) or port_index.get('producer_out')['coord'] != (52.0, 5.0):
+        raise Exception("Serious problem")
+
+    # add: an asset in a building in a subarea
+    subarea = esdl.Area(id='subarea', name='subarea')
+    building = esdl.Building(id='building', name='building', geometry=esdl.Point(lat=52.2, lon=5.2))
+    consumer = create_asset(esdl.GenericConsumer, 'consumer', esdl.Point(lat=52.2, lon=5.2))
+    building.asset.append(consumer)
+    subarea.asset.append(building)
+    area.area.append(subarea)
+    info = port_index.get('consumer_in')
+    if info is None or info['asset'] is not consumer or info['building'] is not building:
+        raise Exception("Serious problem")
+
+    # changes of the carrier of a port and the geometry of an asset are picked up on the next lookup
+    pipe.port[0].carrier = carrier
+    if port_index.get('pipe_in')['carrier_id'] != 'gas':
+        raise Exception("Serious problem")
+    producer.geometry = esdl.Point(lat=51.9, lon=4.9)
+    pipe.geometry.point[0].lat = 51.9
+    pipe.geometry.point[0].lon = 4.9
+    if port_index.get('producer_out')['coord'] != (51.9, 4.9) or port_index.get('pipe_in')['coord'] != (51.9, 4.9):
+        raise Exception("Serious problem")
+
+    # move: an asset that is moved to another area is still indexed, with its building removed
+    area.asset.append(consumer)
+    info = port_index.get('consumer_out')
+    if info is None or info['asset'] is not consumer or info['building'] is not None:
+        raise Exception("Serious problem")
+
+    # remove: the ports of a removed asset, also of the assets in a removed area
+    area.asset.remove(producer)
+    if port_index.get('producer_in') is not None or port_index.get('producer_out') is not None:
+        raise Exception("Serious problem")
+    subarea.asset.append(consumer)
+    area.area.remove(subarea)
+    if port_index.get('consumer_in') is not None:
+        raise Exception("Serious problem")
+    if sorted(port_index.ports.keys()) != ['pipe_in', 'pipe_out']:
+        raise Exception("Serious problem")
+    print(sorted(port_index.ports.keys()))
+
+    # the index is consistent with an index that is built from scratch
+    esh.remove_port_index(es.id)
+    new_index = esh.get_port_index(es.id)
+    if {k: (v['asset'], v['coord'], v['carrier_id']) for k, v in new_index.ports.items()} != \
+            {k: (v['asset'], v['coord'], v['carrier_id']) for k, v in port_index.ports.items()}:
+        raise Exception("Serious problem")
@@ -0,0 +1,52 @@
+import time
+import numpy as np
+from utils.RDWGSConverter import RDWGSConverter
+from esdl.processing.ESDLGeometry import convert_mp_rd_to_wgs
+
+NUM_POINTS = 1000000
+
+if __name__ == '__main__':
+    converter = RDWGSConverter()
+    rng = np.random.default_rng(0)
+    rd = np.column_stack([rng.uniform(0, 300000, NUM_POINTS), rng.uniform(300000, 620000, NUM_POINTS)])
+    rd_list = rd.tolist()
+
+    start = time.perf_counter()
+    wgs_scalar = [converter.fromRdToWgs(p) for p in rd_list]
+    scalar_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    wgs_array = converter.fromRdToWgsArray(rd)
+    array_time = time.perf_counter() - start
+
+    print('RD -> WGS84 of {} points: scalar {:.2f}s, array {:.3f}s ({:.0f}x)'.format(NUM_POINTS, scalar_time,
+                                                                                    array_time,
+                                                                                    scalar_time / array_time))
+    max_diff = np.abs(np.array(wgs_scalar) - wgs_array).max()
+    print('Maximum difference: {}'.format(max_diff))
+    if max_diff > 1e-9:
+        raise Exception("Serious problem")
+
+    start = time.perf_counter()
+    rd_scalar = [converter.fromWgsToRd(p) for p in wgs_scalar]
+    scalar_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    rd_array = converter.fromWgsToRdArray(wgs_array)
+    array_time = time.perf_counter() - start
+
+    print('WGS84 -> RD of {} points: scalar {:.2f}s, array {:.3f}s ({:.0f}x)'.format(NUM_POINTS, scalar_time,
+                                                                                    array_time,
+                                                                                    scalar_time / array_time))
+    max_diff = np.abs(np.array(rd_scalar) - rd_array).max()
+    print('Maximum difference: {}'.format(max_diff))
+    if max_diff > 1e-9:
+        raise Exception("Serious problem")
+
+    # a multipolygon of 100 polygons with 10000 points each
+    mp = [[rd_list[i:i + 10000]] for i in range(0, NUM_POINTS, 10000)]
+    start = time.perf_counter()
+    convert_mp_rd_to_wgs(mp)
+    print('Multipolygon with {} points: {:.3f}s'.format(NUM_POINTS, time.perf_counter() - start))
+    if np.abs(np.array([p for polygon in mp for ring in polygon for p in ring]) - wgs_array).max() > 1e-9:
+        raise Exception("Serious problem")
@@ -0,0 +1,100 @@
+import os
+import tempfile
+import threading
+import time
+from esdl import esdl
+from esdl.esdl_handler import EnergySystemHandler
+from src.connection_store import ConnectionStore
+from src.session_store import DiskSession, DiskSessionBackend, MemorySessionBackend, SessionConflictError, \
+    modification_version
+
+SEPARATE_KEYS = ('esh', 'conn_list')
+
+
+if __name__ == '__main__':
+    # the version of the handler changes on every change of an energy system, without building a spatial index
+    esh = EnergySystemHandler()
+    es = esh.create_empty_energy_system('Session store test', '', 'Instance', 'Area')
+    version = modification_version(esh)
+    es.instance[0].area.asset.append(esdl.WindTurbine(id='windturbine', geometry=esdl.Point(lat=52.0, lon=5.0)))
+    if modification_version(esh) == version or esh.spatial_indices:
+        raise Exception("Serious problem")
+    version = modification_version(esh)
+    es.instance[0].area.asset[0].geometry.lat = 52.1
+    if modification_version(esh) == version:
+        raise Exception("Serious problem")
+    if modification_version([1, 2]) is not None:
+        raise Exception("Serious problem")
+
+    # values that are changed in place are written in the next flush
+    directory = tempfile.mkdtemp()
+    disk_session = DiskSession(directory, SEPARATE_KEYS)
+    disk_session['esh'] = esh
+    disk_session['conn_list'] = {es.id: ConnectionStore()}
+    disk_session['name'] = 'test'
+    disk_session.flush()
+    disk_session['esh'].get_energy_system(es.id).name = 'Changed'
+    disk_session['conn_list'][es.id].append({'from-port-id': 'a', 'from-asset-id': 'b', 'to-port-id': 'c',
+                                             'to-asset-id': 'd'})
+    disk_session.flush()
+    restored = DiskSession(directory, SEPARATE_KEYS)
+    if restored['esh'].get_energy_system(es.id).name != 'Changed' or len(restored['conn_list'][es.id]) != 1:
+        raise Exception("Serious problem")
+    if restored['name'] != 'test':
+        raise Exception("Serious problem")
+
+    # a locked session can't be changed by another process (a second backend on the same directory) until it is
+    # unlocked, so the read-modify-write of a request is never lost
+    directory = tempfile.mkdtemp()
+    backend1 = DiskSessionBackend(directory, 10, SEPARATE_KEYS)
+    backend2 = DiskSessionBackend(directory, 10, SEPARATE_KEYS)
+    backend1.create('client')['conn_list'] = 1
+    backend1.flush()
+
+    def increment(backend):
+        client_session = backend.lock_session('client')
+        client_session['conn_list'] = client_session['conn_list'] + 1
+        time.sleep(0.1)
+        backend.unlock_session(client_session)
+
+    threads = [threading.Thread(target=increment, args=(backend,)) for backend in (backend1, backend2, backend1)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if backend2.lock_session('client')['conn_list'] != 4:
+        raise Exception("Serious problem")
+    backend2.unlock_session(backend2.get('client'))
+
+    # without the lock, a conflicting write of a separate key is an error instead of being discarded silently
+    session1 = DiskSession(os.path.join(directory, 'client'), SEPARATE_KEYS)
+    session2 = DiskSession(os.path.join(directory, 'client'), SEPARATE_KEYS)
+    session1['conn_list'] = session2['conn_list'] = 0
+    session1['conn_list'] = 5
+    session1.flush()
+    session2['conn_list'] = 6
+    try:
+        session2._write('conn_list', {'conn_list'})
+        raise Exception("Serious problem")
+    except SessionConflictError as e:
+        print(e)
+    if session2['conn_list'] != 5:
+        raise Exception("Serious problem")
+
+    # sessions are not evicted if they cannot be spilled to disk
+    backend = MemorySessionBackend(memory_budget=1, separate_keys=SEPARATE_KEYS)
+    for client_id in ('client1', 'client2'):
+        backend.create(client_id)['value'] = 'x' * 1000
+    backend.flush()
+    if sorted(backend.client_ids()) != ['client1', 'client2'] or backend.evictions != 0:
+        raise Exception("Serious problem")
+
+    # spilled sessions are loaded again when they are accessed
+    backend = MemorySessionBackend(memory_budget=1, spill_directory=tempfile.mkdtemp(), separate_keys=SEPARATE_KEYS)
+    for client_id in ('client1', 'client2'):
+        backend.create(client_id)['value'] = client_id
+    backend.flush()
+    if backend.evictions != 1 or 'client1' not in backend.spilled:
+        raise Exception("Serious problem")
+    if backend.get('client1')['value'] != 'client1':
+        raise Exception("Serious problem")
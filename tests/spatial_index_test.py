@@ -0,0 +1,70 @@
+from esdl import esdl
+from esdl.esdl_handler import EnergySystemHandler
+from esdl.processing import ESDLGeometry
+from src.shape import Shape
+
+
+def create_polygon(coordinates):
+    return Shape.create([[{'lat': lat, 'lng': lon} for lat, lon in coordinates]]).get_esdl()
+
+
+if __name__ == '__main__':
+    esh = EnergySystemHandler()
+    es = esh.create_empty_energy_system('Spatial index test', '', 'Instance', 'Area')
+    area = es.instance[0].area
+    subarea = esdl.Area(id='subarea', name='subarea',
+                        geometry=create_polygon([(52.0, 5.0), (52.0, 5.5), (52.5, 5.5), (52.5, 5.0)]))
+    area.area.append(subarea)
+    windturbine = esdl.WindTurbine(id='windturbine', geometry=esdl.Point(lat=52.1, lon=5.1))
+    subarea.asset.append(windturbine)
+    pipe = esdl.Pipe(id='pipe', geometry=esdl.Line())
+    ESDLGeometry.create_points(pipe.geometry, [5.2, 5.3, 5.4], [52.2, 52.2, 52.3], 2)
+    subarea.asset.append(pipe)
+    building = esdl.Building(id='building', geometry=esdl.Point(lat=53.0, lon=6.0))
+    area.asset.append(building)
+
+    spatial_index = esh.get_spatial_index(es.id)
+    print(spatial_index.bounds())
+    if spatial_index.bounds() != (5.0, 52.0, 6.0, 53.0):
+        raise Exception("Serious problem")
+    if set(spatial_index.query_bbox(5.05, 52.05, 5.15, 52.15)) != {subarea, windturbine}:
+        raise Exception("Serious problem")
+    if spatial_index.query_bbox(5.05, 52.05, 5.15, 52.15, types=esdl.EnergyAsset) != [windturbine]:
+        raise Exception("Serious problem")
+    if set(spatial_index.query_within(subarea.geometry, types=esdl.EnergyAsset)) != {windturbine, pipe}:
+        raise Exception("Serious problem")
+    if spatial_index.query_containing(5.1, 52.1, types=esdl.Area) != [subarea]:
+        raise Exception("Serious problem")
+    if spatial_index.nearest(5.25, 52.21, types=esdl.EnergyAsset) is not pipe or \
+            spatial_index.nearest(7.0, 54.0, max_distance=0.1) is not None:
+        raise Exception("Serious problem")
+
+    # geometry changes: a new point, a changed point of a line and a moved building
+    version = spatial_index.version
+    windturbine.geometry = esdl.Point(lat=52.45, lon=5.45)
+    pipe.geometry.point[0].lon = 5.15
+    building.geometry = esdl.Point(lat=52.4, lon=5.1)
+    if spatial_index.version == version:
+        raise Exception("Serious problem")
+    if spatial_index.query_bbox(5.05, 52.05, 5.15, 52.15, types=esdl.EnergyAsset) != []:
+        raise Exception("Serious problem")
+    if spatial_index.query_bbox(5.4, 52.4, 5.5, 52.5, types=esdl.EnergyAsset) != [windturbine]:
+        raise Exception("Serious problem")
+    if spatial_index.query_bbox(5.14, 52.19, 5.16, 52.21, types=esdl.EnergyAsset) != [pipe]:
+        raise Exception("Serious problem")
+    if spatial_index.nearest(5.1, 52.4, types=esdl.AbstractBuilding) is not building:
+        raise Exception("Serious problem")
+    if spatial_index.bounds() != (5.0, 52.0, 5.5, 52.5):
+        raise Exception("Serious problem")
+
+    # added and removed objects
+    pv = esdl.PVInstallation(id='pv', geometry=esdl.Point(lat=52.3, lon=5.3))
+    subarea.asset.append(pv)
+    subarea.asset.remove(windturbine)
+    assets = spatial_index.query_within(subarea.geometry, types=esdl.EnergyAsset)
+    print([asset.id for asset in assets])
+    if set(assets) != {pipe, pv}:
+        raise Exception("Serious problem")
+    area.area.remove(subarea)
+    if spatial_index.query_bbox(4.0, 51.0, 7.0, 54.0) != [building]:
+        raise Exception("Serious problem")
@@ -0,0 +1,83 @@
+import json
+import time
+import numpy as np
+from geojson import Feature, MultiLineString, FeatureCollection, dumps
+from math import fabs
+from esdl import esdl
+from extensions.time_dimension import build_asset_table, build_frames
+from src.time_dimension_data import SimulationData
+
+NUM_CONDUCTORS = 5000
+NUM_STEPS = 96
+ES_ID = 'es'
+CARRIERS = ['elec', 'gas', 'h2']
+
+
+def create_conductors(rng):
+    conductors = dict()
+    for i in range(NUM_CONDUCTORS):
+        line = esdl.Line()
+        for p in rng.uniform([4.0, 51.0], [6.0, 53.0], (2, 2)):
+            line.point.append(esdl.Point(lon=p[0], lat=p[1]))
+        conductors['c{}'.format(i)] = esdl.ElectricityCable(id='c{}'.format(i), geometry=line)
+    return conductors
+
+
+def geojson_frames(data, conductors, colors, boundaries):
+    """The frames as they were generated before: a geojson feature with geometry and style per asset and time step"""
+    feature_list = []
+    for t, values in zip(data.times, data.values.T):
+        time_str = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(int(t)))
+        for index, value in enumerate(values.tolist()):
+            asset = conductors[data.asset_ids[index]]
+            min_en, max_en = boundaries[data.networks[index]]
+            coordinates = [[(asset.geometry.point.items[0].lon, asset.geometry.point.items[0].lat),
+                            (asset.geometry.point.items[1].lon, asset.geometry.point.items[1].lat)]]
+            feature = Feature(geometry=MultiLineString(coordinates))
+            feature['properties']['id'] = data.asset_ids[index]
+            feature['properties']['time'] = time_str
+            feature['properties']['load'] = value
+            feature['properties']['stroke'] = colors[ES_ID + data.carriers[index]]["color"]
+            if value < 0:
+                feature['properties']['pos'] = False
+                feature['properties']['strokeWidth'] = 10 * fabs(value / min_en) + 3
+            else:
+                feature['properties']['pos'] = True
+                feature['properties']['strokeWidth'] = 10 * value / max_en + 3
+            feature_list.append(feature)
+    return dumps(FeatureCollection(feature_list))
+
+
+if __name__ == '__main__':
+    rng = np.random.default_rng(0)
+    conductors = create_conductors(rng)
+    colors = {ES_ID + carrier: {'color': '#{:06x}'.format(i * 0x333333)} for i, carrier in enumerate(CARRIERS)}
+    times = 1420066800 + 900 * np.arange(NUM_STEPS)
+    series = [(asset_id, CARRIERS[i % 3] + '_network', CARRIERS[i % 3], times, rng.normal(0, 100, NUM_STEPS))
+              for i, asset_id in enumerate(conductors)]
+    data = SimulationData.from_series(series)
+    boundaries = data.boundaries()
+
+    start = time.perf_counter()
+    old_payload = geojson_frames(data, conductors, colors, boundaries)
+    old_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    table_payload = json.dumps(build_asset_table(data, conductors.get, colors, ES_ID, boundaries))
+    table_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    new_payload = json.dumps(build_frames(data.window(times[0], times[-1] + 900)))
+    new_time = time.perf_counter() - start
+
+    print('{} conductors x {} steps'.format(NUM_CONDUCTORS, NUM_STEPS))
+    print('geojson frames: {:.2f}s, {:.1f} MB'.format(old_time, len(old_payload) / 1e6))
+    print('asset table (once per simulation): {:.3f}s, {:.1f} MB'.format(table_time, len(table_payload) / 1e6))
+    print('frames: {:.3f}s, {:.1f} MB ({:.0f}x faster, {:.0f}x smaller)'.format(
+        new_time, len(new_payload) / 1e6, old_time / new_time, len(old_payload) / len(new_payload)))
+
+    frames = json.loads(new_payload)
+    features = json.loads(old_payload)['features']
+    loads = np.array([f['properties']['load'] for f in features]).reshape(NUM_STEPS, NUM_CONDUCTORS)
+    if np.abs(loads - np.array(frames['loads'])).max() > 1e-3:
+        raise Exception("Serious problem")
@@ -15,62 +15,135 @@
 # Formules voor benadering zijn gebaseerd op http://www.dekoepel.nl/pdf/Transformatieformules.pdf
 # Bovenstaande link werkt helaas niet meer, daar Stiching de Koepel opgeheven is. Backup link: http://media.thomasv.nl/2015/07/Transformatieformules.pdf
 
+import numpy as np
+
+
 class RDWGSConverter:
     X0 = 155000
     Y0 = 463000
     phi0 = 52.15517440
     lam0 = 5.38720621
 
-    def fromRdToWgs(self, coords):
+    # RD -> WGS84
+    Kp = [0, 2, 0, 2, 0, 2, 1, 4, 2, 4, 1]
+    Kq = [1, 0, 2, 1, 3, 2, 0, 0, 3, 1, 1]
+    Kpq = [3235.65389, -32.58297, -0.24750, -0.84978, -0.06550, -0.01709, -0.00738, 0.00530, -0.00039, 0.00033,
+           -0.00012]
+
+    Lp = [1, 1, 1, 3, 1, 3, 0, 3, 1, 0, 2, 5]
+    Lq = [0, 1, 2, 0, 3, 1, 1, 2, 4, 2, 0, 0]
+    Lpq = [5260.52916, 105.94684, 2.45656, -0.81885, 0.05594, -0.05607, 0.01199, -0.00256, 0.00128, 0.00022,
+           -0.00022, 0.00026]
 
-        Kp = [0, 2, 0, 2, 0, 2, 1, 4, 2, 4, 1]
-        Kq = [1, 0, 2, 1, 3, 2, 0, 0, 3, 1, 1]
-        Kpq = [3235.65389, -32.58297, -0.24750, -0.84978, -0.06550, -0.01709, -0.00738, 0.00530, -0.00039, 0.00033,
-               -0.00012]
+    # WGS84 -> RD
+    Rp = [0, 1, 2, 0, 1, 3, 1, 0, 2]
+    Rq = [1, 1, 1, 3, 0, 1, 3, 2, 3]
+    Rpq = [190094.945, -11832.228, -114.221, -32.391, -0.705, -2.340, -0.608, -0.008, 0.148]
 
-        Lp = [1, 1, 1, 3, 1, 3, 0, 3, 1, 0, 2, 5]
-        Lq = [0, 1, 2, 0, 3, 1, 1, 2, 4, 2, 0, 0]
-        Lpq = [5260.52916, 105.94684, 2.45656, -0.81885, 0.05594, -0.05607, 0.01199, -0.00256, 0.00128, 0.00022,
-               -0.00022, 0.00026]
+    Sp = [1, 0, 2, 1, 3, 0, 2, 1, 0, 1]
+    Sq = [0, 2, 0, 2, 0, 1, 2, 1, 4, 4]
+    Spq = [309056.544, 3638.893, 73.077, -157.984, 59.788, 0.433, -6.439, -0.032, 0.092, -0.054]
 
+    def fromRdToWgs(self, coords):
         dX = 1E-5 * (coords[0] - self.X0)
         dY = 1E-5 * (coords[1] - self.Y0)
 
         phi = 0
         lam = 0
 
-        for k in range(len(Kpq)):
-            phi = phi + (Kpq[k] * dX ** Kp[k] * dY ** Kq[k])
+        for k in range(len(self.Kpq)):
+            phi = phi + (self.Kpq[k] * dX ** self.Kp[k] * dY ** self.Kq[k])
         phi = self.phi0 + phi / 3600
 
-        for l in range(len(Lpq)):
-            lam = lam + (Lpq[l] * dX ** Lp[l] * dY ** Lq[l])
+        for l in range(len(self.Lpq)):
+            lam = lam + (self.Lpq[l] * dX ** self.Lp[l] * dY ** self.Lq[l])
         lam = self.lam0 + lam / 3600
 
         return [phi, lam]
 
     def fromWgsToRd(self, coords):
-
-        Rp = [0, 1, 2, 0, 1, 3, 1, 0, 2]
-        Rq = [1, 1, 1, 3, 0, 1, 3, 2, 3]
-        Rpq = [190094.945, -11832.228, -114.221, -32.391, -0.705, -2.340, -0.608, -0.008, 0.148]
-
-        Sp = [1, 0, 2, 1, 3, 0, 2, 1, 0, 1]
-        Sq = [0, 2, 0, 2, 0, 1, 2, 1, 4, 4]
-        Spq = [309056.544, 3638.893, 73.077, -157.984, 59.788, 0.433, -6.439, -0.032, 0.092, -0.054]
-
         dPhi = 0.36 * (coords[0] - self.phi0)
         dLam = 0.36 * (coords[1] - self.lam0)
 
         X = 0
         Y = 0
 
-        for r in range(len(Rpq)):
-            X = X + (Rpq[r] * dPhi ** Rp[r] * dLam ** Rq[r])
+        for r in range(len(self.Rpq)):
+            X = X + (self.Rpq[r] * dPhi ** self.Rp[r] * dLam ** self.Rq[r])
         X = self.X0 + X
 
-        for s in range(len(Spq)):
-            Y = Y + (Spq[s] * dPhi ** Sp[s] * dLam ** Sq[s])
+        for s in range(len(self.Spq)):
+            Y = Y + (self.Spq[s] * dPhi ** self.Sp[s] * dLam ** self.Sq[s])
         Y = self.Y0 + Y
 
-        return [X, Y]
\ No newline at end of file
+        return [X, Y]
+
+    # -----------------------------------------------------------------------------------------------------------------
+    #  Batch conversion of arrays of points, with the same results as the conversion of single points
+    # -----------------------------------------------------------------------------------------------------------------
+    @staticmethod
+    def _polynomial(coef, p, q, a, b):
+        # the powers of a and b are calculated once for all terms of the polynomial, with ** (like the conversion of
+        # single points) instead of repeated multiplication, such that the results are the same
+        a_powers = [a ** i for i in range(max(p) + 1)]
+        b_powers = [b ** j for j in range(max(q) + 1)]
+
+        result = np.zeros_like(a)
+        for c, i, j in zip(coef, p, q):
+            result += c * a_powers[i] * b_powers[j]
+        return result
+
+    def fromRdToWgsArray(self, coords):
+        """
+        Converts an array of RD points to WGS84
+        :param coords: array-like of shape (n, 2) with [x, y] points
+        :return: numpy array of shape (n, 2) with [lat, lon] points
+        """
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        dX = 1E-5 * (coords[:, 0] - self.X0)
+        dY = 1E-5 * (coords[:, 1] - self.Y0)
+
+        result = np.empty_like(coords)
+        result[:, 0] = self.phi0 + self._polynomial(self.Kpq, self.Kp, self.Kq, dX, dY) / 3600
+        result[:, 1] = self.lam0 + self._polynomial(self.Lpq, self.Lp, self.Lq, dX, dY) / 3600
+        return result
+
+    def fromWgsToRdArray(self, coords):
+        """
+        Converts an array of WGS84 points to RD
+        :param coords: array-like of shape (n, 2) with [lat, lon] points
+        :return: numpy array of shape (n, 2) with [x, y] points
+        """
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        dPhi = 0.36 * (coords[:, 0] - self.phi0)
+        dLam = 0.36 * (coords[:, 1] - self.lam0)
+
+        result = np.empty_like(coords)
+        result[:, 0] = self.X0 + self._polynomial(self.Rpq, self.Rp, self.Rq, dPhi, dLam)
+        result[:, 1] = self.Y0 + self._polynomial(self.Spq, self.Sp, self.Sq, dPhi, dLam)
+        return result
+
+    def fromRdToWgsRings(self, rings):
+        """
+        Converts a list of rings (lists of RD points) to WGS84 in one batch, e.g. the rings of a polygon
+        :return: list of rings with [lat, lon] points
+        """
+        return self._convert_rings(rings, self.fromRdToWgsArray)
+
+    def fromWgsToRdRings(self, rings):
+        """Converts a list of rings (lists of [lat, lon] points) to RD in one batch"""
+        return self._convert_rings(rings, self.fromWgsToRdArray)
+
+    @staticmethod
+    def _convert_rings(rings, convert):
+        lengths = [len(ring) for ring in rings]
+        points = [point[:2] for ring in rings for point in ring]
+        if not points:
+            return [[] for _ in rings]
+        converted = convert(points).tolist()
+        result = []
+        start = 0
+        for length in lengths:
+            result.append(converted[start:start + length])
+            start += length
+        return result